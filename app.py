@@ -1,111 +1,314 @@
 import streamlit as st
-from pdb import set_trace
 from utils.import_secrets import import_secrets
 import_secrets()
 
-from utils.google_utils import get_google_credentials, get_events, load_token
-from utils.twilio_utils import send_twilio_message
+from utils.google_utils import get_google_credentials, get_shared_credentials, sanitize_phone, iter_appointments, GOOGLE_CALENDAR_IDS
+from utils.resolution_memo import set_override, list_overrides, remove_entry, memo_key
+from utils.pipeline import run_pipeline
+from utils.plans import load_plan, refresh_plan, plan_dir, plan_appointments, plan_render, describe
+from utils.outbox import enqueue, enqueue_stream, start_background_drain, get_states, count_states, outbox_key
+from utils.status_webhook import start_status_server
+from utils import tracing, event_store
+from utils.date_utils import format_italian_datetime, format_italian_day, parse_local_datetime
+from utils.messages import load_engine
 
-from datetime import datetime, timedelta
+import os
+from itertools import groupby
+from datetime import date, datetime, timedelta
 from zoneinfo import ZoneInfo
 
-ITALIAN_MONTHS = [
-    "Gennaio", "Febbraio", "Marzo", "Aprile", "Maggio", "Giugno",
-    "Luglio", "Agosto", "Settembre", "Ottobre", "Novembre", "Dicembre",
-]
-
-def format_italian_datetime(iso_dt: str, tz: str = "Europe/Rome") -> str:
-    if iso_dt.endswith("Z"):
-        iso_dt = iso_dt[:-1] + "+00:00"
-    dt = datetime.fromisoformat(iso_dt)
-    local_dt = dt.astimezone(ZoneInfo(tz))
-    today = datetime.now(ZoneInfo(tz)).date()
-    tomorrow = today + timedelta(days=1)
-    local_date = local_dt.date()
-    day = local_dt.day
-    month_name = ITALIAN_MONTHS[local_dt.month - 1]
-    time_str = local_dt.strftime("%H:%M")
-    if local_date == tomorrow:
-        return f"Domani {day} {month_name} alle {time_str}"
-    else:
-        return f"{day} {month_name} alle {time_str}"
+# where the number of each patient comes from (appointment["phone_source"])
+PHONE_SOURCES = {"titolo": "titolo dell'evento", "descrizione": "descrizione dell'evento",
+                 "rubrica": "rubrica Google", "correzione": "correzione manuale"}
+
+def candidate_label(candidate):
+    return f"{candidate['name']} ({candidate['phone'] or 'senza numero'}, {candidate['score']:.0%})"
+
+def _change_note(change):
+    if change is None:
+        return ""
+    if change["kind"] == event_store.ADDED:
+        return " 🆕 _nuovo_"
+    if change["kind"] == event_store.MOVED:
+        return f" 🔁 _spostato, prima: {format_italian_datetime(change['old_start'])}_"
+    return ""
 
-def extract_time_hhmm(iso_dt: str, tz: str = "Europe/Rome") -> str:
-    if iso_dt.endswith("Z"):
-        iso_dt = iso_dt[:-1] + "+00:00"
-    dt = datetime.fromisoformat(iso_dt)
-    local_dt = dt.astimezone(ZoneInfo(tz))
-    return local_dt.strftime("%H:%M")
+def _gone_lines(gone):
+    return "\n".join("- ~~{summary}~~: {time} _({what})_".format(
+        summary=c["summary"] or "senza titolo", time=format_italian_datetime(c["old_start"]),
+        what="annullato" if c["kind"] == event_store.CANCELLED else "spostato a " + format_italian_datetime(c["new_start"]))
+        for c in gone)
 
-def format_italian_date_time(iso_dt: str, tz: str = "Europe/Rome") -> str:
+def _gone_by_day(changes):
+    """Cancelled and moved appointments by the day they were on (ISO date)."""
+    gone = {}
+    for c in (changes or {}).values():
+        if not c["old_start"] or c["kind"] == event_store.ADDED:
+            continue
+        old_day = parse_local_datetime(c["old_start"]).date().isoformat()
+        if c["kind"] == event_store.MOVED and parse_local_datetime(c["new_start"]).date().isoformat() == old_day:
+            continue  # same day: already marked in the list
+        gone.setdefault(old_day, []).append(c)
+    return gone
+
+def iter_summary_sections(events_list, changes=None):
     """
-    Convert an ISO datetime string with offset to a string like:
-      "*11 ottobre* alle ore *15:00*"
+    One markdown section per day; events_list is in start order (a list or a stream).
+    changes: {(calendar_id, event_id): change} from the calendar store, highlighted in the list.
     """
-    # Handle UTC 'Z' suffix
-    if iso_dt.endswith("Z"):
-        iso_dt = iso_dt[:-1] + "+00:00"
-
-    dt = datetime.fromisoformat(iso_dt)
-    local_dt = dt.astimezone(ZoneInfo(tz))
-
-    day = local_dt.day
-    month_name = ITALIAN_MONTHS[local_dt.month - 1]
-    time_str = local_dt.strftime("%H:%M")
-
-    return f"*{day} {month_name}* alle ore *{time_str}*"
-
-def create_appointment_summary(events_list):
-    events_string = "\n".join(["- **{event_name}**: {time}".format(
-        event_name=each["event_name"],
-        time = format_italian_datetime(each["start"])) for each in events_list])
-    appointments_list = [each for each in events_list if each["phone"]]
-    appointments = "\n".join(["- **{name}**: {time}".format(
-        name=each["name"],
-        time = format_italian_datetime(each["start"])) for each in appointments_list])
-    return f"""Per domani sono presenti questi eventi all'interno della categoria "Lavoro":
-{events_string}
+    gone = _gone_by_day(changes)
+    for day, day_events in groupby(events_list, key=lambda each: each["day"]):
+        day_events = list(day_events)
+        times = {id(each): format_italian_datetime(each["start"]) for each in day_events}  # once per event
+        events_string = "\n".join(["- **{event_name}**: {time}{note}".format(
+            event_name=each["event_name"],
+            time=times[id(each)],
+            note=_change_note(changes.get((each["calendar_id"], each["event_id"]))) if changes else "") for each in day_events])
+        appointments_list = [each for each in day_events if each["phone"]]
+        appointments = "\n".join(["- **{name}**: {time} _(numero da {source})_".format(
+            name=each["name"],
+            time=times[id(each)],
+            source=PHONE_SOURCES.get(each.get("phone_source"), "rubrica")) for each in appointments_list]) or "- nessuno"
+        to_review = [each for each in day_events if each.get("review")]
+        review_string = ("\n\nDa verificare (contatto incerto, nessun messaggio finché non lo confermi):\n" + "\n".join(
+            "- **{event_name}**: {candidates}".format(
+                event_name=each["event_name"],
+                candidates=", ".join(candidate_label(c) for c in each["review"])) for each in to_review)) if to_review else ""
+        day_gone = gone.pop(day, None)
+        gone_string = f"\n\nAnnullati o spostati dall'ultimo controllo:\n{_gone_lines(day_gone)}" if day_gone else ""
+        yield f"""#### {format_italian_day(date.fromisoformat(day))}
+Eventi all'interno della categoria "Lavoro":
+{events_string}{gone_string}
 
 Il messaggio verrà inviato a questi pazienti:
-{appointments}
+{appointments}{review_string}
 """
 
+def create_appointment_summary(events_list, changes=None):
+    # one section per day, in calendar order
+    events_list = sorted(events_list, key=lambda each: each["day"])
+    sections = list(iter_summary_sections(events_list, changes))
+    # days left without appointments: only the cancellations are left to show
+    days_shown = {each["day"] for each in events_list}
+    for day, gone in sorted(_gone_by_day(changes).items()):
+        if day not in days_shown:
+            sections.append(f"#### {format_italian_day(date.fromisoformat(day))}\n"
+                            f"Annullati o spostati dall'ultimo controllo:\n{_gone_lines(gone)}\n")
+    return "\n".join(sections)
+
+def calendar_changes(days):
+    """
+    Appointments added, moved or cancelled on `days` since the last check (utils/event_store.py),
+    marked as seen: each change is highlighted once.
+    """
+    if not event_store.EVENT_STORE:
+        return None
+    wanted = {d.isoformat() for d in days}
+    changes = {}
+    for c in event_store.pending_changes(GOOGLE_CALENDAR_IDS, event_store.EVENTS_FILE):
+        starts = [c["old_start"], c["new_start"]]
+        if any(s and parse_local_datetime(s).date().isoformat() in wanted for s in starts):
+            changes[(c["calendar_id"], c["event_id"])] = c
+    if changes:
+        event_store.mark_seen(list(changes.values()), event_store.EVENTS_FILE)
+    return changes
+
+def selected_days():
+    """Date range picker plus the option to leave out single days (e.g. the Sunday of a long weekend)."""
+    tomorrow = datetime.now(ZoneInfo("Europe/Rome")).date() + timedelta(days=1)
+    picked = st.date_input("Giorni per cui inviare il promemoria", value=(tomorrow, tomorrow), format="DD/MM/YYYY")
+    if not isinstance(picked, (tuple, list)):
+        picked = (picked,)
+    if not picked:
+        return [tomorrow]
+    start, end = picked[0], picked[-1]
+    days = [start + timedelta(days=i) for i in range((end - start).days + 1)]
+    if len(days) > 1:
+        days = st.multiselect("Giorni inclusi", days, default=days, format_func=format_italian_day)
+    return days
+
 st.title("Invia un messaggio di reminder a tutti i pazienti di domani")
 
+days = selected_days()
+
+# Timing panel: tracing costs (almost) nothing while this is off. Each session has its own
+# collector: the process is shared, a search here must not clear another session's spans
+if st.sidebar.checkbox("Misura i tempi di esecuzione", key="tracing"):
+    if "trace" not in st.session_state:
+        st.session_state["trace"] = tracing.Collector()
+    tracing.use(st.session_state["trace"])
+else:
+    tracing.use(None)
+
+# Streaming mode (clinic groups, long ranges): appointments are shown day by day and never
+# kept in the session; sending reads the calendar again (cheap: contacts and memo are cached)
+streaming = st.sidebar.checkbox("Calendari molto grandi (streaming)", key="streaming")
+
 # === Initialize session_state keys only once (do NOT overwrite them on every run) ===
-if "google_credentials" not in st.session_state:
-    creds = load_token()
-    st.session_state["google_credentials"] = creds
 if "appointments" not in st.session_state:
     st.session_state["appointments"] = None
 if "last_summary" not in st.session_state:
     st.session_state["last_summary"] = None
+if "outbox_keys" not in st.session_state:
+    st.session_state["outbox_keys"] = []
+if "stream_days" not in st.session_state:
+    st.session_state["stream_days"] = None       # days found in streaming mode, not sent yet
+if "stream_sent_days" not in st.session_state:
+    st.session_state["stream_sent_days"] = None  # days sent in streaming mode (status by day)
+if "stream_shown" not in st.session_state:
+    st.session_state["stream_shown"] = None      # reminders shown in the streaming summary (only these are sent)
+if "plan" not in st.session_state:
+    st.session_state["plan"] = None              # (plan dir, version, description) of the plan shown
+if "calendar_changes" not in st.session_state:
+    st.session_state["calendar_changes"] = None  # calendar changes highlighted in the summary
+if "plans_sent" not in st.session_state:
+    st.session_state["plans_sent"] = []          # "dir#version" already confirmed, not offered again
+
+def shown_key(each):
+    # the same appointment going to the same number as in the summary the practitioner read
+    return f"{outbox_key(each.get('event_id') or each['event_name'], each['start'])}|{each['phone']}"
+
+def render_reminder(each):
+    # template and language per appointment (utils/messages.py), rendered once per slot
+    return load_engine().render(each)
 
 # Button to fetch contacts
-if st.button("Trova contatti a cui inviare il messaggio", key="find_contacts"):
-    # if no creds in session, fetch them and store
-    if not st.session_state["google_credentials"]:
+find = st.button("Trova contatti a cui inviare il messaggio", key="find_contacts", disabled=not days)
+if find:
+    if st.session_state.get("trace"):
+        st.session_state["trace"].reset()  # this session's spans only
+    # credentials are shared by all sessions of the process (refreshed once, see google_utils);
+    # only go through the sign-in when there are none yet
+    creds = get_shared_credentials()
+    if not creds:
         with st.spinner("Authenticating with Google..."):
             creds = get_google_credentials()
-        st.session_state["google_credentials"] = creds
+    st.session_state["plan"] = None  # computed now: the ready plan is not what is shown anymore
+
+if find and streaming:
+    counts = {"appointments": 0, "with_phone": 0}
+    shown = set()
+
+    def counted(stream):
+        for each in stream:
+            counts["appointments"] += 1
+            if each.phone:
+                counts["with_phone"] += 1
+                shown.add(shown_key(each))
+            yield each
+
+    # each day is written as soon as the stream moves on to the next one
+    for section in iter_summary_sections(counted(iter_appointments(creds, days=days))):
+        st.markdown(section)
+    st.session_state["appointments"] = None
+    if not counts["appointments"]:
+        st.write("Non ho trovato nessun paziente per i giorni selezionati")
+        st.session_state["stream_days"] = None
     else:
-        creds = st.session_state["google_credentials"]
+        st.write(f"Pazienti con un numero: {counts['with_phone']} su {counts['appointments']} appuntamenti")
+        st.session_state["stream_days"] = [d.isoformat() for d in days]
+    st.session_state["stream_shown"] = shown
+elif find:
+    # fetch events and resolve contacts as the calendar pages arrive, showing them as we go
+    bar = st.progress(0.0, text="Leggo il calendario...")
+    found_box = st.empty()
+
+    def on_progress(progress, appointment):
+        if progress["events"]:
+            bar.progress(progress["resolved"] / progress["events"],
+                         text=f"Contatti trovati: {progress['with_phone']} / {progress['resolved']} appuntamenti controllati")
+        if appointment is not None and appointment["phone"]:
+            found_box.markdown(f"Ultimo trovato: **{appointment['name']}** ({format_italian_datetime(appointment['start'])})")
 
-    # fetch events and store them in session_state
-    appointments = get_events(creds)
+    appointments, _ = run_pipeline(creds, days=days, on_progress=on_progress)
+    bar.empty()
+    found_box.empty()
     st.session_state["appointments"] = appointments
+    st.session_state["stream_days"] = None
+    changes = st.session_state["calendar_changes"] = calendar_changes(days)
 
     if not appointments:
-        st.write("Non ho trovato nessun paziente per domani")
+        st.write("Non ho trovato nessun paziente per i giorni selezionati")
         st.session_state["last_summary"] = None
+        if changes:
+            st.markdown(create_appointment_summary([], changes))
     else:
-        summary = create_appointment_summary(appointments)
+        summary = create_appointment_summary(appointments, changes)
         st.session_state["last_summary"] = summary
         st.write(summary)
 
+def show_plan(plan):
+    st.session_state["plan"] = (plan_dir(days), plan["version"], describe(plan))
+    st.session_state["calendar_changes"] = None
+    st.session_state["appointments"] = plan_appointments(plan) or None
+    st.session_state["last_summary"] = create_appointment_summary(st.session_state["appointments"] or [])
+
+# Plan prepared in advance (osteopatia_reminder precompute): shown right away, it only needs the confirmation
+current_plan_dir = plan_dir(days) if days and not streaming else None
+if st.session_state["plan"] and st.session_state["plan"][0] != current_plan_dir:
+    # other days selected: the plan on screen was for the previous selection
+    st.session_state["plan"] = st.session_state["appointments"] = st.session_state["last_summary"] = None
+if current_plan_dir and not find:
+    if st.session_state["appointments"] is None:
+        plan = load_plan(days, GOOGLE_CALENDAR_IDS)
+        if plan and f"{current_plan_dir}#{plan['version']}" not in st.session_state["plans_sent"]:
+            show_plan(plan)
+    if st.session_state["plan"]:
+        st.info(f"Piano pronto ({st.session_state['plan'][2]})")
+        if st.button("Aggiorna il piano con le ultime modifiche", key="refresh_plan"):
+            creds = get_shared_credentials() or get_google_credentials()
+            with st.spinner("Leggo le modifiche al calendario..."):
+                show_plan(refresh_plan(creds, days, GOOGLE_CALENDAR_IDS))
+            st.rerun()
+        if st.session_state["appointments"]:
+            st.write(st.session_state["last_summary"])
+        else:
+            st.write("Non ci sono pazienti nel piano per i giorni selezionati")
+
+def save_correction(appointments, summary, name, phone):
+    """Remember the contact of a calendar summary (see utils/resolution_memo.py) and apply it to the list."""
+    set_override(summary, name, phone)
+    key = memo_key(summary)
+    for each in appointments:
+        if memo_key(each["event_name"]) == key:
+            each.update(name=name, phone=phone, phone_source="correzione" if phone else None, review=None)
+    st.session_state["last_summary"] = create_appointment_summary(appointments, st.session_state["calendar_changes"])
+
 # If we already have a summary/appointments in session_state, show them
 if st.session_state["appointments"]:
 
+    # Uncertain matches: nobody is messaged until one of the candidates is confirmed (or corrected below)
+    to_review = [each for each in st.session_state["appointments"] if each.get("review")]
+    if to_review:
+        with st.expander(f"Contatti da verificare ({len(to_review)})", expanded=True):
+            summary = st.selectbox("Evento", list(dict.fromkeys(each["event_name"] for each in to_review)), key="review_summary")
+            candidates = next(each for each in to_review if each["event_name"] == summary)["review"]
+            choice = st.radio("Chi è?", range(len(candidates)), format_func=lambda i: candidate_label(candidates[i]),
+                              key=f"review_choice_{summary}")
+            if st.button("Conferma", key="review_confirm"):
+                picked = candidates[choice]
+                phone = sanitize_phone(picked["phone"]) if picked["phone"] else None
+                save_correction(st.session_state["appointments"], summary, picked["name"], phone)
+                st.success(f"{picked['name']} confermato: verrà usato anche le prossime volte")
+                st.write(st.session_state["last_summary"])
+
+    # Manual corrections: remembered for this calendar summary from now on (see utils/resolution_memo.py)
+    with st.expander("Correggi un contatto"):
+        appointments = st.session_state["appointments"]
+        summaries = list(dict.fromkeys(each["event_name"] for each in appointments))
+        summary = st.selectbox("Evento", summaries, key="override_summary")
+        current = next(each for each in appointments if each["event_name"] == summary)
+        name = st.text_input("Nome del paziente", value=current["name"], key=f"override_name_{summary}")
+        raw_phone = st.text_input("Telefono (vuoto = non inviare)", value=current["phone"] or "", key=f"override_phone_{summary}")
+        if st.button("Salva correzione", key="override_save"):
+            phone = sanitize_phone(raw_phone) if raw_phone.strip() else None
+            if raw_phone.strip() and not phone:
+                st.error(f"Numero non valido: {raw_phone}")
+            else:
+                save_correction(appointments, summary, name, phone)
+                st.success("Correzione salvata: verrà usata anche le prossime volte")
+                st.write(st.session_state["last_summary"])
+
     # Button to send reminders (exists only when appointments are present)
     if st.button("Invia il promemoria", key="send_reminders"):
         # Use the appointments stored in session_state (persisted across reruns)
@@ -113,15 +316,104 @@ if st.session_state["appointments"]:
         if not appointments_to_send:
             st.warning("Nessun promemoria da inviare.")
         else:
-            # iterate and send messages
-            appointments_to_send = [each for each in appointments_to_send if each["phone"]]
-            for appointment in appointments_to_send:
-                phone = appointment.get("phone")
-                #time = extract_time_hhmm(appointment["start"])
-                time = format_italian_date_time(appointment["start"])
-                with st.spinner(f"Sto inviando il messaggio a {phone}..."):
-                    send_twilio_message(phone, time)
-            st.success("Messaggi inviati!")
-            # Optional: clear appointments after sending to avoid duplicate sends
+            # queue the sends in the durable outbox (idempotent on event id + date) and send in background
+            render = render_reminder
+            if st.session_state["plan"]:
+                # messages already rendered by the precompute job
+                plan_shown = load_plan(days, GOOGLE_CALENDAR_IDS, version=st.session_state["plan"][1])
+                render = plan_render(plan_shown, render_reminder) if plan_shown else render_reminder
+                st.session_state["plans_sent"].append(f"{st.session_state['plan'][0]}#{st.session_state['plan'][1]}")
+                st.session_state["plan"] = None
+            keys = enqueue(appointments_to_send, render)
+            start_background_drain()
+            st.session_state["outbox_keys"] = keys
+            st.success(f"{len(keys)} promemoria in coda di invio")
+            # clearing is safe: anything not sent yet stays in the outbox and is retried
             st.session_state["appointments"] = None
             st.session_state["last_summary"] = None
+
+if st.session_state["stream_days"] and streaming:
+    if st.button("Invia il promemoria", key="send_reminders_stream"):
+        creds = get_shared_credentials() or get_google_credentials()
+        stream_days = [date.fromisoformat(d) for d in st.session_state["stream_days"]]
+        shown = st.session_state["stream_shown"] or set()
+        skipped = []
+
+        def reviewed(stream):
+            # the calendar is read again: anything added or matched to another number since the
+            # summary was shown is not sent without being seen
+            for each in stream:
+                if not each.phone:
+                    continue
+                if shown_key(each) in shown:
+                    yield each
+                else:
+                    skipped.append(each)
+
+        with st.spinner("Metto in coda i promemoria..."):
+            queued = enqueue_stream(reviewed(iter_appointments(creds, days=stream_days)), render_reminder)
+        start_background_drain()
+        st.success(f"{queued} promemoria in coda di invio")
+        if skipped:
+            st.warning(f"{len(skipped)} appuntamenti cambiati dopo il riepilogo non sono stati inviati: "
+                       "cerca di nuovo i contatti per vederli. " +
+                       ", ".join(f"{each.event_name} ({format_italian_datetime(each.start)})" for each in skipped[:10]))
+        st.session_state["stream_shown"] = None
+        st.session_state["stream_sent_days"] = st.session_state["stream_days"]
+        st.session_state["stream_days"] = None
+
+with st.sidebar.expander("Correzioni salvate"):
+    overrides = list_overrides()
+    if not overrides:
+        st.write("Nessuna correzione")
+    for row in overrides:
+        st.markdown(f"**{row['query']}** → {row['name']} ({row['phone'] or 'non inviare'})")
+        if st.button("Rimuovi", key=f"override_remove_{row['query']}"):
+            remove_entry(row["query"])
+            st.rerun()
+
+STATE_LABELS = {"queued": "⏳ in coda", "sending": "📤 in invio", "sent": "✅ inviato", "failed": "❌ non inviato"}
+# delivery status from Twilio's status callbacks (utils/status_webhook.py), once the message is sent
+DELIVERY_LABELS = {"delivered": "📬 consegnato", "read": "👀 letto", "undelivered": "❌ non consegnato",
+                   "failed": "❌ non consegnato"}
+
+if os.getenv("STATUS_CALLBACK_URL"):
+    # one receiver per process; no-op on reruns
+    start_status_server()
+
+if st.session_state["stream_sent_days"] and streaming:
+    st.subheader("Stato invii")
+    st.button("Aggiorna stato", key="refresh_outbox_stream")
+    start_background_drain()
+    for state, n in count_states(st.session_state["stream_sent_days"]).items():
+        st.markdown(f"- {DELIVERY_LABELS.get(state) or STATE_LABELS.get(state, state)}: {n}")
+elif st.session_state["outbox_keys"]:
+    st.subheader("Stato invii")
+    st.button("Aggiorna stato", key="refresh_outbox")
+    # resume sends still queued (e.g. retries after a restart); no-op if a drainer is already running
+    start_background_drain()
+    for row in get_states(st.session_state["outbox_keys"]):
+        label = STATE_LABELS.get(row['state'], row['state'])
+        if row["state"] == "sent" and row["delivery"] in DELIVERY_LABELS:
+            label = DELIVERY_LABELS[row["delivery"]]
+        line = f"- **{row['name']}** ({row['phone']}): {label}"
+        if row["state"] == "sent" and row["delivery_error"]:
+            line += f" — errore {row['delivery_error']}"
+        if row["last_error"] and row["state"] != "sent":
+            line += f" — {row['last_error']} (tentativi: {row['attempts']})"
+        st.markdown(line)
+
+if tracing.is_enabled():
+    with st.expander("Tempi di esecuzione", expanded=False):
+        report = tracing.snapshot()
+        if not report["spans"]:
+            st.write("Nessuna misura: premi \"Trova contatti\" o invia i promemoria.")
+        else:
+            st.markdown("**Fasi**")
+            st.dataframe(report["spans"], hide_index=True)
+            st.markdown("**Chiamate API**")
+            st.dataframe([{"api": k, "chiamate": v} for k, v in sorted(report["api_calls"].items())], hide_index=True)
+            if report["caches"]:
+                st.markdown("**Cache**")
+                st.dataframe(report["caches"], hide_index=True)
+            st.download_button("Esporta (JSON lines)", tracing.to_jsonl(), file_name="tracing.jsonl", mime="application/jsonl")
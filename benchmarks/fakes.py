@@ -0,0 +1,393 @@
+"""
+In-process stand-ins for the Google Calendar, People and Twilio APIs.
+
+They mimic the small surface the app uses (request objects with .execute(), pagination,
+sync tokens, messages.create) with configurable latency and error rate, and record every
+call in an ApiStats so benchmarks can report call counts and latency percentiles.
+
+    stats = ApiStats()
+    cfg = FakeConfig(latency=0.02, error_rate=0.01)
+    with installed(calendar=FakeCalendarService(events, cfg, stats),
+                   people=FakePeopleService(people, cfg, stats),
+                   twilio=FakeTwilioClient(cfg, stats)):
+        get_events(creds, days=[...])
+"""
+import json
+import time
+import bisect
+from collections import deque
+import random
+import threading
+from urllib.request import Request, urlopen
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Dict, List, Any, Optional
+
+# ---- call accounting ----
+
+def percentile(values: List[float], p: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    k = min(len(ordered) - 1, max(0, round(p / 100 * (len(ordered) - 1))))
+    return ordered[k]
+
+class ApiStats:
+    """Thread-safe call counter + latency samples per API method (e.g. "calendar.events.list")."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies: Dict[str, List[float]] = {}
+        self.errors: Dict[str, int] = {}
+
+    def record(self, name: str, seconds: float, error: bool = False):
+        with self._lock:
+            self.latencies.setdefault(name, []).append(seconds)
+            if error:
+                self.errors[name] = self.errors.get(name, 0) + 1
+
+    def calls(self, name: Optional[str] = None) -> int:
+        if name is not None:
+            return len(self.latencies.get(name, []))
+        return sum(len(v) for v in self.latencies.values())
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        return {
+            name: {
+                "calls": len(samples),
+                "errors": self.errors.get(name, 0),
+                "p50_ms": percentile(samples, 50) * 1000,
+                "p95_ms": percentile(samples, 95) * 1000,
+            }
+            for name, samples in sorted(self.latencies.items())
+        }
+
+@dataclass
+class FakeConfig:
+    latency: float = 0.0         # seconds per call
+    jitter: float = 0.0          # +/- uniform seconds
+    error_rate: float = 0.0      # probability of a transient error (503 / 429)
+    seed: Optional[int] = 1
+    rate_limit: float = 0.0      # calls accepted per second, the rest get 429 like a quota (0 = no limit)
+
+class FakeHttpError(Exception):
+    """Looks enough like googleapiclient.errors.HttpError for the app code."""
+
+    class _Resp(dict):
+        def __init__(self, status):
+            super().__init__()
+            self.status = status
+
+    def __init__(self, status: int, content: bytes = b""):
+        super().__init__(f"HTTP {status}")
+        self.resp = self._Resp(status)
+        self.content = content
+
+class _Backend:
+    api = "fake"
+
+    def __init__(self, config: FakeConfig, stats: ApiStats):
+        self.config = config
+        self.stats = stats
+        self._rnd = random.Random(config.seed)
+        self._rnd_lock = threading.Lock()
+        self._recent: deque = deque()  # timestamps of the calls of the last second (rate_limit)
+
+    def _over_quota(self) -> bool:
+        if not self.config.rate_limit:
+            return False
+        now = time.monotonic()
+        with self._rnd_lock:
+            while self._recent and now - self._recent[0] >= 1.0:
+                self._recent.popleft()
+            if len(self._recent) >= self.config.rate_limit:
+                self.stats.record("quota.429", 0.0, error=True)
+                return True
+            self._recent.append(now)
+            return False
+
+    def _roll(self):
+        with self._rnd_lock:
+            jitter = self._rnd.uniform(-self.config.jitter, self.config.jitter) if self.config.jitter else 0.0
+            failed = self._rnd.random() < self.config.error_rate
+        return max(0.0, self.config.latency + jitter), failed
+
+    def call(self, name: str, fn, make_error, quota: bool = True):
+        delay, failed = self._roll()
+        t = time.perf_counter()
+        if delay:
+            time.sleep(delay)
+        self.stats.record(name, time.perf_counter() - t, error=failed)
+        if failed:
+            raise make_error()
+        if quota and self._over_quota():
+            raise make_error(429)
+        return fn()
+
+    def new_batch_http_request(self, callback=None):
+        return _Batch(self, callback)
+
+class _Request:
+    def __init__(self, backend: _Backend, name: str, fn):
+        self._backend, self._name, self._fn = backend, name, fn
+
+    def execute(self, http=None, num_retries=0):
+        return self._backend.call(self._name, self._fn, lambda status=503: FakeHttpError(status))
+
+class _Batch:
+    """Like googleapiclient's BatchHttpRequest: one HTTP exchange, per-sub-request results."""
+
+    def __init__(self, backend: _Backend, callback):
+        self._backend = backend
+        self._callback = callback
+        self._requests = []
+
+    def add(self, request, callback=None, request_id=None):
+        self._requests.append((request, callback or self._callback, request_id or str(len(self._requests))))
+
+    def execute(self, http=None):
+        def _run():
+            outcomes = []
+            for request, callback, request_id in self._requests:
+                _, failed = self._backend._roll()
+                if failed or self._backend._over_quota():
+                    outcomes.append((callback, request_id, None, FakeHttpError(503 if failed else 429)))
+                else:
+                    outcomes.append((callback, request_id, request._fn(), None))
+            return outcomes
+        for callback, request_id, response, error in self._backend.call(f"{self._backend.api}.batch", _run, lambda status=503: FakeHttpError(status),
+                                                                     quota=False):  # sub-requests count, not the envelope
+            if callback:
+                callback(request_id, response, error)
+
+# ---- Google Calendar ----
+
+class FakeCalendarService(_Backend):
+    """events: {calendar_id: [event, ...]} (already sorted by start)."""
+
+    PAGE_SIZE = 250
+    api = "calendar"
+
+    def __init__(self, events: Dict[str, List[Dict[str, Any]]], config: FakeConfig, stats: ApiStats):
+        super().__init__(config, stats)
+        self._events = events
+        # start strings per calendar, to slice the time window without copying the calendar
+        self._starts = {cid: [ev["start"].get("dateTime", "") for ev in evs] for cid, evs in events.items()}
+        self._cancelled: Dict[tuple, Dict[str, Any]] = {}  # (calendar, event id) -> deleted event
+        # sync tokens: every edit gets a sequence number, a token is "<instance>-<last seq seen>"
+        self._seq = 0
+        self._changed: Dict[tuple, int] = {}  # (calendar, event id) -> seq of its last edit
+        self._channels: Dict[str, Dict[str, Any]] = {}  # calendar -> watch channel body
+        self.notifications = 0
+
+    def events(self):
+        return self
+
+    def channels(self):
+        return self
+
+    # ---- edits, to exercise incremental reads (updatedMin) ----
+
+    def _now(self) -> str:
+        return time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime()) + f".{int(time.time() * 1000) % 1000:03d}Z"
+
+    def upsert(self, calendar_id: str, event: Dict[str, Any]):
+        """Add or replace (same id) an event, as if edited in Google Calendar now."""
+        evs = [ev for ev in self._events.get(calendar_id, []) if ev["id"] != event["id"]]
+        evs.append({**event, "updated": self._now()})
+        evs.sort(key=lambda ev: ev["start"].get("dateTime", ""))
+        self._events[calendar_id] = evs
+        self._starts[calendar_id] = [ev["start"].get("dateTime", "") for ev in evs]
+        self._cancelled.pop((calendar_id, event["id"]), None)
+        self._edited(calendar_id, event["id"])
+
+    def delete(self, calendar_id: str, event_id: str):
+        evs = self._events.get(calendar_id, [])
+        self._events[calendar_id] = [ev for ev in evs if ev["id"] != event_id]
+        self._starts[calendar_id] = [ev["start"].get("dateTime", "") for ev in self._events[calendar_id]]
+        self._cancelled[(calendar_id, event_id)] = {"id": event_id, "status": "cancelled", "updated": self._now()}
+        self._edited(calendar_id, event_id)
+
+    def _edited(self, calendar_id, event_id):
+        self._seq += 1
+        self._changed[(calendar_id, event_id)] = self._seq
+        channel = self._channels.get(calendar_id)
+        if channel:
+            # like Google: POST a notification to the channel address, in the background
+            headers = {"X-Goog-Channel-ID": channel["id"], "X-Goog-Channel-Token": channel.get("token", ""),
+                       "X-Goog-Resource-State": "exists", "Content-Length": "0"}
+            self.notifications += 1
+
+            def _post():
+                try:
+                    urlopen(Request(channel["address"], data=b"", headers=headers, method="POST"), timeout=5).close()
+                except Exception as e:
+                    print(f"fake calendar: notification not delivered: {e}")
+            threading.Thread(target=_post, daemon=True).start()
+
+    def _token(self) -> str:
+        return f"{id(self)}-{self._seq}"
+
+    def _changed_by_token(self, calendarId, syncToken):
+        owner, _, seq = syncToken.rpartition("-")
+        if owner != str(id(self)):
+            raise FakeHttpError(410)  # expired / not ours: full sync required
+        since = int(seq)
+        items = []
+        current = {ev["id"]: ev for ev in self._events.get(calendarId, [])}
+        for (cid, event_id), at in self._changed.items():
+            if cid != calendarId or at <= since:
+                continue
+            items.append(current.get(event_id) or self._cancelled[(cid, event_id)])
+        return {"items": items, "nextSyncToken": self._token()}
+
+    def watch(self, calendarId, body=None, **kwargs):
+        def _watch():
+            self._channels[calendarId] = dict(body)
+            expiration = int((time.time() + int(body.get("params", {}).get("ttl", 604800))) * 1000)
+            return {"kind": "api#channel", "id": body["id"], "resourceId": f"res-{calendarId}", "expiration": str(expiration)}
+        return _Request(self, "calendar.events.watch", _watch)
+
+    def stop(self, body=None, **kwargs):
+        def _stop():
+            for cid, channel in list(self._channels.items()):
+                if channel["id"] == body["id"]:
+                    del self._channels[cid]
+            return {}
+        return _Request(self, "calendar.channels.stop", _stop)
+
+    def _changed_since(self, calendarId, updated_min):
+        items = [ev for ev in self._events.get(calendarId, []) if ev.get("updated", "") >= updated_min]
+        items += [ev for (cid, _), ev in self._cancelled.items() if cid == calendarId and ev["updated"] >= updated_min]
+        return {"items": items}
+
+    def list(self, calendarId, timeMin=None, timeMax=None, pageToken=None, maxResults=None, updatedMin=None,
+             syncToken=None, **kwargs):
+        if updatedMin is not None:
+            return _Request(self, "calendar.events.list", lambda: self._changed_since(calendarId, updatedMin))
+        if syncToken is not None:
+            return _Request(self, "calendar.events.list", lambda: self._changed_by_token(calendarId, syncToken))
+
+        def _page():
+            starts = self._starts.get(calendarId, [])
+            lo = bisect.bisect_left(starts, timeMin[:19]) if timeMin else 0
+            hi = bisect.bisect_right(starts, timeMax[:19] + "~") if timeMax else len(starts)
+            size = min(maxResults or self.PAGE_SIZE, self.PAGE_SIZE)
+            offset = int(pageToken or 0)
+            resp = {"items": self._events.get(calendarId, [])[lo + offset:min(hi, lo + offset + size)]}
+            if lo + offset + size < hi:
+                resp["nextPageToken"] = str(offset + size)
+            elif not timeMax:
+                resp["nextSyncToken"] = self._token()  # only unbounded listings can be followed with a token
+            return resp
+        return _Request(self, "calendar.events.list", _page)
+
+# ---- Google People ----
+
+class FakePeopleService(_Backend):
+    """people: People API person dicts (resourceName, names, phoneNumbers)."""
+
+    PAGE_SIZE = 1000
+    api = "people"
+
+    def __init__(self, people: List[Dict[str, Any]], config: FakeConfig, stats: ApiStats):
+        super().__init__(config, stats)
+        self._people = people
+
+    def people(self):
+        return self
+
+    def connections(self):
+        return self
+
+    def list(self, resourceName="people/me", pageSize=None, pageToken=None, syncToken=None, **kwargs):
+        def _page():
+            # every sync token means "nothing changed since"
+            items = [] if syncToken else self._people
+            size = min(pageSize or self.PAGE_SIZE, self.PAGE_SIZE)
+            offset = int(pageToken or 0)
+            resp = {"connections": items[offset:offset + size]}
+            if offset + size < len(items):
+                resp["nextPageToken"] = str(offset + size)
+            else:
+                resp["nextSyncToken"] = "sync-%d" % len(self._people)
+            return resp
+        return _Request(self, "people.connections.list", _page)
+
+    def searchContacts(self, query="", pageSize=10, **kwargs):
+        def _search():
+            if not query:
+                return {}
+            q = query.casefold()
+            hits = [p for p in self._people if q in p["names"][0]["displayName"].casefold()][:pageSize]
+            return {"results": [{"person": p} for p in hits]}
+        return _Request(self, "people.searchContacts", _search)
+
+# ---- Twilio ----
+
+class _FakeMessage:
+    def __init__(self, sid):
+        self.sid = sid
+        self.status = "queued"
+
+class FakeTwilioClient(_Backend):
+    """Stands in for twilio.rest.Client: client.messages.create(...)."""
+
+    def __init__(self, config: FakeConfig, stats: ApiStats):
+        super().__init__(config, stats)
+        self._counter = 0
+        self._counter_lock = threading.Lock()
+        self.messages = self
+        self.http_client = None
+
+    def _error(self, status=429):
+        from twilio.base.exceptions import TwilioRestException
+        return TwilioRestException(status, "https://api.twilio.com/fake", msg="Too Many Requests")
+
+    def create(self, **kwargs):
+        from twilio.base.exceptions import TwilioRestException
+        try:
+            json.loads(kwargs.get("content_variables") or "{}")
+        except ValueError:
+            # what Twilio answers to variables that are not valid JSON
+            raise TwilioRestException(400, "https://api.twilio.com/fake", msg="Invalid content_variables")
+
+        def _create():
+            with self._counter_lock:
+                self._counter += 1
+                return _FakeMessage(f"SMfake{self._counter:08d}")
+        return self.call("twilio.messages.create", _create, self._error)
+
+# ---- wiring ----
+
+@contextmanager
+def installed(calendar=None, people=None, twilio=None, budgets: Optional[Dict[str, float]] = None,
+              store: Optional[str] = None):
+    """
+    Route the app's service factories to the fakes for the duration of the block.
+    The quota governor (utils/quota.py) gets `budgets` (calls per second per API); by default
+    it is out of the way, since the fakes have no quota unless FakeConfig.rate_limit is set.
+    The local calendar store (utils/event_store.py) is off unless `store` gives its path:
+    a store left in tmp/ by another run would not match the fake calendars.
+    """
+    from utils import google_utils, twilio_utils, pipeline, quota, event_store
+    saved = (google_utils.get_service, google_utils._thread_http, twilio_utils.get_twilio_client)
+    saved_store = (event_store.EVENT_STORE, event_store.EVENTS_FILE)
+    event_store.EVENT_STORE = store is not None
+    event_store.EVENTS_FILE = store or event_store.EVENTS_FILE
+    saved_budgets = dict(quota.BUDGETS)
+    quota.BUDGETS.update(budgets or {api: 1e9 for api in quota.BUDGETS})
+    quota.reset()
+    services = {"calendar": calendar, "people": people}
+    google_utils.get_service = pipeline.get_service = lambda name, version, creds: services[name]
+    google_utils._thread_http = lambda creds: None
+    if twilio is not None:
+        twilio_utils.get_twilio_client = lambda *args, **kwargs: twilio
+    try:
+        yield
+    finally:
+        google_utils.get_service, google_utils._thread_http, twilio_utils.get_twilio_client = saved
+        pipeline.get_service = saved[0]
+        event_store.EVENT_STORE, event_store.EVENTS_FILE = saved_store
+        quota.BUDGETS.update(saved_budgets)
+        quota.reset()
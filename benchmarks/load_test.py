@@ -0,0 +1,186 @@
+"""
+End-to-end load test of the reminder pipeline against the local fakes in benchmarks/fakes.py:
+get_events (calendar fetch + contact sync + matching + searchContacts fallback) and the send
+loop (outbox enqueue + drain through send_twilio_messages).
+
+    python benchmarks/load_test.py
+    python benchmarks/load_test.py --scales 10 100 1000 10000 --latency 0.01 --twilio-error-rate 0.02
+    python benchmarks/load_test.py --calendars 3 --json
+    python benchmarks/load_test.py --pipeline   # streaming mode (utils/pipeline.py): lookups and sends overlap
+    python benchmarks/load_test.py --scales 1000 --people-rate-limit 5   # People quota: 429s smoothed by utils/quota.py
+    python benchmarks/load_test.py --event-store   # local calendar store: the second get_events is a delta call
+
+Runs in a throw-away working directory, so tmp/ caches and the outbox of the real app are not touched.
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fakes import ApiStats, FakeConfig, FakeCalendarService, FakePeopleService, FakeTwilioClient, installed
+
+FIRST = ["Mario", "Anna", "Luca", "Giulia", "Niccolò", "Francesca", "Marco", "Chiara", "Davide", "Elena", "Paolo", "Sara"]
+LAST = ["Rossi", "Bianchi", "D'Angelo", "Esposito", "Romano", "Colombo", "Ricci", "Marino", "Greco", "Bruno", "Gallo", "Conti"]
+
+def build_workload(n_appointments: int, n_calendars: int, known_ratio: float = 0.9, seed: int = 1,
+                   n_patients: int = None):
+    """
+    n_appointments spread over ~40 per day; about 60% distinct patients (regulars come back)
+    unless n_patients is given, known_ratio of them in the address book (the rest go through
+    the searchContacts fallback).
+    """
+    rnd = random.Random(seed)
+    tz = ZoneInfo("Europe/Rome")
+    first_day = datetime.now(tz).date() + timedelta(days=1)
+    n_days = max(1, -(-n_appointments // 40))
+    n_patients = n_patients or max(1, int(n_appointments * 0.6))
+
+    patients = [f"{rnd.choice(FIRST)} {rnd.choice(LAST)} {i}" for i in range(n_patients)]
+    people = [
+        {"resourceName": f"people/{i}", "names": [{"displayName": name}],
+         "phoneNumbers": [{"value": f"+39 3{rnd.randint(20, 99)} {rnd.randint(1000000, 9999999)}"}]}
+        for i, name in enumerate(patients) if rnd.random() < known_ratio
+    ]
+    # plus the rest of the address book that never shows up in the calendar
+    people += [{"resourceName": f"people/x{i}", "names": [{"displayName": f"Contatto {i}"}]} for i in range(n_patients)]
+
+    calendar_ids = [f"cal{i}@example.com" for i in range(n_calendars)]
+    events = {cid: [] for cid in calendar_ids}
+    for i in range(n_appointments):
+        day = first_day + timedelta(days=i % n_days)
+        start = datetime(day.year, day.month, day.day, 8, 0, tzinfo=tz) + timedelta(minutes=30 * ((i // n_days) % 24))
+        cid = calendar_ids[i % n_calendars]
+        events[cid].append({
+            "id": f"ev{i}", "iCalUID": f"ev{i}@google.com", "summary": f"{rnd.choice(patients)} pz",
+            "start": {"dateTime": start.isoformat()}, "end": {"dateTime": (start + timedelta(minutes=45)).isoformat()},
+        })
+    for cid in calendar_ids:
+        events[cid].sort(key=lambda ev: ev["start"]["dateTime"])
+    days = [first_day + timedelta(days=i) for i in range(n_days)]
+    return events, people, calendar_ids, days
+
+def run_scale(n: int, args) -> dict:
+    from utils import google_utils, outbox, twilio_utils, quota
+    from utils.messages import load_engine
+
+    events, people, calendar_ids, days = build_workload(n, args.calendars)
+    google_cfg = FakeConfig(latency=args.latency, jitter=args.latency / 2, error_rate=args.google_error_rate)
+    people_cfg = FakeConfig(latency=args.latency, jitter=args.latency / 2, error_rate=args.google_error_rate,
+                            rate_limit=args.people_rate_limit)
+    twilio_cfg = FakeConfig(latency=args.latency, jitter=args.latency / 2, error_rate=args.twilio_error_rate)
+    stats = ApiStats()
+    stages = {}
+    budgets = {api: 1e9 for api in quota.BUDGETS}
+    if args.people_rate_limit and not args.no_governor:
+        budgets["people"] = args.people_rate_limit
+    quota.BACKOFF_BASE = 0.05
+
+    workdir = tempfile.mkdtemp(prefix="load_test_")
+    cwd = os.getcwd()
+    os.chdir(workdir)  # tmp/contacts_cache.json, tmp/outbox.sqlite3 go here
+    google_utils._search_warmed_up = False
+    outbox.BACKOFF_BASE = 0.01
+    outbox.BACKOFF_MAX = 0.1
+    render = load_engine().render
+    try:
+        with installed(calendar=FakeCalendarService(events, google_cfg, stats),
+                       people=FakePeopleService(people, people_cfg, stats),
+                       twilio=FakeTwilioClient(twilio_cfg, stats), budgets=budgets,
+                       store=os.path.join("tmp", "events.sqlite3") if args.event_store else None):
+            send_batch = lambda messages: twilio_utils.send_twilio_messages(messages, max_mps=args.mps)
+            if args.pipeline:
+                from utils.pipeline import run_pipeline
+                t = time.perf_counter()
+                appointments, progress = run_pipeline(
+                    object(), days=days, calendar_ids=calendar_ids, send=True, send_batch=send_batch,
+                    render=render,
+                    concurrency=args.concurrency)
+                stages["pipeline"] = time.perf_counter() - t
+                sent = {k: progress[k] for k in ("sent", "retried", "failed")}
+                to_send = [each for each in appointments if each["phone"]]
+                return _report(n, to_send, sent, stages, stats, quota.stats())
+
+            t = time.perf_counter()
+            appointments = google_utils.get_events(object(), days=days, calendar_ids=calendar_ids) or []
+            stages["get_events"] = time.perf_counter() - t
+            if args.event_store:
+                # the same view opened again: served from the store after one delta call per calendar
+                t = time.perf_counter()
+                google_utils.get_events(object(), days=days, calendar_ids=calendar_ids)
+                stages["get_events.repeat"] = time.perf_counter() - t
+
+            to_send = [each for each in appointments if each["phone"]]
+            t = time.perf_counter()
+            outbox.enqueue(to_send, render)
+            stages["outbox.enqueue"] = time.perf_counter() - t
+
+            t = time.perf_counter()
+            sent = outbox.drain(send_batch, wait=True)
+            stages["send"] = time.perf_counter() - t
+            quotas = quota.stats()
+    finally:
+        os.chdir(cwd)
+    return _report(n, to_send, sent, stages, stats, quotas)
+
+def _report(n, to_send, sent, stages, stats, quotas) -> dict:
+    return {
+        "appointments": n,
+        "matched": len(to_send),
+        "sent": sent,
+        "stages_s": {k: round(v, 4) for k, v in stages.items()},
+        "api_calls": stats.calls(),
+        "apis": stats.summary(),
+        "quota": {api: s for api, s in quotas.items() if s["waited"] or s["throttled"] or s["unavailable"]},
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scales", type=int, nargs="+", default=[10, 100, 1000, 10000])
+    parser.add_argument("--calendars", type=int, default=1)
+    parser.add_argument("--latency", type=float, default=0.005, help="seconds per fake API call")
+    parser.add_argument("--google-error-rate", type=float, default=0.0, help="share of Google calls failing with 503")
+    parser.add_argument("--twilio-error-rate", type=float, default=0.0, help="share of sends failing with 429 (retried by the outbox)")
+    parser.add_argument("--mps", type=float, default=0, help="Twilio messages per second cap (0 = unlimited, to measure the pipeline itself)")
+    parser.add_argument("--pipeline", action="store_true", help="use the asyncio pipeline instead of get_events + drain")
+    parser.add_argument("--concurrency", type=int, default=8, help="People searches in flight (--pipeline only)")
+    parser.add_argument("--people-rate-limit", type=float, default=0, help="fake People quota in calls per second (0 = none)")
+    parser.add_argument("--no-governor", action="store_true", help="with --people-rate-limit: no budget, only retries after the 429s")
+    parser.add_argument("--event-store", action="store_true", help="read the calendars through utils/event_store.py and time a repeat view")
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+
+    # keep the app's print() chatter out of the report
+    real_stdout = sys.stdout
+    results = []
+    for n in args.scales:
+        sys.stdout = open(os.devnull, "w")
+        try:
+            results.append(run_scale(n, args))
+        finally:
+            sys.stdout.close()
+            sys.stdout = real_stdout
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    for r in results:
+        stages = "  ".join(f"{k}={v * 1000:.0f}ms" for k, v in r["stages_s"].items())
+        print(f"\n== {r['appointments']} appointments ({r['matched']} with phone, sent {r['sent']}) — {r['api_calls']} API calls")
+        print(f"   {stages}")
+        for name, s in r["apis"].items():
+            print(f"   {name:<26} calls={s['calls']:<6} errors={s['errors']:<4} p50={s['p50_ms']:.1f}ms p95={s['p95_ms']:.1f}ms")
+        for api, s in r["quota"].items():
+            print(f"   quota {api:<20} waited={s['waited']} ({s['wait_s']}s) 429={s['throttled']} 503={s['unavailable']} "
+                  f"retries={s['retries']} gave_up={s['gave_up']} rate={s['rate_per_min']}/min")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+Peak Python memory (tracemalloc) of get_events (whole list) vs the streaming mode
+(iter_appointments consumed one appointment at a time, as the app summary and the CLI do),
+against the local fakes, for a growing number of events and a fixed address book:
+
+    python benchmarks/memory.py
+    python benchmarks/memory.py --scales 1000 10000 100000 --calendars 3 --patients 2000
+
+The fake calendars themselves are built before measuring: only what the app allocates counts.
+"""
+import os
+import sys
+import json
+import argparse
+import tempfile
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fakes import ApiStats, FakeConfig, FakeCalendarService, FakePeopleService, installed
+from load_test import build_workload
+
+def _consume_list(google_utils, days, calendar_ids, sink):
+    appointments = google_utils.get_events(object(), days=days, calendar_ids=calendar_ids) or []
+    for each in appointments:
+        sink.write(f"{each['day']} {each['start']} {each['name']} {each['phone']}\n")
+    return len(appointments)
+
+def _consume_stream(google_utils, days, calendar_ids, sink):
+    n = 0
+    for each in google_utils.iter_appointments(object(), days=days, calendar_ids=calendar_ids):
+        sink.write(f"{each['day']} {each['start']} {each['name']} {each['phone']}\n")
+        n += 1
+    return n
+
+def measure(n: int, args, streaming: bool) -> dict:
+    from utils import google_utils
+    events, people, calendar_ids, days = build_workload(n, args.calendars, n_patients=args.patients)
+    cfg = FakeConfig()
+    workdir = tempfile.mkdtemp(prefix="memory_bench_")
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        with installed(calendar=FakeCalendarService(events, cfg, ApiStats()),
+                       people=FakePeopleService(people, cfg, ApiStats())), open(os.devnull, "w") as sink:
+            # first run fills tmp/ caches (contacts, memo): measure the steady state (second run)
+            (_consume_stream if streaming else _consume_list)(google_utils, days, calendar_ids, sink)
+            tracemalloc.start()
+            count = (_consume_stream if streaming else _consume_list)(google_utils, days, calendar_ids, sink)
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+    finally:
+        os.chdir(cwd)
+    return {"events": n, "mode": "stream" if streaming else "list", "appointments": count, "peak_mb": round(peak / 2**20, 2)}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scales", type=int, nargs="+", default=[1000, 10000, 50000])
+    parser.add_argument("--calendars", type=int, default=2)
+    parser.add_argument("--patients", type=int, default=1000, help="address book size (kept fixed across scales)")
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+
+    real_stdout = sys.stdout
+    results = []
+    for n in args.scales:
+        for streaming in (False, True):
+            sys.stdout = open(os.devnull, "w")  # the app's print() chatter
+            try:
+                results.append(measure(n, args, streaming))
+            finally:
+                sys.stdout.close()
+                sys.stdout = real_stdout
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{'events':>8}  {'list (MB)':>10}  {'stream (MB)':>11}")
+    for lst, stream in zip(results[::2], results[1::2]):
+        print(f"{lst['events']:>8}  {lst['peak_mb']:>10.2f}  {stream['peak_mb']:>11.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""
+Accuracy and latency of the contact matcher (ContactIndex.match in utils/contacts.py) on
+synthetic calendar summaries: exact names, swapped first/last name, notes after the name,
+typos, and patients that are not in the address book at all.
+
+    python benchmarks/name_matching.py
+    python benchmarks/name_matching.py --contacts 5000 --summaries 2000 --threshold 0.8
+
+"wrong" are summaries messaged automatically to someone else: the number that must stay at 0.
+The "regress" row replays wrong matches seen before (REGRESSIONS) on their own address books.
+"""
+import os
+import sys
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fakes import percentile
+from utils import contacts
+from utils.contacts import ContactIndex, is_confident
+
+FIRST = ["Mario", "Anna", "Luca", "Giulia", "Niccolò", "Francesca", "Marco", "Chiara", "Davide", "Elena", "Paolo",
+         "Sara", "Giovanni", "Maria", "Alessandro", "Martina", "Lorenzo", "Valentina", "Matteo", "Federica"]
+LAST = ["Rossi", "Bianchi", "D'Angelo", "Esposito", "Romano", "Colombo", "Ricci", "Marino", "Greco", "Bruno", "Gallo",
+        "Conti", "De Luca", "Mancini", "Costa", "Giordano", "Rizzo", "Lombardi", "Moretti", "Barbieri", "Fontana",
+        "Santoro", "Mariani", "Rinaldi", "Caruso", "Ferrara", "Galli", "Martini", "Leone", "Longo"]
+NOTES = ["pz", "prima visita", "controllo", "trattamento", "(figlio)", "seduta 3"]
+
+# (address book, summary, patient): wrong automatic matches seen before, checked on every run
+REGRESSIONS = [
+    (["Giovanni Esposito", "Giovanni Esposito Esposito"], "Giovanni Esposiito Esposito", "Giovanni Esposito Esposito"),
+    (["Matteo Giordano", "Matteo Giordano Giordano"], "Matteo Giordanno Giordano", "Matteo Giordano Giordano"),
+    (["Mario Ferrara", "Marco Ferrara", "Mario Ferrara Marino"], "Mario Ferrara Mairno", "Mario Ferrara Marino"),
+]
+
+def typo(rnd, word):
+    if len(word) < 4:
+        return word
+    i = rnd.randrange(1, len(word) - 1)
+    kind = rnd.choice(["drop", "swap", "double"])
+    if kind == "drop":
+        return word[:i] + word[i + 1:]
+    if kind == "swap":
+        return word[:i] + word[i + 1] + word[i] + word[i + 2:]
+    return word[:i] + word[i] + word[i:]
+
+def build(n_contacts, n_summaries, seed=1):
+    rnd = random.Random(seed)
+    names = list(dict.fromkeys(f"{rnd.choice(FIRST)} {rnd.choice(LAST)} {rnd.choice(LAST)}" if rnd.random() < 0.3
+                               else f"{rnd.choice(FIRST)} {rnd.choice(LAST)}" for _ in range(n_contacts)))
+    people = [{"resource_name": f"people/{i}", "name": name, "phone": f"+393{rnd.randint(200000000, 999999999)}"}
+              for i, name in enumerate(names)]
+    summaries = []
+    for _ in range(n_summaries):
+        kind = rnd.choice(["exact", "swapped", "notes", "typo", "unknown"])
+        if kind == "unknown":
+            summaries.append((kind, f"{rnd.choice(FIRST)} Sconosciuto{rnd.randint(1, 999)}", None))
+            continue
+        person = rnd.choice(people)
+        words = person["name"].split()
+        if kind == "swapped":
+            words = words[1:] + words[:1]
+        elif kind == "notes":
+            words = words + [rnd.choice(NOTES)]
+        elif kind == "typo":
+            i = rnd.randrange(len(words))
+            words[i] = typo(rnd, words[i])
+        summaries.append((kind, " ".join(words), person["resource_name"]))
+    return people, summaries
+
+def regressions():
+    counts = {"auto ok": 0, "wrong": 0, "review": 0, "not found": 0}
+    for names, summary, patient in REGRESSIONS:
+        index = ContactIndex()
+        for i, name in enumerate(names):
+            index.add({"resource_name": f"people/{i}", "name": name, "phone": f"+39333000000{i}"})
+        found = index.match(summary)
+        if found is None:
+            counts["not found"] += 1
+        elif not is_confident(found):
+            counts["review"] += 1
+        elif found["name"] == patient:
+            counts["auto ok"] += 1
+        else:
+            counts["wrong"] += 1
+            print(f"  SBAGLIATO: {summary!r} -> {found['name']!r} ({found['confidence']}), il paziente è {patient!r}")
+    return counts
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--contacts", type=int, default=2000)
+    parser.add_argument("--summaries", type=int, default=2000)
+    parser.add_argument("--threshold", type=float, default=contacts.MATCH_REVIEW_THRESHOLD)
+    args = parser.parse_args()
+    contacts.MATCH_REVIEW_THRESHOLD = args.threshold
+
+    people, summaries = build(args.contacts, args.summaries)
+    t = time.perf_counter()
+    index = ContactIndex()
+    for person in people:
+        index.add(person)
+    print(f"indice di {len(index)} contatti in {(time.perf_counter() - t) * 1000:.0f} ms")
+
+    by_kind = {}
+    latencies = []
+    for kind, summary, expected in summaries:
+        t = time.perf_counter()
+        found = index.match(summary)
+        latencies.append(time.perf_counter() - t)
+        counts = by_kind.setdefault(kind, {"auto ok": 0, "wrong": 0, "review": 0, "not found": 0})
+        same_person = found is not None and (found["resource_name"] == expected or
+                                             any(c["resource_name"] == expected for c in found["candidates"][:1]))
+        if found is None:
+            counts["not found"] += 1
+        elif not is_confident(found):
+            counts["review"] += 1
+        elif same_person or (expected and index.contacts[expected]["name"] == found["name"]):
+            counts["auto ok"] += 1  # namesakes: same name, any of them is as good as the other
+        else:
+            counts["wrong"] += 1
+
+    latencies.sort()
+    print(f"match: p50 {percentile(latencies, 50) * 1e6:.0f} µs, p95 {percentile(latencies, 95) * 1e6:.0f} µs, "
+          f"max {latencies[-1] * 1e6:.0f} µs (soglia {args.threshold})")
+    by_kind["regress"] = regressions()
+    for kind, counts in by_kind.items():
+        print(f"  {kind:<8} " + "  ".join(f"{k}={v}" for k, v in counts.items()))
+
+if __name__ == "__main__":
+    main()
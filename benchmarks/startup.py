@@ -0,0 +1,85 @@
+"""
+Startup-time budget for the app and the utils modules.
+
+Each module is imported in a fresh interpreter (best of --runs), so the numbers are what
+a Streamlit cold start / cron run actually pays. Exits with status 1 if any module goes
+over its budget, so it can be used as a regression check:
+
+    python benchmarks/startup.py
+    python benchmarks/startup.py --runs 10 --scale 1.5
+"""
+import os
+import sys
+import json
+import argparse
+import tempfile
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# seconds, on top of a bare interpreter start
+BUDGETS = {
+    "utils.google_utils": 0.10,
+    "utils.outbox": 0.05,
+    "utils.date_utils": 0.05,
+    "osteopatia_reminder": 0.05,
+    # streamlit import ~0.3s + running the script once in bare mode ~0.5s;
+    # the rest of what app.py imports must stay lazy
+    "app": 1.20,
+}
+
+_SNIPPET = """
+import time, sys
+t = time.perf_counter()
+import {module}
+print("__startup__=%r" % (time.perf_counter() - t))
+"""
+
+def measure(module: str, cwd: str, runs: int) -> float:
+    env = dict(os.environ, PYTHONPATH=ROOT + os.pathsep + os.environ.get("PYTHONPATH", ""))
+    best = None
+    for _ in range(runs):
+        out = subprocess.run(
+            [sys.executable, "-c", _SNIPPET.format(module=module)],
+            cwd=cwd, env=env, capture_output=True, text=True,
+        )
+        if out.returncode != 0:
+            raise RuntimeError(f"import {module} failed:\n{out.stderr}")
+        # the module itself may print: pick our marker line
+        line = [l for l in out.stdout.splitlines() if l.startswith("__startup__=")][-1]
+        elapsed = float(line.split("=", 1)[1])
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def _sandbox() -> str:
+    """Working dir with a minimal secrets.toml, so `import app` runs in Streamlit bare mode."""
+    d = tempfile.mkdtemp(prefix="startup_bench_")
+    os.makedirs(os.path.join(d, ".streamlit"))
+    os.makedirs(os.path.join(d, "tmp"))
+    with open(os.path.join(d, ".streamlit", "secrets.toml"), "w") as f:
+        f.write('[env]\nLOCAL_DEV = "True"\n')
+    return d
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--scale", type=float, default=1.0, help="multiply all budgets (slow CI machines)")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    cwd = _sandbox()
+    results = {}
+    for module, budget in BUDGETS.items():
+        elapsed = measure(module, cwd, args.runs)
+        results[module] = {"seconds": round(elapsed, 4), "budget": budget * args.scale, "ok": elapsed <= budget * args.scale}
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        for module, r in results.items():
+            flag = "ok  " if r["ok"] else "SLOW"
+            print(f"{flag} {module:<22} {r['seconds'] * 1000:8.1f} ms  (budget {r['budget'] * 1000:.0f} ms)")
+    return 0 if all(r["ok"] for r in results.values()) else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,106 @@
+"""
+Per-event cost of the text pipeline (name normalization, phone sanitization, date formatting)
+over a synthetic workload:
+
+    python benchmarks/text_pipeline.py
+    python benchmarks/text_pipeline.py --events 10000 --patients 400
+
+"uncached" calls the functions through __wrapped__, i.e. what every event paid before memoization.
+"payload" is the outbox payload of each reminder: formatted and serialized per event, or
+through the render cache of utils/messages.py.
+"""
+import os
+import sys
+import time
+import json
+import random
+import argparse
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils import contacts, date_utils, messages
+from utils.google_utils import sanitize_phone
+
+FIRST = ["Mario", "Anna", "Luca", "Giulia", "Niccolò", "Francesca", "Marco", "Chiara", "Davide", "Elena"]
+LAST = ["Rossi", "Bianchi", "D’Angelo", "Esposito", "Romano", "Colombo", "Ricci", "Marino", "Greco", "Bruno"]
+
+def synthetic_events(n_events: int, n_patients: int, seed: int = 1):
+    rnd = random.Random(seed)
+    patients = []
+    for _ in range(n_patients):
+        name = f"{rnd.choice(FIRST)} {rnd.choice(LAST)}"
+        phone = f"3{rnd.randint(20, 99)} {rnd.randint(100, 999)} {rnd.randint(1000, 9999)}"
+        summary = rnd.choice([name, f"{name} pz", f"{name} pz {phone}", f"{name} {phone}"])
+        patients.append((summary, phone))
+    start = datetime.now(ZoneInfo("Europe/Rome")).replace(minute=0, second=0, microsecond=0)
+    events = []
+    for i in range(n_events):
+        summary, phone = rnd.choice(patients)
+        # 30 minute slots over a few weeks: start strings repeat across events like a real calendar
+        when = (start + timedelta(minutes=30 * rnd.randint(0, 2000))).isoformat()
+        events.append((summary, phone, when))
+    return events
+
+def run(events, cached: bool) -> float:
+    if cached:
+        nq, nk, sp, parse = contacts.normalize_query, contacts.name_key, sanitize_phone, date_utils.parse_local_datetime
+        for f in (nq, nk, sp, parse):
+            f.cache_clear()
+    else:
+        nq, nk, sp = contacts.normalize_query.__wrapped__, contacts.name_key.__wrapped__, sanitize_phone.__wrapped__
+        parse = date_utils.parse_local_datetime.__wrapped__
+    # the formatters call parse_local_datetime from the module: swap it for the uncached run
+    original = date_utils.parse_local_datetime
+    date_utils.parse_local_datetime = parse
+    try:
+        t = time.perf_counter()
+        for summary, phone, when in events:
+            nq(summary)
+            nk(summary)
+            sp(phone)
+            date_utils.format_italian_datetime(when)
+            date_utils.format_italian_date_time(when)
+            date_utils.extract_time_hhmm(when)
+        return time.perf_counter() - t
+    finally:
+        date_utils.parse_local_datetime = original
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events", type=int, default=10_000)
+    parser.add_argument("--patients", type=int, default=400)
+    args = parser.parse_args()
+
+    events = synthetic_events(args.events, args.patients)
+    run(events[:100], cached=False)  # import phonenumbers metadata etc. outside the timing
+
+    uncached = run(events, cached=False)
+    cold = run(events, cached=True)
+    t = time.perf_counter()
+    for summary, phone, when in events:  # second pass on warm caches (e.g. next rerun / next day)
+        contacts.normalize_query(summary); contacts.name_key(summary); sanitize_phone(phone)
+        date_utils.format_italian_datetime(when); date_utils.format_italian_date_time(when); date_utils.extract_time_hhmm(when)
+    warm = time.perf_counter() - t
+
+    appointments = [{"start": when, "phone": "+39" + phone.replace(" ", ""), "event_name": summary, "name": summary}
+                    for summary, phone, when in events]
+    t = time.perf_counter()
+    for each in appointments:
+        json.dumps({"content_variables": json.dumps({"2": date_utils.format_italian_date_time(each["start"])})})
+    per_event = time.perf_counter() - t
+    engine = messages.load_engine()
+    t = time.perf_counter()
+    for each in appointments:
+        json.dumps(engine.render(each))
+    engine_total = time.perf_counter() - t
+
+    n = len(events)
+    print(f"{n} events, {args.patients} distinct patients")
+    for label, total in (("uncached", uncached), ("cached (cold)", cold), ("cached (warm)", warm),
+                         ("payload", per_event), ("payload cache", engine_total)):
+        print(f"{label:<14} total {total * 1000:8.1f} ms   per event {total / n * 1e6:7.1f} µs")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,318 @@
+"""
+Headless entry point (cron / small VM), no Streamlit involved:
+
+    python -m osteopatia_reminder run --date tomorrow --dry-run
+    python -m osteopatia_reminder run --date tomorrow --until 2026-11-03
+    python -m osteopatia_reminder run --date 2026-10-20 --secrets /etc/osteopatia/secrets.toml
+    python -m osteopatia_reminder run --pipeline   # send each reminder as soon as its contact is found
+    python -m osteopatia_reminder run --date today --until 2026-12-31 --stream   # constant memory
+
+    python -m osteopatia_reminder webhook                       # receive Twilio delivery statuses
+    python -m osteopatia_reminder fake-status SM123 delivered   # post a synthetic status callback
+    python -m osteopatia_reminder fake-calendar-change primary  # post a synthetic calendar push notification
+
+    python -m osteopatia_reminder precompute                    # tomorrow's plan, ready for the app (cron, every evening)
+    python -m osteopatia_reminder precompute --every 10         # and keep it up to date with the calendar changes
+
+    python -m osteopatia_reminder schedule                      # every practice of tenants.toml, at its send_at
+    python -m osteopatia_reminder schedule --now --dry-run      # run all of them once, right away
+
+Secrets come from the environment and/or the same secrets.toml used by the Streamlit app.
+The Google token must already exist in tmp/token.json (authorize once from the app).
+"""
+import os
+import sys
+import argparse
+from datetime import datetime, date, timedelta
+from zoneinfo import ZoneInfo
+
+TZ = "Europe/Rome"
+
+def parse_day(value: str) -> date:
+    today = datetime.now(ZoneInfo(TZ)).date()
+    if value == "today":
+        return today
+    if value == "tomorrow":
+        return today + timedelta(days=1)
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"data non valida: {value!r} (usa today, tomorrow o YYYY-MM-DD)")
+
+def cmd_run(args) -> int:
+    # imported here so that `--help` and argument errors stay instant
+    from utils.import_secrets import load_secrets
+    load_secrets(args.secrets)
+
+    from utils import tracing
+    if args.trace:
+        tracing.enable()
+    try:
+        return _run(args)
+    finally:
+        if args.trace:
+            tracing.export_jsonl(args.trace)
+        _print_quota()
+
+def _print_quota():
+    from utils import quota
+    if quota.stats():
+        print(f"Quote API: {quota.summary_line()}")
+
+def _target(each) -> str:
+    if each.get("review"):
+        return "da verificare: " + ", ".join(f"{c['name']} {c['score']:.0%}" for c in each["review"])
+    return f"{each['phone']}, da {each['phone_source']}" if each["phone"] else "nessun telefono"
+
+def _run(args) -> int:
+    from utils.google_utils import load_valid_credentials, get_events
+    from utils.date_utils import format_italian_datetime
+    from utils.messages import load_engine
+
+    creds = load_valid_credentials()
+    if not creds:
+        print("Token Google mancante o scaduto: autorizza l'accesso una volta dall'app Streamlit.", file=sys.stderr)
+        return 2
+
+    last = args.until or args.date
+    days = [args.date + timedelta(days=i) for i in range((last - args.date).days + 1)]
+    if args.pipeline and not args.dry_run:
+        return _run_pipeline(creds, days)
+    if args.stream:
+        return _run_stream(creds, days, args.dry_run)
+    appointments = get_events(creds, days=days) or []
+    to_send = [each for each in appointments if each["phone"]]
+    for each in appointments:
+        print(f"- {each['event_name']}: {format_italian_datetime(each['start'])} -> {each['name']} ({_target(each)})")
+    print(f"{len(to_send)}/{len(appointments)} promemoria da inviare dal {args.date.isoformat()} al {last.isoformat()}")
+    to_review = sum(1 for each in appointments if each.get("review"))
+    if to_review:
+        print(f"{to_review} contatti incerti non verranno avvisati: confermali nell'app")
+
+    if args.dry_run or not to_send:
+        return 0
+
+    from utils.outbox import enqueue, drain, recover_interrupted
+    recover_interrupted()
+    enqueue(to_send, load_engine().render)
+    stats = drain(wait=True)
+    print(f"Inviati: {stats['sent']}, non inviati: {stats['failed']}")
+    return 1 if stats["failed"] else 0
+
+def _run_pipeline(creds, days) -> int:
+    from utils.pipeline import run_pipeline
+    from utils.outbox import recover_interrupted
+    from utils.date_utils import format_italian_datetime
+    from utils.messages import load_engine
+
+    def on_progress(progress, appointment):
+        if appointment is not None:
+            print(f"- {appointment['event_name']}: {format_italian_datetime(appointment['start'])} -> {appointment['name']} ({_target(appointment)})")
+
+    recover_interrupted()
+    appointments, progress = run_pipeline(creds, days=days, send=True, on_progress=on_progress,
+                                          render=load_engine().render)
+    print(f"{progress['with_phone']}/{len(appointments)} promemoria dal {days[0].isoformat()} al {days[-1].isoformat()}")
+    print(f"Inviati: {progress['sent']}, non inviati: {progress['failed']}")
+    return 1 if progress["failed"] else 0
+
+def _run_stream(creds, days, dry_run: bool) -> int:
+    from utils.google_utils import iter_appointments
+    from utils.outbox import enqueue_stream, drain, recover_interrupted
+    from utils.date_utils import format_italian_datetime
+    from utils.messages import load_engine
+
+    counts = {"appointments": 0, "with_phone": 0}
+
+    def printed(stream):
+        for each in stream:
+            counts["appointments"] += 1
+            counts["with_phone"] += 1 if each.phone else 0
+            print(f"- {each.event_name}: {format_italian_datetime(each.start)} -> {each.name} ({_target(each)})")
+            yield each
+
+    stream = printed(iter_appointments(creds, days=days))
+    if dry_run:
+        for _ in stream:
+            pass
+    else:
+        recover_interrupted()
+        enqueue_stream(stream, load_engine().render)
+    print(f"{counts['with_phone']}/{counts['appointments']} promemoria dal {days[0].isoformat()} al {days[-1].isoformat()}")
+    if dry_run or not counts["with_phone"]:
+        return 0
+    stats = drain(wait=True)
+    print(f"Inviati: {stats['sent']}, non inviati: {stats['failed']}")
+    return 1 if stats["failed"] else 0
+
+def cmd_webhook(args) -> int:
+    from utils.import_secrets import load_secrets
+    load_secrets(args.secrets)
+    from utils import status_webhook
+    from utils.tenants import load_tenants, TENANTS_FILE
+    tenants_file = args.tenants or TENANTS_FILE
+    try:
+        # the scheduler's practices: their callbacks (?tenant=<id>) and calendar stores
+        tenants = load_tenants(tenants_file) if os.path.exists(tenants_file) else []
+    except (OSError, ValueError) as e:
+        print(f"File dei tenant non valido: {e}", file=sys.stderr)
+        return 2
+    server = status_webhook.make_server(args.host or status_webhook.STATUS_WEBHOOK_HOST,
+                                        args.port or status_webhook.STATUS_WEBHOOK_PORT, tenants=tenants)
+    host, port = server.server_address[:2]
+    print(f"Ricevo gli stati di consegna su http://{host}:{port}{status_webhook.STATUS_WEBHOOK_PATH} "
+          f"e le notifiche del calendario su {status_webhook.CALENDAR_WEBHOOK_PATH} (Ctrl+C per uscire)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+def cmd_fake_status(args) -> int:
+    from utils.import_secrets import load_secrets
+    load_secrets(args.secrets)
+    from utils.status_webhook import post_synthetic_callback
+    auth_token = None
+    if args.tenant:
+        from utils.tenants import load_tenants
+        tenant = next((t for t in load_tenants(args.tenants) if t.id == args.tenant), None)
+        if tenant is None:
+            print(f"Tenant sconosciuto: {args.tenant}", file=sys.stderr)
+            return 2
+        auth_token = tenant.twilio_auth_token
+    code = post_synthetic_callback(args.sid, args.status, url=args.url, error_code=args.error_code,
+                                   auth_token=auth_token, tenant=args.tenant)
+    print(f"HTTP {code}")
+    return 0 if code < 300 else 1
+
+def cmd_fake_calendar_change(args) -> int:
+    from utils.import_secrets import load_secrets
+    load_secrets(args.secrets)
+    from utils.status_webhook import post_synthetic_calendar_notification
+    try:
+        code = post_synthetic_calendar_notification(args.calendar_id, args.state, url=args.url)
+    except ValueError as e:
+        print(e)
+        return 1
+    print(f"HTTP {code}")
+    return 0 if code < 300 else 1
+
+def cmd_precompute(args) -> int:
+    from utils.import_secrets import load_secrets
+    load_secrets(args.secrets)
+    import time
+    from utils.google_utils import load_valid_credentials
+    from utils.plans import refresh_plan, describe
+
+    creds = load_valid_credentials()
+    if not creds:
+        print("Token Google mancante o scaduto: autorizza l'accesso una volta dall'app Streamlit.", file=sys.stderr)
+        return 2
+    last = args.until or args.date
+    days = [args.date + timedelta(days=i) for i in range((last - args.date).days + 1)]
+    full = args.full
+    while True:
+        plan = refresh_plan(creds, days, full=full)
+        with_phone = sum(1 for entry in plan["entries"].values() if entry["appointment"]["phone"])
+        print(f"Piano {describe(plan)} — {with_phone} promemoria su {len(plan['entries'])} appuntamenti")
+        if not args.every:
+            return 0
+        full = False
+        try:
+            time.sleep(args.every * 60)
+        except KeyboardInterrupt:
+            return 0
+
+def cmd_schedule(args) -> int:
+    from utils.import_secrets import load_secrets
+    load_secrets(args.secrets)
+    from utils.tenants import load_tenants
+    from utils.scheduler import Scheduler
+
+    try:
+        tenants = load_tenants(args.tenants)
+    except (OSError, ValueError) as e:
+        print(f"File dei tenant non valido: {e}", file=sys.stderr)
+        return 2
+    scheduler = Scheduler(tenants)
+    try:
+        if args.now:
+            results = scheduler.run_all(dry_run=args.dry_run)
+            for result in results:
+                line = f"{result['tenant']}: " + (f"errore: {result['error']}" if result.get("error") else
+                                                   f"{result.get('appointments', 0)} appuntamenti, {result.get('queued', 0)} promemoria")
+                print(line)
+            _print_quota()
+            return 1 if any(result.get("error") for result in results) else 0
+        if args.once:
+            for future in scheduler.tick():
+                future.result()
+            return 0
+        scheduler.run_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        scheduler.shutdown()
+    return 0
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="osteopatia_reminder", description="Promemoria WhatsApp per i pazienti")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    run = sub.add_parser("run", help="trova gli appuntamenti e invia i promemoria")
+    run.add_argument("--date", type=parse_day, default="tomorrow", help="today, tomorrow o YYYY-MM-DD (default: tomorrow)")
+    run.add_argument("--until", type=parse_day, default=None, help="ultimo giorno incluso, per più giorni in una volta (es. ponti)")
+    run.add_argument("--dry-run", action="store_true", help="mostra solo i messaggi che verrebbero inviati")
+    run.add_argument("--pipeline", action="store_true", help="invia ogni promemoria appena trovato il contatto, senza aspettare gli altri")
+    run.add_argument("--stream", action="store_true", help="calendari molto grandi: legge e mette in coda un po' alla volta, a memoria costante")
+    run.add_argument("--trace", default=None, metavar="FILE", help="registra i tempi di ogni fase in FILE (JSON lines)")
+    run.add_argument("--secrets", default=None, help="percorso di secrets.toml (default: $SECRETS_FILE o .streamlit/secrets.toml)")
+    run.set_defaults(func=cmd_run)
+
+    webhook = sub.add_parser("webhook", help="riceve gli stati di consegna da Twilio (status callback)")
+    webhook.add_argument("--host", default=None, help="default: $STATUS_WEBHOOK_HOST o 127.0.0.1")
+    webhook.add_argument("--port", type=int, default=None, help="default: $STATUS_WEBHOOK_PORT o 8765")
+    webhook.add_argument("--tenants", default=None, help="percorso di tenants.toml (default: $TENANTS_FILE o tenants.toml)")
+    webhook.add_argument("--secrets", default=None, help="percorso di secrets.toml")
+    webhook.set_defaults(func=cmd_webhook)
+
+    fake = sub.add_parser("fake-status", help="invia al ricevitore uno stato di consegna finto, per le prove")
+    fake.add_argument("sid", help="SID del messaggio (colonna sid dell'outbox)")
+    fake.add_argument("status", choices=["queued", "sent", "delivered", "read", "undelivered", "failed"])
+    fake.add_argument("--error-code", default=None)
+    fake.add_argument("--url", default=None, help="default: indirizzo locale del ricevitore")
+    fake.add_argument("--tenant", default=None, help="come la callback di questo studio di tenants.toml")
+    fake.add_argument("--tenants", default=None, help="percorso di tenants.toml (default: $TENANTS_FILE o tenants.toml)")
+    fake.add_argument("--secrets", default=None, help="percorso di secrets.toml")
+    fake.set_defaults(func=cmd_fake_status)
+
+    fake_cal = sub.add_parser("fake-calendar-change", help="invia al ricevitore una notifica finta di modifica del calendario")
+    fake_cal.add_argument("calendar_id", help="calendario con un canale di notifica aperto (CALENDAR_WEBHOOK_URL)")
+    fake_cal.add_argument("--state", choices=["exists", "not_exists", "sync"], default="exists")
+    fake_cal.add_argument("--url", default=None, help="default: indirizzo locale del ricevitore")
+    fake_cal.add_argument("--secrets", default=None, help="percorso di secrets.toml")
+    fake_cal.set_defaults(func=cmd_fake_calendar_change)
+
+    precompute = sub.add_parser("precompute", help="prepara il piano dei promemoria, che l'app mostra subito")
+    precompute.add_argument("--date", type=parse_day, default="tomorrow", help="today, tomorrow o YYYY-MM-DD (default: tomorrow)")
+    precompute.add_argument("--until", type=parse_day, default=None, help="ultimo giorno incluso")
+    precompute.add_argument("--full", action="store_true", help="ricalcola da zero invece di leggere solo le modifiche")
+    precompute.add_argument("--every", type=float, default=0, metavar="MINUTI", help="resta attivo e aggiorna il piano ogni MINUTI")
+    precompute.add_argument("--secrets", default=None, help="percorso di secrets.toml")
+    precompute.set_defaults(func=cmd_precompute)
+
+    schedule = sub.add_parser("schedule", help="più studi in un processo: ognuno all'orario di invio del suo tenants.toml")
+    schedule.add_argument("--tenants", default=None, help="percorso di tenants.toml (default: $TENANTS_FILE o tenants.toml)")
+    schedule.add_argument("--once", action="store_true", help="un solo controllo: avvia gli studi in orario ed esce")
+    schedule.add_argument("--now", action="store_true", help="avvia subito tutti gli studi, senza guardare l'orario")
+    schedule.add_argument("--dry-run", action="store_true", help="con --now: trova gli appuntamenti senza inviare")
+    schedule.add_argument("--secrets", default=None, help="percorso di secrets.toml")
+    schedule.set_defaults(func=cmd_schedule)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,29 @@
+from dataclasses import dataclass
+from typing import Optional
+
+@dataclass(slots=True)
+class Appointment:
+    """
+    One appointment of the streaming mode (google_utils.iter_appointments): same fields as
+    the dicts returned by get_events, without a per-instance __dict__.
+    Supports a["phone"] / a.get("phone") so the summary, render functions and
+    outbox.enqueue work with both.
+    """
+    event_id: Optional[str]
+    event_name: str
+    day: str
+    start: str
+    calendar_id: Optional[str]
+    phone_source: Optional[str]
+    name: str
+    phone: Optional[str]
+    review: Optional[list] = None  # candidates to confirm, when the contact match is uncertain
+
+    def __getitem__(self, key: str):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def get(self, key: str, default=None):
+        return getattr(self, key, default)
@@ -0,0 +1,461 @@
+import os
+import re
+import json
+import time
+import heapq
+import unicodedata
+from collections import Counter
+from functools import lru_cache
+from typing import Optional, Dict, Any, Iterator, Tuple, List
+
+from utils import tracing, quota
+
+# Fields we need from the People API to match an event summary to a patient
+PERSON_FIELDS = "names,phoneNumbers,metadata"
+CONNECTIONS_PAGE_SIZE = 1000  # max allowed by connections().list
+
+# On-disk cache, next to token.json
+CONTACTS_CACHE_FILE = os.path.join("tmp", "contacts_cache.json")
+CONTACTS_CACHE_MAX_AGE = int(os.getenv("CONTACTS_CACHE_MAX_AGE", "900"))  # seconds without asking Google for changes
+
+# Name matching: every match gets a confidence in [0, 1]. Below MATCH_REVIEW_THRESHOLD the
+# appointment is not messaged automatically: the app shows the MATCH_TOP_K candidates to confirm.
+MATCH_REVIEW_THRESHOLD = float(os.getenv("MATCH_REVIEW_THRESHOLD", "0.85"))
+MATCH_MIN_SCORE = 0.5     # below this a contact is not even a candidate
+MATCH_TOP_K = 3
+MATCH_MARGIN = 0.1        # a runner-up (with another number) closer than this lowers the confidence, twice the gap
+MATCH_POOL = 20           # contacts scored per summary, picked from the n-gram / token index
+MATCH_REPEAT = 0.75       # an extra summary word this close to a contact word is a misspelt name word, not a note
+
+# ---- Name normalization ----
+
+_PHONE_PATTERN = re.compile(r'(?:\+?0{0,2}39)?\s*[\d\s.\-]{6,15}')
+_PZ_SUFFIX = re.compile(r'\s*[Pp][Zz]\s*$')
+_MULTI_SPACE = re.compile(r'\s{2,}')
+_QUOTES = str.maketrans({'’': " ", '‘': " ", '“': ' ', '”': ' ', "'": " "})
+_TOKEN_SPLIT = re.compile(r"[^\w]+")
+
+@lru_cache(maxsize=8192)
+def normalize_query(q: str) -> str:
+    # Normalize Unicode (e.g., é -> é)
+    q = unicodedata.normalize('NFKD', q)
+    # Replace curly quotes with straight ones
+    q = q.translate(_QUOTES)
+
+    # Remove phone number and strip extra whitespace
+    cleaned = _PHONE_PATTERN.sub('', q).strip()
+
+    # Remove final pz at the end
+    cleaned = _PZ_SUFFIX.sub('', cleaned).strip()
+
+    # Collapse multiple spaces if phone number was in the middle
+    cleaned = _MULTI_SPACE.sub(' ', cleaned)
+    return cleaned
+
+def find_phone_numbers(text: str):
+    """Candidate phone numbers written in free text (summary "Mario Rossi pz 333 1234567", description)."""
+    return [m.group(0).strip(" .-") for m in _PHONE_PATTERN.finditer(text or "") if sum(c.isdigit() for c in m.group(0)) >= 6]
+
+@lru_cache(maxsize=8192)
+def name_key(text: str) -> str:
+    """
+    Lookup key for a name: same rules as normalize_query, then drop accents and case
+    so "Niccolò Rossi pz" and "niccolo rossi" end up on the same key.
+    """
+    cleaned = normalize_query(text or "")
+    cleaned = "".join(c for c in cleaned if not unicodedata.combining(c))
+    return cleaned.casefold()
+
+def _tokens(key: str):
+    return tuple(t for t in _TOKEN_SPLIT.split(key) if t)
+
+# ---- Name scoring ----
+
+@lru_cache(maxsize=65536)
+def _grams(token: str) -> frozenset:
+    """Character trigrams of a token, padded so short tokens and word edges count too."""
+    padded = f" {token} "
+    return frozenset(padded[i:i + 3] for i in range(len(padded) - 2))
+
+@lru_cache(maxsize=65536)
+def token_similarity(a: str, b: str) -> float:
+    """1 - edit distance (with swapped letters) / longer length: "rosi" ~ "rossi" = 0.8."""
+    if a == b:
+        return 1.0
+    if not a or not b:
+        return 0.0
+    prev2, prev = None, list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        cur = [i] + [0] * len(b)
+        for j, cb in enumerate(b, 1):
+            cur[j] = min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + (ca != cb))
+            if i > 1 and j > 1 and ca == b[j - 2] and a[i - 2] == cb:
+                cur[j] = min(cur[j], prev2[j - 2] + 1)
+        prev2, prev = prev, cur
+    return 1.0 - prev[-1] / max(len(a), len(b))
+
+@lru_cache(maxsize=65536)
+def _score_tokens(key: str) -> tuple:
+    # a lone letter goes with the next word: "D'Angelo", "D Angelo" and "DAngelo" are the same name
+    out, pending = [], ""
+    for t in _tokens(key):
+        if len(t) == 1 and not pending:
+            pending = t
+            continue
+        out.append(pending + t)
+        pending = ""
+    if pending:
+        out.append(pending)
+    return tuple(out)
+
+def _similar(a: str, b: str) -> float:
+    if abs(len(a) - len(b)) * 2 > max(len(a), len(b)):
+        return 0.0  # too different in length to reach 0.5
+    return token_similarity(a, b)
+
+def score_name(summary_tokens, contact_tokens) -> float:
+    """
+    How well a contact name fits an event summary, in [0, 1]: every word of the contact
+    should be in the summary (typos cost a little), extra words in the summary (notes) cost
+    less, and words in another order ("Rossi Mario") a little. An extra word that looks like
+    a word of the contact is not a note: "Giovanni Esposiito Esposito" names one more Esposito
+    than "Giovanni Esposito" has, so it counts as a missing word.
+    """
+    if not summary_tokens or not contact_tokens:
+        return 0.0
+    free = dict(enumerate(summary_tokens))
+    total = 0.0
+    pairs = []  # (position in the contact name, position in the summary)
+    # exact words first, so a typo cannot take the place of the word written right
+    left = []
+    for ci, c in enumerate(contact_tokens):
+        si = next((i for i, t in free.items() if t == c), None)
+        if si is None:
+            left.append(ci)
+            continue
+        del free[si]
+        total += 1.0
+        pairs.append((ci, si))
+    for ci in sorted(left, key=lambda i: -len(contact_tokens[i])):
+        if not free:
+            break
+        c = contact_tokens[ci]
+        si, sim = None, 0.0
+        for i, t in free.items():
+            s = _similar(c, t)
+            if s > sim:
+                si, sim = i, s
+        if sim >= 0.5:
+            del free[si]
+            total += sim
+            pairs.append((ci, si))
+    # an extra word like one of the contact's is a name word the contact does not have
+    repeats = sum(1 for t in free.values() if any(_similar(c, t) >= MATCH_REPEAT for c in contact_tokens))
+    coverage = total / (len(contact_tokens) + repeats)
+    precision = (len(summary_tokens) - len(free)) / len(summary_tokens)
+    in_order = [si for _, si in sorted(pairs)] == sorted(si for _, si in pairs)
+    score = coverage * (0.8 + 0.2 * precision) * (1.0 if in_order else 0.95)
+    if len(contact_tokens) == 1 and len(summary_tokens) > 1:
+        score = min(score, 0.8)  # a lone surname in the address book fits too many summaries
+    return score
+
+def rank_contacts(summary: str, contacts: List[Dict[str, Any]], k: int = MATCH_TOP_K,
+                  tokens: Optional[List[tuple]] = None) -> Optional[Dict[str, Any]]:
+    """
+    Best contact for a summary among `contacts`, as a copy with "confidence" and
+    "candidates" (top k: name, phone, resource_name, score). None if nothing scores
+    MATCH_MIN_SCORE. Contacts with the same number count as one (duplicates).
+    `tokens`: the words of each contact name, when already known (ContactIndex).
+    """
+    summary_tokens = _score_tokens(name_key(summary))
+    scored = []
+    if tokens is None:
+        tokens = [_score_tokens(name_key(contact["name"])) for contact in contacts]
+    for contact, words in zip(contacts, tokens):
+        score = score_name(summary_tokens, words)
+        if score >= MATCH_MIN_SCORE:
+            scored.append((score, words, contact))
+    if not scored:
+        return None
+    # ties: the longer name (it explains more of the summary), the one with a phone number, a stable order
+    scored.sort(key=lambda x: (-round(x[0], 3), -len(x[1]), x[2]["phone"] is None, x[2].get("resource_name") or ""))
+    best_score, best_tokens, best = scored[0]
+    # a close runner-up with another number could be either of them; a part of the best name
+    # ("Paolo Santoro" for "Paolo Costa Santoro") is not a different reading of the summary,
+    # a name with a word repeated ("Giovanni Esposito Esposito" for "Giovanni Esposito") is
+    best_words = Counter(best_tokens)
+    runner_up = next((score for score, tokens, c in scored[1:]
+                      if c["phone"] != best["phone"] and not Counter(tokens) <= best_words), 0.0)
+    confidence = best_score - 2 * max(0.0, MATCH_MARGIN - (best_score - runner_up))
+    candidates = [{"name": c["name"], "phone": c["phone"], "resource_name": c.get("resource_name"), "score": round(score, 2)}
+                  for score, _, c in scored[:k]]
+    return {**best, "confidence": round(max(0.0, confidence), 3), "candidates": candidates}
+
+def is_confident(contact: Optional[Dict[str, Any]]) -> bool:
+    """A resolved contact good enough to message without asking (remembered ones have no confidence: they are)."""
+    return contact is not None and not contact.get("error") and contact.get("confidence", 1.0) >= MATCH_REVIEW_THRESHOLD
+
+# ---- People API helpers ----
+
+def person_to_contact(person: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Reduce a People API person to the small dict the rest of the app uses."""
+    names = person.get("names") or []
+    if not names or not names[0].get("displayName"):
+        return None
+    phones = person.get("phoneNumbers") or []
+    phone = None
+    if phones:
+        phone = phones[0].get("canonicalForm") or phones[0].get("value")
+    return {
+        "resource_name": person.get("resourceName"),
+        "name": names[0]["displayName"],
+        "phone": phone,
+    }
+
+def iter_connections(people_service, person_fields: str = PERSON_FIELDS, sync_token: Optional[str] = None,
+                     result: Optional[Dict[str, Any]] = None) -> Iterator[Dict[str, Any]]:
+    """
+    Page through every connection of the user (not just the first page).
+    Always asks for a sync token; when sync_token is given only the changes since then are returned.
+    The nextSyncToken of the last page is stored in result["sync_token"] if a dict is passed.
+    """
+    page_token = None
+    while True:
+        params = dict(
+            resourceName="people/me",
+            pageSize=CONNECTIONS_PAGE_SIZE,
+            pageToken=page_token,
+            personFields=person_fields,
+            requestSyncToken=True,
+        )
+        if sync_token:
+            params["syncToken"] = sync_token
+        tracing.count("people.connections.list")
+        with tracing.span("people.connections.list"):
+            resp = quota.call(quota.for_service("people", people_service), people_service.people().connections().list(**params).execute)
+        for person in resp.get("connections", []):
+            yield person
+        page_token = resp.get("nextPageToken")
+        if not page_token:
+            if result is not None:
+                result["sync_token"] = resp.get("nextSyncToken")
+            break
+
+# ---- In-memory index ----
+
+class ContactIndex:
+    """
+    In-memory lookup of contacts by normalized name.
+    match() takes the exact key (or the same words in another order) when there is one;
+    otherwise the words of the summary pick candidates from a token index, with a trigram
+    index over the known words for the misspelled ones, and the best MATCH_POOL are scored
+    with score_name().
+    """
+
+    def __init__(self):
+        self.contacts: Dict[str, Dict[str, Any]] = {}  # resource_name -> contact
+        self._by_key: Dict[str, set] = {}
+        self._by_sorted_tokens: Dict[tuple, set] = {}
+        self._by_token: Dict[str, set] = {}
+        self._by_gram: Dict[str, set] = {}  # trigram -> known tokens containing it
+        self._words: Dict[str, tuple] = {}   # resource_name -> words of the name, as scored
+
+    def __len__(self):
+        return len(self.contacts)
+
+    def add(self, contact: Dict[str, Any]):
+        rn = contact.get("resource_name") or contact["name"]
+        if rn in self.contacts:
+            self.remove(rn)
+        self.contacts[rn] = contact
+        key = name_key(contact["name"])
+        tokens = _tokens(key)
+        self._by_key.setdefault(key, set()).add(rn)
+        self._by_sorted_tokens.setdefault(tuple(sorted(tokens)), set()).add(rn)
+        self._words[rn] = _score_tokens(key)
+        for t in tokens:
+            if t not in self._by_token:
+                for g in _grams(t):
+                    self._by_gram.setdefault(g, set()).add(t)
+            self._by_token.setdefault(t, set()).add(rn)
+
+    def remove(self, resource_name: str):
+        contact = self.contacts.pop(resource_name, None)
+        if contact is None:
+            return
+        self._words.pop(resource_name, None)
+        key = name_key(contact["name"])
+        tokens = _tokens(key)
+        for table, k in ((self._by_key, key), (self._by_sorted_tokens, tuple(sorted(tokens)))):
+            bucket = table.get(k)
+            if bucket:
+                bucket.discard(resource_name)
+                if not bucket:
+                    del table[k]
+        for t in tokens:
+            bucket = self._by_token.get(t)
+            if bucket:
+                bucket.discard(resource_name)
+                if not bucket:
+                    del self._by_token[t]
+                    for g in _grams(t):
+                        known = self._by_gram.get(g)
+                        if known:
+                            known.discard(t)
+                            if not known:
+                                del self._by_gram[g]
+
+    def _similar_tokens(self, token: str, limit: int = 5) -> List[Tuple[str, float]]:
+        """Known tokens spelled like `token` (typos), via the trigrams they share."""
+        grams = _grams(token)
+        shared: Dict[str, int] = {}
+        for g in grams:
+            for t in self._by_gram.get(g, ()):
+                shared[t] = shared.get(t, 0) + 1
+        close = heapq.nlargest(limit * 2, shared, key=lambda t: 2 * shared[t] / (len(grams) + len(_grams(t))))
+        similar = [(t, token_similarity(token, t)) for t in close]
+        return [(t, sim) for t, sim in sorted(similar, key=lambda x: -x[1])[:limit] if sim >= 0.5]
+
+    def _exact(self, bucket) -> Dict[str, Any]:
+        contacts = [self.contacts[rn] for rn in bucket]
+        # prefer a contact that has a phone number, then a stable order
+        contacts.sort(key=lambda c: (c["phone"] is None, c.get("resource_name") or c["name"]))
+        phones = {c["phone"] for c in contacts if c["phone"]}
+        candidates = [{"name": c["name"], "phone": c["phone"], "resource_name": c.get("resource_name"), "score": 1.0}
+                      for c in contacts[:MATCH_TOP_K]]
+        # namesakes with different numbers: which one is it?
+        return {**contacts[0], "confidence": 1.0 if len(phones) <= 1 else 0.5, "candidates": candidates}
+
+    def match(self, summary: str, k: int = MATCH_TOP_K) -> Optional[Dict[str, Any]]:
+        """
+        Best contact for an event summary, as a copy with "confidence" and the top `k`
+        "candidates" (see rank_contacts), or None.
+        """
+        key = name_key(summary)
+        if not key:
+            return None
+        # 1) exact
+        if key in self._by_key:
+            return self._exact(self._by_key[key])
+        tokens = _tokens(key)
+        # 2) same tokens, different order ("Rossi Mario")
+        sorted_tokens = tuple(sorted(tokens))
+        if sorted_tokens in self._by_sorted_tokens:
+            return self._exact(self._by_sorted_tokens[sorted_tokens])
+        # 3) candidates sharing words (or words spelled almost the same), then scored
+        weights: Dict[str, float] = {}
+        for t in set(tokens):
+            matches = [(t, 1.0)] if t in self._by_token else self._similar_tokens(t) if len(t) >= 3 else []
+            for known, sim in matches:
+                for rn in self._by_token[known]:
+                    weights[rn] = weights.get(rn, 0.0) + sim
+        if not weights:
+            return None
+        pool = heapq.nlargest(MATCH_POOL, weights, key=weights.get)
+        return rank_contacts(summary, [self.contacts[rn] for rn in pool], k, [self._words[rn] for rn in pool])
+
+# ---- Persistent cache + incremental sync ----
+
+def load_contact_cache(path: str = CONTACTS_CACHE_FILE) -> Dict[str, Any]:
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return data if isinstance(data, dict) else {}
+    except Exception as e:
+        print(f"Warning: could not load contact cache: {e}")
+        return {}
+
+def save_contact_cache(index: ContactIndex, sync_token: Optional[str], path: str = CONTACTS_CACHE_FILE):
+    d = os.path.dirname(path) or "."
+    os.makedirs(d, exist_ok=True)
+    payload = {"sync_token": sync_token, "synced_at": time.time(), "contacts": list(index.contacts.values())}
+    tmp_path = path + ".tmp"
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(payload, f, ensure_ascii=False)
+        # contacts are personal data: owner read/write only
+        try:
+            os.chmod(tmp_path, 0o600)
+        except Exception:
+            pass
+        os.replace(tmp_path, path)
+    except Exception as e:
+        print(f"Warning: failed to save contact cache to {path}: {e}")
+
+def _is_expired_sync_token(e: Exception) -> bool:
+    # HttpError from googleapiclient: 410 GONE, or 400 with EXPIRED_SYNC_TOKEN in the body
+    status = getattr(getattr(e, "resp", None), "status", None)
+    if status == 410:
+        return True
+    content = getattr(e, "content", b"") or b""
+    if isinstance(content, bytes):
+        content = content.decode("utf-8", "ignore")
+    return status == 400 and "EXPIRED_SYNC_TOKEN" in content
+
+def _apply_changes(index: ContactIndex, people_service, sync_token: Optional[str]) -> Tuple[Optional[str], set]:
+    """Apply added/changed/deleted people to the index. Returns (next sync token, changed resource names)."""
+    result: Dict[str, Any] = {}
+    changed = set()
+    for person in iter_connections(people_service, sync_token=sync_token, result=result):
+        rn = person.get("resourceName")
+        changed.add(rn)
+        if (person.get("metadata") or {}).get("deleted"):
+            if rn:
+                index.remove(rn)
+        else:
+            contact = person_to_contact(person)
+            if contact:
+                index.add(contact)
+            elif rn:
+                # the contact lost its name: it can no longer be matched
+                index.remove(rn)
+    return result.get("sync_token"), changed
+
+def sync_contact_index(people_service=None, path: str = CONTACTS_CACHE_FILE,
+                       max_age: int = CONTACTS_CACHE_MAX_AGE, force: bool = False,
+                       memo_path: Optional[str] = None) -> ContactIndex:
+    """
+    Return a ContactIndex backed by the on-disk cache.
+      - cache younger than max_age: no network call at all (people_service may be None);
+      - cache with a sync token: only the changes since the last sync are downloaded;
+      - no cache or expired token: full resync.
+    Changed contacts are dropped from the resolution memo at memo_path (default tmp/).
+    """
+    cache = load_contact_cache(path)
+    index = ContactIndex()
+    for contact in cache.get("contacts", []):
+        index.add(contact)
+
+    fresh = cache and time.time() - cache.get("synced_at", 0) < max_age
+    tracing.cache("contacts.disk_cache", bool(fresh and not force))
+    if fresh and not force:
+        return index
+    if people_service is None:
+        # nothing better available: stale data is still better than no data
+        return index
+
+    sync_token = cache.get("sync_token")
+    if sync_token:
+        try:
+            sync_token, changed = _apply_changes(index, people_service, sync_token)
+            print(f"Contatti sincronizzati: {len(changed)} modifiche")
+            save_contact_cache(index, sync_token, path)
+            if changed:
+                # remembered event -> contact resolutions of these people may be stale now
+                from utils.resolution_memo import invalidate_contacts, MEMO_FILE
+                invalidate_contacts(changed, path=memo_path or MEMO_FILE)
+            return index
+        except Exception as e:
+            if not _is_expired_sync_token(e):
+                raise
+            print("Sync token scaduto, risincronizzo tutti i contatti")
+
+    index = ContactIndex()
+    sync_token, _ = _apply_changes(index, people_service, None)
+    print(f"Indicizzati {len(index)} contatti")
+    save_contact_cache(index, sync_token, path)
+    from utils.resolution_memo import invalidate_all, MEMO_FILE
+    invalidate_all(path=memo_path or MEMO_FILE)
+    return index
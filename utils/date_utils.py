@@ -0,0 +1,84 @@
+from datetime import date, datetime, timedelta
+from functools import lru_cache
+from zoneinfo import ZoneInfo
+
+# Month / weekday names and the reminder's date format per message language (utils/messages.py).
+# "date_time" gets day, month and time; the day + month strings are built once here, not per message.
+LOCALES = {
+    "it": {"months": ["Gennaio", "Febbraio", "Marzo", "Aprile", "Maggio", "Giugno",
+                      "Luglio", "Agosto", "Settembre", "Ottobre", "Novembre", "Dicembre"],
+           "weekdays": ["Lunedì", "Martedì", "Mercoledì", "Giovedì", "Venerdì", "Sabato", "Domenica"],
+           "day_month": "{day} {month}", "date_time": "*{day_month}* alle ore *{time}*"},
+    "en": {"months": ["January", "February", "March", "April", "May", "June",
+                      "July", "August", "September", "October", "November", "December"],
+           "weekdays": ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"],
+           "day_month": "{month} {day}", "date_time": "*{day_month}* at *{time}*"},
+    "de": {"months": ["Januar", "Februar", "März", "April", "Mai", "Juni",
+                      "Juli", "August", "September", "Oktober", "November", "Dezember"],
+           "weekdays": ["Montag", "Dienstag", "Mittwoch", "Donnerstag", "Freitag", "Samstag", "Sonntag"],
+           "day_month": "{day}. {month}", "date_time": "*{day_month}* um *{time}* Uhr"},
+    "fr": {"months": ["janvier", "février", "mars", "avril", "mai", "juin",
+                      "juillet", "août", "septembre", "octobre", "novembre", "décembre"],
+           "weekdays": ["lundi", "mardi", "mercredi", "jeudi", "vendredi", "samedi", "dimanche"],
+           "day_month": "{day} {month}", "date_time": "*{day_month}* à *{time}*"},
+    "es": {"months": ["enero", "febrero", "marzo", "abril", "mayo", "junio",
+                      "julio", "agosto", "septiembre", "octubre", "noviembre", "diciembre"],
+           "weekdays": ["lunes", "martes", "miércoles", "jueves", "viernes", "sábado", "domingo"],
+           "day_month": "{day} de {month}", "date_time": "*{day_month}* a las *{time}*"},
+}
+# language -> [month][day] -> "11 Ottobre" (index 0 unused)
+DAY_MONTH = {lang: [[locale["day_month"].format(day=d, month=m) for d in range(32)] for m in locale["months"]]
+             for lang, locale in LOCALES.items()}
+
+ITALIAN_MONTHS = LOCALES["it"]["months"]
+
+@lru_cache(maxsize=None)
+def _zone(tz: str) -> ZoneInfo:
+    return ZoneInfo(tz)
+
+@lru_cache(maxsize=8192)
+def parse_local_datetime(iso_dt: str, tz: str = "Europe/Rome") -> datetime:
+    """
+    ISO string from the Calendar API -> aware datetime in `tz`.
+    Parsed once per (string, tz) and shared by all the formatters below.
+    """
+    # Handle UTC 'Z' suffix
+    if iso_dt.endswith("Z"):
+        iso_dt = iso_dt[:-1] + "+00:00"
+    return datetime.fromisoformat(iso_dt).astimezone(_zone(tz))
+
+def _hhmm(local_dt: datetime) -> str:
+    # same as strftime("%H:%M"), without the strftime overhead
+    return f"{local_dt.hour:02d}:{local_dt.minute:02d}"
+
+def format_italian_datetime(iso_dt: str, tz: str = "Europe/Rome") -> str:
+    local_dt = parse_local_datetime(iso_dt, tz)
+    tomorrow = datetime.now(_zone(tz)).date() + timedelta(days=1)
+    day_month = DAY_MONTH["it"][local_dt.month - 1][local_dt.day]
+    time_str = _hhmm(local_dt)
+    if local_dt.date() == tomorrow:
+        return f"Domani {day_month} alle {time_str}"
+    else:
+        return f"{day_month} alle {time_str}"
+
+def extract_time_hhmm(iso_dt: str, tz: str = "Europe/Rome") -> str:
+    return _hhmm(parse_local_datetime(iso_dt, tz))
+
+def format_date_time(iso_dt: str, language: str = "it", tz: str = "Europe/Rome") -> str:
+    """The reminder's date in `language`: "*11 Ottobre* alle ore *15:00*", "*October 11* at *15:00*"."""
+    local_dt = parse_local_datetime(iso_dt, tz)
+    return LOCALES[language]["date_time"].format(day_month=DAY_MONTH[language][local_dt.month - 1][local_dt.day],
+                                                 time=_hhmm(local_dt))
+
+def format_italian_date_time(iso_dt: str, tz: str = "Europe/Rome") -> str:
+    """
+    Convert an ISO datetime string with offset to a string like:
+      "*11 ottobre* alle ore *15:00*"
+    """
+    return format_date_time(iso_dt, "it", tz)
+
+ITALIAN_WEEKDAYS = LOCALES["it"]["weekdays"]
+
+def format_italian_day(day: date) -> str:
+    """"Sabato 18 Ottobre" """
+    return f"{ITALIAN_WEEKDAYS[day.weekday()]} {day.day} {ITALIAN_MONTHS[day.month - 1]}"
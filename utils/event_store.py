@@ -0,0 +1,372 @@
+import os
+import json
+import time
+import uuid
+import secrets
+import sqlite3
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Optional, Dict, Any, List, Tuple
+
+from utils import tracing, quota
+
+# Local copy of the calendars, kept up to date with Calendar sync tokens: the first read of a
+# calendar lists everything from yesterday on (full sync), every following read asks only
+# what changed since (events.list with syncToken: usually a single small page).
+#
+# With CALENDAR_WEBHOOK_URL (public https URL of the receiver in utils/status_webhook.py,
+# path /google/calendar) each calendar also gets a watch channel: Google notifies every
+# change, and until a notification arrives reads come straight from the store, without any
+# call at all. STORE_MAX_AGE still forces a delta call now and then, in case a notification
+# got lost.
+#
+# Every sync records the appointments added, moved or cancelled since the previous one, for
+# the app to highlight until they have been seen.
+EVENTS_FILE = os.path.join("tmp", "events.sqlite3")
+EVENT_STORE = os.getenv("EVENT_STORE", "1") == "1"
+STORE_PAST_DAYS = 1              # the store starts from yesterday: older days are read directly
+STORE_MAX_AGE = float(os.getenv("EVENT_STORE_MAX_AGE", "3600"))  # seconds between delta calls when watched
+CALENDAR_WEBHOOK_URL = os.getenv("CALENDAR_WEBHOOK_URL")
+CHANNEL_TTL = 7 * 24 * 3600      # seconds; Google caps it anyway
+CHANNEL_RENEW_BEFORE = 3600      # renew channels expiring within an hour
+
+ADDED = "added"
+MOVED = "moved"
+CANCELLED = "cancelled"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS calendars (
+    calendar_id TEXT PRIMARY KEY,
+    sync_token TEXT,
+    window_start TEXT,
+    synced_at REAL,
+    dirty INTEGER NOT NULL DEFAULT 1,
+    channel_id TEXT,
+    channel_resource_id TEXT,
+    channel_token TEXT,
+    channel_expires_at REAL
+);
+CREATE TABLE IF NOT EXISTS events (
+    calendar_id TEXT NOT NULL,
+    event_id TEXT NOT NULL,
+    start_ts REAL NOT NULL,
+    series_id TEXT,
+    data TEXT NOT NULL,
+    PRIMARY KEY (calendar_id, event_id)
+);
+CREATE INDEX IF NOT EXISTS events_start ON events (calendar_id, start_ts);
+CREATE INDEX IF NOT EXISTS events_series ON events (calendar_id, series_id);
+CREATE TABLE IF NOT EXISTS changes (
+    calendar_id TEXT NOT NULL,
+    event_id TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    summary TEXT,
+    old_start TEXT,
+    new_start TEXT,
+    changed_at REAL NOT NULL,
+    PRIMARY KEY (calendar_id, event_id)
+);
+"""
+
+def _connect(path: str = EVENTS_FILE) -> sqlite3.Connection:
+    d = os.path.dirname(path) or "."
+    os.makedirs(d, exist_ok=True)
+    conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript(_SCHEMA)
+    return conn
+
+# one sync at a time per calendar in this process: two sessions opening the app together
+# make one delta call, not two
+_sync_locks: Dict[Tuple[str, str], threading.Lock] = {}
+_sync_locks_guard = threading.Lock()
+
+def _sync_lock(path: str, calendar_id: str) -> threading.Lock:
+    with _sync_locks_guard:
+        return _sync_locks.setdefault((os.path.abspath(path), calendar_id), threading.Lock())
+
+def _start(ev) -> str:
+    return ev["start"].get("dateTime", ev["start"].get("date"))
+
+def _start_ts(ev) -> float:
+    from utils.google_utils import _start_sort_key
+    return _start_sort_key(ev).timestamp()
+
+def _ts(rfc3339: str) -> float:
+    return datetime.fromisoformat(rfc3339.replace("Z", "+00:00")).timestamp()
+
+def _is_gone(e: Exception) -> bool:
+    # 410: sync token expired or invalidated, a full sync is needed
+    return quota.error_status(e) == 410
+
+def _list_pages(cal_service, calendar_id, http=None, **params):
+    """All pages of an events.list; returns (items, next sync token). http: the worker thread's connection."""
+    items, page_token = [], None
+    while True:
+        request = cal_service.events().list(calendarId=calendar_id, singleEvents=True, maxResults=2500,
+                                            pageToken=page_token, **params)
+        tracing.count("calendar.events.list")
+        with tracing.span("calendar.events.list", calendar=calendar_id, sync="delta" if "syncToken" in params else "full"):
+            resp = quota.call(quota.for_service("calendar", cal_service), lambda: request.execute(http=http))
+        items.extend(resp.get("items", []))
+        page_token = resp.get("nextPageToken")
+        if not page_token:
+            return items, resp.get("nextSyncToken")
+
+def _record_change(conn, calendar_id, event_id, kind, summary, old_start, new_start):
+    previous = conn.execute("SELECT kind, old_start FROM changes WHERE calendar_id = ? AND event_id = ?",
+                            (calendar_id, event_id)).fetchone()
+    if previous is not None:
+        # not seen yet: keep what it looked like at the last check
+        if previous["kind"] == ADDED and kind == CANCELLED:
+            conn.execute("DELETE FROM changes WHERE calendar_id = ? AND event_id = ?", (calendar_id, event_id))
+            return
+        if previous["kind"] == ADDED:
+            kind = ADDED
+        old_start = previous["old_start"]
+        if kind == MOVED and old_start == new_start:
+            conn.execute("DELETE FROM changes WHERE calendar_id = ? AND event_id = ?", (calendar_id, event_id))
+            return
+    conn.execute("INSERT OR REPLACE INTO changes (calendar_id, event_id, kind, summary, old_start, new_start, changed_at) "
+                 "VALUES (?, ?, ?, ?, ?, ?, ?)", (calendar_id, event_id, kind, summary, old_start, new_start, time.time()))
+
+def _apply(conn, calendar_id: str, items: List[Dict[str, Any]], track: bool) -> int:
+    """Write a delta (or a whole listing) into the store; returns the number of changes recorded."""
+    changes = 0
+    for ev in items:
+        row = conn.execute("SELECT data FROM events WHERE calendar_id = ? AND event_id = ?", (calendar_id, ev["id"])).fetchone()
+        old = json.loads(row["data"]) if row else None
+        if ev.get("status") == "cancelled":
+            gone = [old] if old else []
+            # a cancelled series takes all its occurrences with it
+            gone += [json.loads(r["data"]) for r in conn.execute(
+                "SELECT data FROM events WHERE calendar_id = ? AND series_id = ?", (calendar_id, ev["id"]))]
+            conn.execute("DELETE FROM events WHERE calendar_id = ? AND (event_id = ? OR series_id = ?)",
+                         (calendar_id, ev["id"], ev["id"]))
+            if track:
+                for each in gone:
+                    _record_change(conn, calendar_id, each["id"], CANCELLED, each.get("summary", ""), _start(each), None)
+                    changes += 1
+            continue
+        if "start" not in ev:
+            continue
+        conn.execute("INSERT OR REPLACE INTO events (calendar_id, event_id, start_ts, series_id, data) VALUES (?, ?, ?, ?, ?)",
+                     (calendar_id, ev["id"], _start_ts(ev), ev.get("recurringEventId"), json.dumps(ev, ensure_ascii=False)))
+        if not track:
+            continue
+        if old is None:
+            _record_change(conn, calendar_id, ev["id"], ADDED, ev.get("summary", ""), None, _start(ev))
+            changes += 1
+        elif _start(old) != _start(ev):
+            _record_change(conn, calendar_id, ev["id"], MOVED, ev.get("summary", ""), _start(old), _start(ev))
+            changes += 1
+    return changes
+
+def _full_sync(conn, cal_service, calendar_id: str, http=None) -> Dict[str, Any]:
+    window_start = (datetime.now(timezone.utc) - timedelta(days=STORE_PAST_DAYS)).replace(hour=0, minute=0, second=0, microsecond=0)
+    window = window_start.strftime("%Y-%m-%dT%H:%M:%SZ")
+    items, sync_token = _list_pages(cal_service, calendar_id, http, timeMin=window)
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        # a resync after an expired token still tells what changed meanwhile; the very first one does not
+        had_events = conn.execute("SELECT 1 FROM events WHERE calendar_id = ? LIMIT 1", (calendar_id,)).fetchone() is not None
+        before = {r["event_id"]: json.loads(r["data"]) for r in conn.execute(
+            "SELECT event_id, data FROM events WHERE calendar_id = ? AND start_ts >= ?", (calendar_id, window_start.timestamp()))}
+        conn.execute("DELETE FROM events WHERE calendar_id = ?", (calendar_id,))
+        changes = _apply(conn, calendar_id, items, track=False)
+        if had_events:
+            now_ids = {ev["id"] for ev in items if ev.get("status") != "cancelled"}
+            for ev in items:
+                if ev.get("status") == "cancelled" or "start" not in ev:
+                    continue
+                old = before.get(ev["id"])
+                if old is None:
+                    _record_change(conn, calendar_id, ev["id"], ADDED, ev.get("summary", ""), None, _start(ev))
+                elif _start(old) != _start(ev):
+                    _record_change(conn, calendar_id, ev["id"], MOVED, ev.get("summary", ""), _start(old), _start(ev))
+                else:
+                    continue
+                changes += 1
+            for event_id, old in before.items():
+                if event_id not in now_ids:
+                    _record_change(conn, calendar_id, event_id, CANCELLED, old.get("summary", ""), _start(old), None)
+                    changes += 1
+        # dirty is left alone: sync_calendar cleared it before the listing, a notification since then still counts
+        conn.execute("INSERT INTO calendars (calendar_id, sync_token, window_start, synced_at, dirty) VALUES (?, ?, ?, ?, 0) "
+                     "ON CONFLICT(calendar_id) DO UPDATE SET sync_token = excluded.sync_token, window_start = excluded.window_start, "
+                     "synced_at = excluded.synced_at", (calendar_id, sync_token, window, time.time()))
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    print(f"Calendario {calendar_id}: {len(items)} eventi scaricati (sincronizzazione completa)")
+    return {"full": True, "items": len(items), "changes": changes}
+
+def sync_calendar(cal_service, calendar_id: str, path: str = EVENTS_FILE, force: bool = False, http=None) -> Dict[str, Any]:
+    """
+    Bring the store up to date for one calendar: a delta call with the sync token, or a full
+    sync the first time / when the token expired (410) / with force=True.
+    Returns {"full", "items", "changes"}.
+    """
+    with _sync_lock(path, calendar_id):
+        conn = _connect(path)
+        try:
+            row = conn.execute("SELECT sync_token FROM calendars WHERE calendar_id = ?", (calendar_id,)).fetchone()
+            # cleared before listing, never after: a notification arriving during the listing sets it
+            # again and the next read syncs once more instead of serving what we are downloading now
+            conn.execute("UPDATE calendars SET dirty = 0 WHERE calendar_id = ?", (calendar_id,))
+            try:
+                return _delta_or_full_sync(conn, cal_service, calendar_id, row, force, http)
+            except Exception:
+                conn.execute("UPDATE calendars SET dirty = 1 WHERE calendar_id = ?", (calendar_id,))
+                raise
+        finally:
+            conn.close()
+
+def _delta_or_full_sync(conn, cal_service, calendar_id: str, row, force: bool, http=None) -> Dict[str, Any]:
+    if force or row is None or not row["sync_token"]:
+        return _full_sync(conn, cal_service, calendar_id, http)
+    try:
+        items, sync_token = _list_pages(cal_service, calendar_id, http, syncToken=row["sync_token"])
+    except Exception as e:
+        if not _is_gone(e):
+            raise
+        print(f"Sync token del calendario {calendar_id} scaduto: sincronizzazione completa")
+        return _full_sync(conn, cal_service, calendar_id, http)
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        changes = _apply(conn, calendar_id, items, track=True)
+        conn.execute("UPDATE calendars SET sync_token = ?, synced_at = ? WHERE calendar_id = ?",
+                     (sync_token, time.time(), calendar_id))
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    return {"full": False, "items": len(items), "changes": changes}
+
+def _needs_sync(row, watched: bool) -> bool:
+    if row is None or not row["sync_token"]:
+        return True
+    if not watched or row["channel_expires_at"] is None or row["channel_expires_at"] < time.time():
+        return True  # no push notifications: always ask for the (small) delta
+    return bool(row["dirty"]) or time.time() - (row["synced_at"] or 0) > STORE_MAX_AGE
+
+def read_events(cal_service, calendar_id: str, tmin: str, tmax: str, path: str = EVENTS_FILE,
+                http=None) -> Optional[List[Dict[str, Any]]]:
+    """
+    Events of one calendar between tmin and tmax (RFC 3339) from the store, synced first when
+    needed. None when the window starts before what the store keeps (read it directly).
+    http: the connection of the calling thread, when several calendars are read at once.
+    """
+    conn = _connect(path)
+    try:
+        row = conn.execute("SELECT * FROM calendars WHERE calendar_id = ?", (calendar_id,)).fetchone()
+    finally:
+        conn.close()
+    if row is not None and row["window_start"] and _ts(tmin) < _ts(row["window_start"]):
+        return None
+    if CALENDAR_WEBHOOK_URL:
+        try:
+            ensure_watch(cal_service, calendar_id, path, http=http)
+        except Exception as e:
+            print(f"Warning: watch channel for {calendar_id} not created: {e}")
+    stale = _needs_sync(row, watched=bool(CALENDAR_WEBHOOK_URL))
+    tracing.cache("calendar.store", not stale)
+    if stale:
+        sync_calendar(cal_service, calendar_id, path, http=http)
+    conn = _connect(path)
+    try:
+        rows = conn.execute("SELECT data FROM events WHERE calendar_id = ? AND start_ts >= ? AND start_ts < ? "
+                            "ORDER BY start_ts", (calendar_id, _ts(tmin), _ts(tmax))).fetchall()
+        window = conn.execute("SELECT window_start FROM calendars WHERE calendar_id = ?", (calendar_id,)).fetchone()
+    finally:
+        conn.close()
+    if window is None or _ts(tmin) < _ts(window["window_start"]):
+        return None
+    return [json.loads(r["data"]) for r in rows]
+
+# ---- changes since the last check ----
+
+def pending_changes(calendar_ids: List[str], path: str = EVENTS_FILE) -> List[Dict[str, Any]]:
+    """Changes not seen yet: {"calendar_id", "event_id", "kind", "summary", "old_start", "new_start"}."""
+    if not os.path.exists(path):
+        return []
+    conn = _connect(path)
+    try:
+        marks = ",".join("?" * len(calendar_ids))
+        rows = conn.execute(f"SELECT * FROM changes WHERE calendar_id IN ({marks}) ORDER BY changed_at", list(calendar_ids)).fetchall()
+        return [dict(r) for r in rows]
+    finally:
+        conn.close()
+
+def mark_seen(changes: List[Dict[str, Any]], path: str = EVENTS_FILE):
+    conn = _connect(path)
+    try:
+        conn.executemany("DELETE FROM changes WHERE calendar_id = ? AND event_id = ? AND changed_at <= ?",
+                         [(c["calendar_id"], c["event_id"], c["changed_at"]) for c in changes])
+    finally:
+        conn.close()
+
+# ---- watch channels (push notifications) ----
+
+def ensure_watch(cal_service, calendar_id: str, path: str = EVENTS_FILE, address: Optional[str] = None, http=None) -> bool:
+    """Open (or renew) the watch channel of a calendar. Returns True if a new channel was created."""
+    address = address or CALENDAR_WEBHOOK_URL
+    conn = _connect(path)
+    try:
+        row = conn.execute("SELECT * FROM calendars WHERE calendar_id = ?", (calendar_id,)).fetchone()
+        if row is not None and row["channel_expires_at"] and row["channel_expires_at"] - time.time() > CHANNEL_RENEW_BEFORE:
+            return False
+        channel_id, token = str(uuid.uuid4()), secrets.token_urlsafe(24)
+        body = {"id": channel_id, "type": "web_hook", "address": address, "token": token,
+                "params": {"ttl": str(CHANNEL_TTL)}}
+        tracing.count("calendar.events.watch")
+        request = cal_service.events().watch(calendarId=calendar_id, body=body)
+        resp = quota.call(quota.for_service("calendar", cal_service), lambda: request.execute(http=http))
+        expires_at = int(resp.get("expiration", (time.time() + CHANNEL_TTL) * 1000)) / 1000
+        if row is not None and row["channel_id"]:
+            _stop_channel(cal_service, row["channel_id"], row["channel_resource_id"], http)
+        # dirty: whatever happened before the channel existed was not notified
+        conn.execute("INSERT INTO calendars (calendar_id, dirty, channel_id, channel_resource_id, channel_token, channel_expires_at) "
+                     "VALUES (?, 1, ?, ?, ?, ?) ON CONFLICT(calendar_id) DO UPDATE SET dirty = 1, channel_id = excluded.channel_id, "
+                     "channel_resource_id = excluded.channel_resource_id, channel_token = excluded.channel_token, "
+                     "channel_expires_at = excluded.channel_expires_at",
+                     (calendar_id, channel_id, resp.get("resourceId"), token, expires_at))
+        return True
+    finally:
+        conn.close()
+
+def _stop_channel(cal_service, channel_id: str, resource_id: Optional[str], http=None):
+    request = cal_service.channels().stop(body={"id": channel_id, "resourceId": resource_id})
+    try:
+        quota.call(quota.for_service("calendar", cal_service), lambda: request.execute(http=http), retries=0)
+    except Exception as e:
+        print(f"Warning: could not stop watch channel {channel_id}: {e}")  # it expires on its own
+
+def handle_notification(channel_id: str, token: Optional[str], resource_state: str, path: str = EVENTS_FILE) -> bool:
+    """
+    A push notification from Google (headers X-Goog-Channel-ID / -Token / X-Goog-Resource-State).
+    Marks the calendar to be synced at the next read. False for an unknown channel or a wrong token.
+    """
+    conn = _connect(path)
+    try:
+        row = conn.execute("SELECT calendar_id, channel_token FROM calendars WHERE channel_id = ?", (channel_id,)).fetchone()
+        if row is None or not secrets.compare_digest(row["channel_token"] or "", token or ""):
+            return False
+        if resource_state != "sync":  # "sync" only confirms the channel was created
+            conn.execute("UPDATE calendars SET dirty = 1 WHERE calendar_id = ?", (row["calendar_id"],))
+        return True
+    finally:
+        conn.close()
+
+def channel_of(calendar_id: str, path: str = EVENTS_FILE) -> Optional[Dict[str, Any]]:
+    """{"channel_id", "token"} of the calendar's watch channel, if any."""
+    conn = _connect(path)
+    try:
+        row = conn.execute("SELECT channel_id, channel_token FROM calendars WHERE calendar_id = ?", (calendar_id,)).fetchone()
+        if row is None or not row["channel_id"]:
+            return None
+        return {"channel_id": row["channel_id"], "token": row["channel_token"]}
+    finally:
+        conn.close()
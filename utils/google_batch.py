@@ -0,0 +1,59 @@
+import time
+from typing import List, Tuple, Any, Optional, Dict
+
+from utils import tracing, quota
+
+# Google batch endpoints accept up to 1000 sub-requests, but Calendar documents 50 as the
+# practical limit and bigger batches are just slower to fail: keep them small.
+BATCH_SIZE = 50
+
+def execute_batch(service, requests: List[Any], name: str = "google.batch", http=None,
+                  batch_size: int = BATCH_SIZE, api: Optional[str] = None) -> List[Tuple[Optional[Dict[str, Any]], Optional[Exception]]]:
+    """
+    Run many googleapiclient requests (built but not executed) as batch HTTP requests
+    of the same service, one round trip per `batch_size` requests.
+    Returns [(response, None) | (None, exception)] in the same order as `requests`:
+    a failing sub-request does not affect the others.
+    With `api` ("people", "calendar") every sub-request counts against that quota bucket
+    and sub-requests rejected with 429 / 503 go out again in a later batch, up to
+    quota.QUOTA_MAX_RETRIES times.
+    """
+    results: List[Tuple[Optional[Dict[str, Any]], Optional[Exception]]] = [(None, None)] * len(requests)
+    api = quota.for_service(api, service) if api else None  # the bucket of this service's user
+
+    def _callback(request_id, response, exception):
+        results[int(request_id)] = (None, exception) if exception is not None else (response, None)
+
+    def _run(chunk):
+        batch = service.new_batch_http_request(callback=_callback)
+        for i in chunk:
+            batch.add(requests[i], request_id=str(i))
+        tracing.count(name)
+        with tracing.span(name, size=len(chunk)):
+            batch.execute(http=http) if http is not None else batch.execute()
+
+    pending = list(range(len(requests)))
+    for attempt in range(quota.QUOTA_MAX_RETRIES + 1):
+        rejected = []  # sub-requests the server turned down with 429 / 503
+        for offset in range(0, len(pending), batch_size):
+            chunk = pending[offset:offset + batch_size]
+            try:
+                if api:
+                    # the whole exchange is retried there on 429 / 503
+                    quota.call(api, lambda: _run(chunk), cost=len(chunk))
+                else:
+                    _run(chunk)
+            except Exception as e:
+                # the whole HTTP exchange failed: every sub-request of this chunk failed with it
+                for i in chunk:
+                    results[i] = (None, e)
+                continue
+            rejected.extend(i for i in chunk if quota.error_status(results[i][1]) in quota.RETRYABLE_STATUS)
+        if not api or not rejected or attempt == quota.QUOTA_MAX_RETRIES:
+            break
+        quota.observe(api, results[rejected[0]][1])  # one slowdown per round, not one per sub-request
+        quota.count(api, "retries", len(rejected))
+        tracing.count(f"{name}.retried", len(rejected))
+        time.sleep(quota.backoff_delay(attempt))
+        pending = rejected
+    return results
@@ -1,20 +1,26 @@
 # app.py
-import streamlit as st
-from datetime import datetime, timedelta, timezone
-import unicodedata
+from __future__ import annotations
+from datetime import datetime, date, timedelta, timezone
 from zoneinfo import ZoneInfo  # pro-level: uses stdlib zoneinfo (Python 3.9+)
 import os, re, json
-import phonenumbers  # optional but recommended to normalize numbers
-from pdb import set_trace
-from typing import Optional, Dict, Any
-import re
-
-# Google libs
-from google.oauth2.credentials import Credentials
-from google.auth.transport.requests import Request
-from googleapiclient.discovery import build
-from google_auth_oauthlib.flow import Flow
-from google_auth_oauthlib.flow import InstalledAppFlow
+import heapq
+import threading
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Dict, Any, TYPE_CHECKING
+
+# Google libs and phonenumbers are imported where they are used: Streamlit reruns the
+# script on every click and the CLI may never need them (see benchmarks/startup.py).
+if TYPE_CHECKING:
+    from google.oauth2.credentials import Credentials
+
+from utils import tracing
+from utils.google_batch import execute_batch
+from utils import quota
+from utils.contacts import (normalize_query, name_key, sync_contact_index, person_to_contact, ContactIndex,
+                            find_phone_numbers, rank_contacts, is_confident, CONTACTS_CACHE_FILE)
+from utils.resolution_memo import load_memo, remember, memo_key, MANUAL, MEMO_FILE
+from utils import event_store
 
 # Config / scopes
 SCOPES = [
@@ -22,11 +28,16 @@ SCOPES = [
     "https://www.googleapis.com/auth/contacts.readonly"
 ]
 CREDENTIALS_FILE = os.path.join("tmp","credentials_web.json")   # downloaded from Google Cloud Console
-is_local = st.secrets["env"].get("LOCAL_DEV")=="True"
+is_local = os.getenv("LOCAL_DEV")=="True"  # set from st.secrets["env"] / secrets.toml by import_secrets
 if is_local:
     CREDENTIALS_FILE = os.path.join("tmp","credentials_local.json")
 TOKEN_FILE = os.path.join("tmp", "token.json")
 GOOGLE_CALENDAR_ID = os.getenv("GOOGLE_CALENDAR_ID")
+# several practitioners / rooms: comma-separated calendar ids (defaults to the single one above)
+GOOGLE_CALENDAR_IDS = [c.strip() for c in os.getenv("GOOGLE_CALENDAR_IDS", "").split(",") if c.strip()] or [GOOGLE_CALENDAR_ID]
+CALENDAR_FETCH_WORKERS = int(os.getenv("CALENDAR_FETCH_WORKERS", "4"))
+# group independent Google calls (calendar pages, contact searches) into batch HTTP requests
+GOOGLE_BATCH = os.getenv("GOOGLE_BATCH", "1") == "1"
 
 BASE_URL = os.getenv("BASE_URL")  # <- set to your deployed domain
 REDIRECT_PATH = "/oauth2callback"         # or "/" if you prefer
@@ -34,26 +45,6 @@ REDIRECT_URI = f"{BASE_URL}{REDIRECT_PATH}"
 
 # ---- Helpers ----
 
-def normalize_query(q: str) -> str:
-    # Normalize Unicode (e.g., é -> é)
-    q = unicodedata.normalize('NFKD', q)
-    # Replace curly quotes with straight ones
-    q = q.replace('’', " ").replace('‘', " ")
-    q = q.replace('“', ' ').replace('”', ' ')
-    q = q.replace("'", " ")
-
-    phone_pattern = re.compile(r'(?:\+?0{0,2}39)?\s*[\d\s.\-]{6,15}')
-    
-    # Remove phone number and strip extra whitespace
-    cleaned = phone_pattern.sub('', q).strip()
-    
-    # Remove final pz at the end
-    cleaned = re.sub(r'\s*[Pp][Zz]\s*$', '', cleaned).strip()
-    
-    # Collapse multiple spaces if phone number was in the middle
-    cleaned = re.sub(r'\s{2,}', ' ', cleaned)
-    return cleaned
-
 def _ensure_token_dir_exists(path: str):
     d = os.path.dirname(path) or "."
     os.makedirs(d, exist_ok=True)
@@ -66,14 +57,17 @@ def save_token(creds: Credentials, path: str = TOKEN_FILE):
     _ensure_token_dir_exists(path)
     try:
         # Prefer storing the full JSON from google Creds (keeps format compatible with google libs)
-        with open(path, "w", encoding="utf-8") as f:
+        # write + rename, so a concurrent reader never sees a half-written token
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
             f.write(creds.to_json())
         # Restrict permissions (rw-------)
         try:
-            os.chmod(path, 0o600)
+            os.chmod(tmp_path, 0o600)
         except Exception:
             # Windows or hosted environments may ignore chmod; not fatal
             pass
+        os.replace(tmp_path, path)
     except Exception as e:
         # non-fatal: log/ignore but keep running
         print(f"Warning: failed to save token to {path}: {e}")
@@ -98,6 +92,7 @@ def load_token(path: str = TOKEN_FILE) -> Optional[Credentials]:
         creds = dict_to_creds(info) if isinstance(info, dict) else None
         # if creds is None, try constructor fallback
         if creds is None:
+            from google.oauth2.credentials import Credentials
             creds = Credentials.from_authorized_user_info(info, scopes=SCOPES)
         return creds
     except Exception as e:
@@ -148,6 +143,7 @@ def dict_to_creds(d: Dict[str, Any]) -> Credentials:
     Ensure creds.expiry is naive UTC (no tzinfo) because google-auth compares
     against a naive utcnow(). This avoids naive/aware comparison errors.
     """
+    from google.oauth2.credentials import Credentials
     # Try to recreate via library helper first (may or may not set expiry as naive)
     try:
         creds = Credentials.from_authorized_user_info(d, scopes=d.get("scopes"))
@@ -183,51 +179,85 @@ def dict_to_creds(d: Dict[str, Any]) -> Credentials:
 
     return creds
 
-# ---- Main flow function ----
-def get_google_credentials() -> Optional[Credentials]:
+# ---- Process-wide credentials ----
+
+# One Credentials object per token file shared by every Streamlit session/tab (and thread)
+# of the process (one token file per practice, see utils/tenants.py). It is refreshed once,
+# under the lock, a few minutes before it expires, instead of each session racing to
+# refresh it and to rewrite token.json.
+REFRESH_MARGIN = timedelta(minutes=5)
+_shared_creds: Dict[str, Any] = {}  # token file -> Credentials
+_creds_lock = threading.Lock()
+
+def _expires_soon(creds) -> bool:
+    if not creds.expiry:
+        return False
+    now = datetime.now(timezone.utc).replace(tzinfo=None)  # google-auth uses naive UTC
+    return creds.expiry - now < REFRESH_MARGIN
+
+def _tag_quota_user(creds, path: str):
+    # Google quotas are per user: the services built on these credentials get their own
+    # quota buckets (quota.for_service), except the classic single token
+    creds.quota_user = None if path == TOKEN_FILE else path
+
+def set_shared_credentials(creds, path: str = TOKEN_FILE):
+    """Install fresh credentials (e.g. right after the OAuth flow) for the whole process."""
+    with _creds_lock:
+        _tag_quota_user(creds, path)
+        _shared_creds[path] = creds
+        save_token(creds, path)
+
+def get_shared_credentials(path: str = TOKEN_FILE) -> Optional[Credentials]:
     """
-    Return valid Credentials. Strategy:
-      1) Try in-memory session cache (st.session_state) — keep for fast reuse during run.
-      2) Try token file on disk (load_token) and refresh if needed.
-      3) Proceed with OAuth Flow (produces token and saves it).
+    Non-interactive: process cache, else token file on disk; refreshed (and saved back)
+    when close to expiry. Returns None when the user has to go through the OAuth flow again.
     """
-    # 0) prefer session cache (fast during a single Streamlit run)
-    cached = st.session_state.get("_google_creds")
-    if isinstance(cached, Credentials):
-        if cached.valid or (cached.refresh_token and cached.expired):
-            if cached.expired and cached.refresh_token:
-                try:
-                    cached.refresh(Request())
-                except Exception:
-                    st.session_state.pop("_google_creds", None)
-                else:
-                    # persist refreshed token
-                    save_token(cached)
-                    return cached
-            else:
-                return cached
-
-    # 1) try disk token
-    creds = load_token()
-    if creds:
-        # if expired and refresh token available, refresh and persist
-        if creds.expired and creds.refresh_token:
+    with _creds_lock:
+        creds = _shared_creds.get(path)
+        tracing.cache("google.credentials", creds is not None)
+        if creds is None:
+            creds = load_token(path)
+            if not creds:
+                return None
+        if creds.refresh_token and (creds.expired or _expires_soon(creds)):
+            from google.auth.transport.requests import Request
             try:
-                creds.refresh(Request())
+                with tracing.span("google.token_refresh"):
+                    creds.refresh(Request())
             except Exception:
                 # corrupted/stale refresh token — remove and fall through to interactive auth
+                _shared_creds.pop(path, None)
                 try:
-                    os.remove(TOKEN_FILE)
+                    os.remove(path)
                 except Exception:
                     pass
-                creds = None
-            else:
-                save_token(creds)
-                st.session_state["_google_creds"] = creds
-                return creds
-        elif creds.valid:
-            st.session_state["_google_creds"] = creds
-            return creds
+                return None
+            save_token(creds, path)
+        if not creds.valid:
+            _shared_creds.pop(path, None)
+            return None
+        _tag_quota_user(creds, path)
+        _shared_creds[path] = creds
+        return creds
+
+def load_valid_credentials(path: str = TOKEN_FILE) -> Optional[Credentials]:
+    """Kept for the CLI: same as get_shared_credentials."""
+    return get_shared_credentials(path)
+
+# ---- Main flow function ----
+@tracing.traced("google.credentials")
+def get_google_credentials() -> Optional[Credentials]:
+    """
+    Return valid Credentials. Strategy:
+      1) Try the process-wide cache, shared by all sessions (get_shared_credentials).
+      2) Try token file on disk (load_token) and refresh if needed.
+      3) Proceed with OAuth Flow (produces token and saves it).
+    """
+    import streamlit as st
+    # 0+1) process-wide cache, backed by the token file on disk (refreshed once for all sessions)
+    creds = get_shared_credentials()
+    if creds:
+        return creds
 
     # 2) interactive OAuth flow (same as your original logic)
     client_config = load_client_config()
@@ -243,12 +273,12 @@ def get_google_credentials() -> Optional[Credentials]:
 
     if running_local:
         # Use the InstalledAppFlow which opens a browser and runs a local HTTP listener.
+        from google_auth_oauthlib.flow import InstalledAppFlow
         flow = InstalledAppFlow.from_client_config(client_config, scopes=SCOPES)
         # run_local_server will open a browser and block until the callback arrives.
         # `port=0` chooses a free port; you can pick a fixed port if you want a stable redirect URI.
         creds = flow.run_local_server(port=0)
-        save_token(creds)
-        st.session_state["_google_creds"] = creds
+        set_shared_credentials(creds)
         return creds
 
     # Otherwise continue with the web-based Flow (used when you have a public redirect URL)
@@ -258,6 +288,7 @@ def get_google_credentials() -> Optional[Credentials]:
             "or enable LOCAL_DEV in st.secrets for local InstalledAppFlow."
         )
 
+    from google_auth_oauthlib.flow import Flow
     flow = Flow.from_client_config(
         client_config=client_config, scopes=SCOPES, redirect_uri=REDIRECT_URI
     )
@@ -272,8 +303,7 @@ def get_google_credentials() -> Optional[Credentials]:
         code = params["code"][0]
         flow.fetch_token(code=code)
         creds = flow.credentials
-        save_token(creds)
-        st.session_state["_google_creds"] = creds
+        set_shared_credentials(creds)
         st.experimental_set_query_params()
         return creds
 
@@ -289,24 +319,70 @@ def get_google_credentials() -> Optional[Credentials]:
     st.stop()
     return None
 
+# ---- Google API clients ----
+
+# build() parses the (static) discovery document every time: keep one client per
+# (api, version, credentials) for the whole process, shared by all sessions.
+# The client objects are shared but their HTTP connection is not: each request is built
+# on the calling thread's own AuthorizedHttp (httplib2 is not thread-safe).
+_services: Dict[tuple, Any] = {}
+_services_lock = threading.Lock()
+# each entry keeps its credentials alive: don't grow forever (2 APIs per practice served)
+_MAX_SERVICES = int(os.getenv("GOOGLE_MAX_SERVICES", "64"))
+
+def _thread_request_builder(creds):
+    from googleapiclient.http import HttpRequest
+
+    def build_request(http, *args, **kwargs):
+        return HttpRequest(_thread_http(creds), *args, **kwargs)
+    return build_request
+
+def get_service(name: str, version: str, creds):
+    key = (name, version, id(creds))
+    with _services_lock:
+        cached = _services.get(key)
+        if cached is not None and cached[0] is creds:
+            tracing.cache("google.service", True)
+            return cached[1]
+        tracing.cache("google.service", False)
+        from googleapiclient.discovery import build
+        with tracing.span("google.build", api=name):
+            service = build(name, version, http=_thread_http(creds), requestBuilder=_thread_request_builder(creds),
+                            cache_discovery=False)
+        service.quota_user = getattr(creds, "quota_user", None)
+        if len(_services) >= _MAX_SERVICES:
+            _services.clear()
+        _services[key] = (creds, service)
+        return service
+
+def get_day_bounds(day: date, tz_name="Europe/Rome"):
+    tz = ZoneInfo(tz_name)
+    tmin = datetime(day.year, day.month, day.day, 0, 0, 0, tzinfo=tz).isoformat()
+    tmax = datetime(day.year, day.month, day.day, 23, 59, 59, tzinfo=tz).isoformat()
+    return tmin, tmax
+
 def get_tomorrow_bounds(tz_name="Europe/Rome"):
     tz = ZoneInfo(tz_name)
     today = datetime.now(tz).date()
     tomorrow = today + timedelta(days=1)
-    tmin = datetime(tomorrow.year, tomorrow.month, tomorrow.day, 0, 0, 0, tzinfo=tz).isoformat()
-    tmax = datetime(tomorrow.year, tomorrow.month, tomorrow.day, 23, 59, 59, tzinfo=tz).isoformat()
-    return tmin, tmax
+    return get_day_bounds(tomorrow, tz_name)
+
+_NON_PHONE_CHARS = re.compile(r"[^\d+]")
 
+@lru_cache(maxsize=8192)
 def sanitize_phone(raw: str, default_region="IT"):
+    # memoized: the same patients (and numbers) come back every week
     # try phonenumbers first
     try:
+        import phonenumbers
         p = phonenumbers.parse(raw, default_region)
-        if phonenumbers.is_possible_number(p) and phonenumbers.is_valid_number(p):
+        # is_valid_number implies is_possible_number
+        if phonenumbers.is_valid_number(p):
             return phonenumbers.format_number(p, phonenumbers.PhoneNumberFormat.E164)
     except Exception:
         pass
     # fallback: remove non-digits and ensure leading +
-    digits = re.sub(r"[^\d+]", "", raw)
+    digits = _NON_PHONE_CHARS.sub("", raw)
     if digits.startswith("00"):
         digits = "+" + digits[2:]
     if digits and not digits.startswith("+"):
@@ -314,82 +390,503 @@ def sanitize_phone(raw: str, default_region="IT"):
         digits = "+" + digits
     return digits
 
-def search_contacts_by_name(people_service, name):
-    # warmup (People API suggests a warmup empty request to improve cache)
+@lru_cache(maxsize=8192)
+def _mobile_e164(raw: str, default_region="IT") -> Optional[str]:
+    """Strict check for numbers found in free text: only valid mobile numbers (WhatsApp), else None."""
     try:
-        people_service.people().searchContacts(query="", pageSize=1, readMask="names,phoneNumbers").execute()
+        import phonenumbers
+        p = phonenumbers.parse(raw, default_region)
+        if not phonenumbers.is_valid_number(p):
+            return None
+        if phonenumbers.number_type(p) not in (phonenumbers.PhoneNumberType.MOBILE,
+                                               phonenumbers.PhoneNumberType.FIXED_LINE_OR_MOBILE):
+            return None  # e.g. the practice's own landline in the description
     except Exception:
-        pass
-    people_service.people().connections().list(resourceName="people/me",pageSize=200,pageToken=None,personFields="names,emailAddresses,phoneNumbers,metadata").execute()
-    resp = people_service.people().searchContacts(query=normalize_query(name), pageSize=10, readMask="names,phoneNumbers").execute()
+        return None
+    return sanitize_phone(raw, default_region)
 
-    if not resp.get("results", []):
-        return
-    person = resp.get("results", [])[0]["person"] # Get the first matching contact
-    google_name = person["names"][0].get("displayName")
-    if person.get("phoneNumbers"):
-        phone = person.get("phoneNumbers")[0]["canonicalForm"]
-    else:
-        phone = None
-    out = {
-            "name": google_name,
-            "phone": phone
-        }
+_HTML_TAG = re.compile(r"<[^>]+>")
+
+def phone_from_event(ev):
+    """
+    Number written in the event itself: (E.164, "titolo" | "descrizione"), or None.
+    The summary wins over the description (which may also contain notes, dates, ...).
+    """
+    for source, text in (("titolo", ev.get("summary")), ("descrizione", ev.get("description"))):
+        if not text:
+            continue
+        if source == "descrizione":
+            text = _HTML_TAG.sub(" ", text)  # Calendar descriptions can be HTML
+        for candidate in find_phone_numbers(text):
+            phone = _mobile_e164(candidate)
+            if phone:
+                return phone, source
+    return None
+
+_search_warmed_up = False
+
+def _warmup_search(people_service):
+    global _search_warmed_up
+    if not _search_warmed_up:
+        # warmup (People API suggests a warmup empty request to improve cache) - once per process
+        try:
+            tracing.count("people.searchContacts")
+            # no retries: not worth a slot of the quota twice
+            quota.call(quota.for_service("people", people_service), people_service.people().searchContacts(query="", pageSize=1, readMask="names,phoneNumbers").execute,
+                       retries=0)
+        except Exception:
+            pass
+        _search_warmed_up = True
+
+def _search_request(people_service, name):
+    return people_service.people().searchContacts(query=normalize_query(name), pageSize=10, readMask="names,phoneNumbers")
+
+def _best_search_result(name, resp):
+    # the People API orders by its own relevance: score every result against the summary instead
+    contacts = [c for c in (person_to_contact(r["person"]) for r in (resp or {}).get("results", [])) if c]
+    return _contact_fields(rank_contacts(name, contacts))
+
+def _contact_fields(found):
+    """What is kept of a match: the contact, its confidence and the other candidates."""
+    if not found:
+        return None
+    return {"name": found["name"], "phone": found["phone"], "resource_name": found.get("resource_name"),
+            "confidence": found["confidence"], "candidates": found["candidates"]}
+
+def more_confident(a, b):
+    """The better of two lookups of the same summary (None, a failed lookup or a contact)."""
+    def rank(c):
+        return -1.0 if not c or c.get("error") else c.get("confidence", 1.0)
+    return a if rank(a) >= rank(b) else b
+
+def search_contacts_by_name(people_service, name):
+    # People API search; callers try the local index first and keep an uncertain match
+    # of theirs if the search does no better (more_confident)
+    _warmup_search(people_service)
+    tracing.count("people.searchContacts")
+    with tracing.span("people.searchContacts"):
+        resp = quota.call(quota.for_service("people", people_service), _search_request(people_service, name).execute)
+    return _best_search_result(name, resp)
+
+def search_contacts_batch(people_service, names) -> Dict[str, Any]:
+    """
+    People API search for many names in batch HTTP requests instead of one round trip each.
+    Returns {name: contact or None}. Sub-requests rejected by the quota (429 / 503) go out
+    again in a later batch; one that still failed is retried once on its own, and if that
+    fails too the name gets {"name", "phone": None, "error"}: a failed lookup, not a
+    contact without a phone (it is not remembered and shows up as such).
+    """
+    names = list(dict.fromkeys(names))
+    if not names:
+        return {}
+    _warmup_search(people_service)
+    if not GOOGLE_BATCH:
+        return {name: search_contacts_by_name(people_service, name) for name in names}
+    tracing.count("people.searchContacts", len(names))
+    results = execute_batch(people_service, [_search_request(people_service, n) for n in names], name="people.batch",
+                            api="people")
+    out = {}
+    for name, (resp, error) in zip(names, results):
+        if error is not None:
+            try:
+                out[name] = search_contacts_by_name(people_service, name)
+            except Exception as e:
+                print(f"Ricerca contatto fallita per '{name}': {e}")
+                out[name] = lookup_failed(name, e)
+            continue
+        out[name] = _best_search_result(name, resp)
     return out
 
-def get_events(creds):
-    cal_service = build("calendar", "v3", credentials=creds)
+def lookup_failed(name, error) -> Dict[str, Any]:
+    """Placeholder contact for a search that did not succeed (quota, network): no phone, but not "not found"."""
+    return {"name": name, "phone": None, "error": str(error) or type(error).__name__}
 
-    tmin, tmax = get_tomorrow_bounds("Europe/Rome")
-    events_result = cal_service.events().list(
-        calendarId=GOOGLE_CALENDAR_ID,
+def _events_list_request(cal_service, calendar_id, tmin, tmax, page_token=None):
+    return cal_service.events().list(
+        calendarId=calendar_id,
         timeMin=tmin,
         timeMax=tmax,
         singleEvents=True,
-        orderBy="startTime"
-    ).execute()
-    events = events_result.get("items", [])
+        orderBy="startTime",
+        maxResults=2500,
+        pageToken=page_token,
+    )
+
+def fetch_events_page(cal_service, calendar_id, tmin, tmax, page_token=None, http=None):
+    """One page of events: returns (items, next page token or None)."""
+    execute_kwargs = {"http": http} if http is not None else {}
+    tracing.count("calendar.events.list")
+    with tracing.span("calendar.events.list", calendar=calendar_id) as sp:
+        request = _events_list_request(cal_service, calendar_id, tmin, tmax, page_token)
+        events_result = quota.call(quota.for_service("calendar", cal_service), lambda: request.execute(**execute_kwargs))
+        sp.set(items=len(events_result.get("items", [])))
+    return events_result.get("items", []), events_result.get("nextPageToken")
+
+def iter_changed_events(cal_service, calendar_id, updated_min: str):
+    """
+    Events created, modified or deleted (status "cancelled") since `updated_min` (RFC 3339),
+    whatever their date. Recurring series come back once, as the series itself
+    (it has a "recurrence" field), not one item per occurrence.
+    """
+    page_token = None
+    while True:
+        request = cal_service.events().list(calendarId=calendar_id, updatedMin=updated_min, showDeleted=True,
+                                            maxResults=2500, pageToken=page_token)
+        tracing.count("calendar.events.list")
+        with tracing.span("calendar.events.list", calendar=calendar_id, updated_min=updated_min):
+            resp = quota.call(quota.for_service("calendar", cal_service), request.execute)
+        yield from resp.get("items", [])
+        page_token = resp.get("nextPageToken")
+        if not page_token:
+            break
+
+def iter_calendar_events(cal_service, calendar_id, tmin, tmax, http=None, page_token=None):
+    """
+    All events between tmin and tmax, following nextPageToken (optionally starting from `page_token`).
+    Pass a per-thread `http` when calling from a worker: the service's own httplib2 object is not thread-safe.
+    """
+    while True:
+        items, page_token = fetch_events_page(cal_service, calendar_id, tmin, tmax, page_token, http=http)
+        yield from items
+        if not page_token:
+            break
+
+def event_day(ev, tz_name="Europe/Rome") -> date:
+    """Local date of an event (all-day events only have start.date)."""
+    start = ev["start"]
+    if "dateTime" not in start:
+        return date.fromisoformat(start["date"])
+    iso_dt = start["dateTime"]
+    if iso_dt.endswith("Z"):
+        iso_dt = iso_dt[:-1] + "+00:00"
+    return datetime.fromisoformat(iso_dt).astimezone(ZoneInfo(tz_name)).date()
+
+_thread_local = threading.local()
+
+def _thread_http(creds):
+    """One authorized httplib2 connection per worker thread (and credentials)."""
+    cached = getattr(_thread_local, "http", None)
+    if cached is not None and cached[0] is creds:
+        return cached[1]
+    import httplib2
+    from google_auth_httplib2 import AuthorizedHttp
+    http = AuthorizedHttp(creds, http=httplib2.Http())
+    _thread_local.http = (creds, http)
+    return http
+
+def _fetch_calendars_batched(cal_service, calendar_ids, tmin, tmax):
+    """
+    One batch request per round: round 1 asks the first page of every calendar, the next
+    rounds the following pages of the calendars that have more. A calendar whose sub-request
+    failed is fetched on its own from that page (errors there are raised, not swallowed).
+    """
+    events = {cid: [] for cid in calendar_ids}
+    pending = {cid: None for cid in calendar_ids}  # calendar -> page token to fetch
+    while pending:
+        cids = list(pending)
+        requests = [_events_list_request(cal_service, cid, tmin, tmax, pending[cid]) for cid in cids]
+        tracing.count("calendar.events.list", len(requests))
+        results = execute_batch(cal_service, requests, name="calendar.batch", api="calendar")
+        nxt = {}
+        for cid, (resp, error) in zip(cids, results):
+            if error is not None:
+                print(f"Batch fallito per il calendario {cid} ({error}), riprovo da solo")
+                events[cid].extend(iter_calendar_events(cal_service, cid, tmin, tmax, page_token=pending[cid]))
+                continue
+            events[cid].extend(resp.get("items", []))
+            if resp.get("nextPageToken"):
+                nxt[cid] = resp["nextPageToken"]
+        pending = nxt
+    return [(cid, events[cid]) for cid in calendar_ids]
+
+@tracing.traced("calendar.fetch")
+def fetch_calendars_events(creds, calendar_ids, tmin, tmax, max_workers: int = CALENDAR_FETCH_WORKERS,
+                           store_path: Optional[str] = None):
+    """
+    Fetch several calendars at once, then merge them in start order: with GOOGLE_BATCH
+    the pages of all calendars go out together in batch HTTP requests, otherwise each
+    calendar is fetched in a bounded thread pool.
+    With EVENT_STORE the calendars are read from the local store (utils/event_store.py,
+    `store_path`), kept in sync with a small delta call; only a window older than the
+    store is fetched directly.
+    The same event shared between calendars (same iCalUID and start) is kept once;
+    each event is tagged with the calendar it came from in ev["calendar_id"].
+    """
+    cal_service = get_service("calendar", "v3", creds)
+    calendar_ids = list(dict.fromkeys(calendar_ids))  # unique, keep order
+    stored = []
+    if event_store.EVENT_STORE:
+        def _read(calendar_id):
+            # each read may do a delta call: the calendars are read in the same bounded pool
+            http = _thread_http(creds) if len(calendar_ids) > 1 else None
+            with tracing.span("calendar.store.read", calendar=calendar_id):
+                return calendar_id, event_store.read_events(cal_service, calendar_id, tmin, tmax,
+                                                            path=store_path or event_store.EVENTS_FILE, http=http)
+
+        if len(calendar_ids) > 1:
+            with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(calendar_ids)))) as pool:
+                reads = list(pool.map(tracing.bound(_read), calendar_ids))
+        else:
+            reads = [_read(calendar_id) for calendar_id in calendar_ids]
+        stored = [(calendar_id, events) for calendar_id, events in reads if events is not None]
+        calendar_ids = [calendar_id for calendar_id, events in reads if events is None]
+
+    def _fetch(calendar_id):
+        http = _thread_http(creds) if len(calendar_ids) > 1 else None
+        return calendar_id, list(iter_calendar_events(cal_service, calendar_id, tmin, tmax, http=http))
+
+    if not calendar_ids:
+        results = []
+    elif len(calendar_ids) == 1:
+        results = [_fetch(calendar_ids[0])]
+    elif GOOGLE_BATCH:
+        results = _fetch_calendars_batched(cal_service, calendar_ids, tmin, tmax)
+    else:
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(calendar_ids)))) as pool:
+            results = list(pool.map(tracing.bound(_fetch), calendar_ids))
+
+    merged = {}
+    for calendar_id, events in stored + results:
+        for ev in events:
+            key = event_key(ev)
+            if key not in merged:
+                merged[key] = {**ev, "calendar_id": calendar_id}
+    return sorted(merged.values(), key=_start_sort_key)
+
+def event_key(ev):
+    """The same event shared between calendars has the same iCalUID and start."""
+    return (ev.get("iCalUID") or ev.get("id"), ev["start"].get("dateTime", ev["start"].get("date")))
+
+def _start_sort_key(ev):
+    start = ev["start"]
+    if "dateTime" not in start:
+        return datetime.fromisoformat(start["date"]).replace(tzinfo=ZoneInfo("Europe/Rome"))
+    iso_dt = start["dateTime"]
+    if iso_dt.endswith("Z"):
+        iso_dt = iso_dt[:-1] + "+00:00"
+    return datetime.fromisoformat(iso_dt)
+
+@tracing.traced("get_events")
+def get_events(creds, day: Optional[date] = None, days: Optional[list] = None, calendar_ids: Optional[list] = None,
+               tz_name: str = "Europe/Rome", cache_dir: Optional[str] = None):
+    """
+    Appointments with the matched contact phone number.
+    `days` is any list of target dates (a range, or e.g. Friday + Monday before a long weekend);
+    default is just `day`, or tomorrow. The whole span is fetched with a single paginated
+    events().list per calendar (several calendars batched or fetched concurrently, default
+    GOOGLE_CALENDAR_IDS) and each distinct patient is resolved only once across all the days,
+    with a single batched People search for the names the local index does not know.
+    tz_name and cache_dir (contacts cache + resolution memo, default tmp/) are per practice
+    when one process serves several of them (utils/scheduler.py).
+    """
+    if days:
+        target_days = sorted(set(days))
+    else:
+        target_days = [day or datetime.now(ZoneInfo(tz_name)).date() + timedelta(days=1)]
+    tmin, _ = get_day_bounds(target_days[0], tz_name)
+    _, tmax = get_day_bounds(target_days[-1], tz_name)
+    wanted = set(target_days)
+    store_path = os.path.join(cache_dir, "events.sqlite3") if cache_dir else event_store.EVENTS_FILE
+    events = fetch_calendars_events(creds, calendar_ids or GOOGLE_CALENDAR_IDS, tmin, tmax, store_path=store_path)
+    events = [ev for ev in events if event_day(ev, tz_name) in wanted]
 
     if len(events)==0:
-        print("Non ho trovato nessun appuntamento per domani")
+        print("Non ho trovato nessun appuntamento per i giorni richiesti")
         return
     else:
-        failures = []
+        people_service = get_service("people", "v1", creds)
+        # address book from the tmp/ cache, refreshed with only the changes since the last sync
+        contacts_path = os.path.join(cache_dir, "contacts_cache.json") if cache_dir else CONTACTS_CACHE_FILE
+        memo_path = os.path.join(cache_dir, "resolution_memo.sqlite3") if cache_dir else MEMO_FILE
+        with tracing.span("contacts.sync"):
+            contact_index = sync_contact_index(people_service, path=contacts_path, memo_path=memo_path)
+        return resolve_appointments(events, people_service, contact_index, load_memo(memo_path),
+                                    memo_path=memo_path, tz_name=tz_name)
+
+STREAM_CHUNK = int(os.getenv("STREAM_CHUNK", "200"))        # events resolved (and People-searched) together
+STREAM_RESOLVED_MAX = 5000  # patients remembered between chunks before starting over
+
+def _tag_calendar(events, calendar_id):
+    for ev in events:
+        ev["calendar_id"] = calendar_id
+        yield ev
+
+def iter_appointments(creds, days: Optional[list] = None, calendar_ids: Optional[list] = None,
+                      chunk_size: int = STREAM_CHUNK):
+    """
+    Streaming version of get_events for very large calendars / long ranges: yields
+    Appointment objects in start order while the calendars are paged lazily (one page per
+    calendar in memory, merged on start time). Events are resolved in chunks of
+    `chunk_size`, so memory stays flat whatever the number of events.
+    """
+    from utils.appointments import Appointment
+    target_days = sorted(set(days)) if days else [datetime.now(ZoneInfo("Europe/Rome")).date() + timedelta(days=1)]
+    tmin, _ = get_day_bounds(target_days[0], "Europe/Rome")
+    _, tmax = get_day_bounds(target_days[-1], "Europe/Rome")
+    wanted = set(target_days)
+    cal_service = get_service("calendar", "v3", creds)
+    calendar_ids = list(dict.fromkeys(calendar_ids or GOOGLE_CALENDAR_IDS))
+    # each calendar comes back ordered by start time: merge them lazily
+    merged = heapq.merge(*(_tag_calendar(iter_calendar_events(cal_service, cid, tmin, tmax), cid) for cid in calendar_ids),
+                         key=_start_sort_key)
+
+    people_service = get_service("people", "v1", creds)
+    with tracing.span("contacts.sync"):
+        contact_index = sync_contact_index(people_service)
+    memo = load_memo()
+    resolved: Dict[str, Any] = {}
+
+    chunk = []
+    seen, seen_start = set(), None  # the same event in two calendars has the same start: only the current start is kept
+    for ev in merged:
+        key = event_key(ev)
+        if key[1] != seen_start:
+            seen, seen_start = set(), key[1]
+        if key in seen or event_day(ev) not in wanted:
+            continue
+        seen.add(key)
+        chunk.append(ev)
+        if len(chunk) >= chunk_size:
+            yield from resolve_appointments(chunk, people_service, contact_index, memo, resolved, factory=Appointment)
+            chunk = []
+            if len(resolved) > STREAM_RESOLVED_MAX:
+                resolved.clear()
+    if chunk:
+        yield from resolve_appointments(chunk, people_service, contact_index, memo, resolved, factory=Appointment)
+
+def resolve_appointments(events, people_service, contact_index: ContactIndex, memo: Dict[str, Any],
+                         resolved: Optional[Dict[str, Any]] = None, failures: Optional[list] = None,
+                         factory=dict, memo_path: Optional[str] = None, tz_name: str = "Europe/Rome") -> list:
+    """
+    Appointments for a list of events (all of them, or one chunk of a stream).
+    Each distinct patient is resolved once: remembered resolutions (and manual corrections)
+    first, then the local index, then one batched People search for everything the index
+    did not know. `resolved` (name_key -> contact) can be carried over between chunks;
+    factory builds each appointment (dict, or Appointment for the streaming mode).
+    """
+    resolved = {} if resolved is None else resolved
+    misses: Dict[str, str] = {}    # name_key(summary) -> summary
+    uncertain: Dict[str, Any] = {} # name_key(summary) -> index match below the review threshold
+    learned: Dict[str, Any] = {}   # summary -> contact, to remember for next time
+    in_event: Dict[int, Any] = {}  # id(ev) -> contact built from the number written in the event
+    for ev in events:
+        summary = ev.get("summary", "")
+        remembered = memo.get(memo_key(summary))
+        # a number written in the event needs no lookup at all (unless corrected by hand)
+        written = None if remembered and remembered["source"] == MANUAL else event_contact(ev)
+        tracing.cache("contacts.in_event", written is not None)
+        if written:
+            in_event[id(ev)] = written
+            continue
+        key = name_key(summary)
+        tracing.cache("contacts.resolved", key in resolved or key in misses)
+        if key in resolved or key in misses:
+            continue
+        tracing.cache("contacts.memo", remembered is not None)
+        if remembered:
+            resolved[key] = remembered
+            continue
+        with tracing.span("contacts.index_match"):
+            found = contact_index.match(summary)
+        tracing.cache("contacts.index", is_confident(found))
+        if is_confident(found):
+            resolved[key] = learned[summary] = _contact_fields(found)
+        else:
+            misses[key] = summary
+            if found:
+                uncertain[key] = _contact_fields(found)
+    if misses:
+        searched = search_contacts_batch(people_service, misses.values())
+        for key, summary in misses.items():
+            resolved[key] = more_confident(searched.get(summary), uncertain.get(key))
+            # only sure matches are remembered: the uncertain ones are asked again next time
+            if is_confident(resolved[key]):
+                learned[summary] = resolved[key]
+    remember_resolutions(learned, memo_path or MEMO_FILE)
+
+    appointments = []
+    for ev in events:
+        contact = in_event.get(id(ev)) or resolved[name_key(ev.get("summary", ""))]
+        appointment = appointment_from_event(ev, contact, failures, factory=factory, tz_name=tz_name)
+        if appointment is not None:
+            appointments.append(appointment)
+    return appointments
+
+def remember_resolutions(learned: Dict[str, Any], path: Optional[str] = None):
+    """Memoize summary -> contact with the number already in E.164 (unusable numbers are not kept)."""
+    keep = {}
+    for summary, contact in learned.items():
+        phone = sanitize_phone(contact["phone"]) if contact["phone"] else None
+        if contact["phone"] and not phone:
+            continue
+        keep[summary] = {**contact, "phone": phone}
+    try:
+        remember(keep, path or MEMO_FILE)
+    except Exception as e:
+        # the memo only saves lookups: never fail the run because of it
+        print(f"Warning: could not save resolution memo: {e}")
 
-        people_service = build("people", "v1", credentials=creds)
-        appointments = []
-        for ev in events:
-            event_start = ev['start'].get('dateTime', ev['start'].get('date'))
-            summary = ev.get("summary", "")
-            print(f"Event: **{summary}**")
-            found_contact = search_contacts_by_name(people_service, summary)
-            if not found_contact:
-                print(f"Nessun telefono associato all'evento '{summary}'")
-                appointments.append({"event_name":summary,"name":summary,"start":event_start,"phone":None})
-                continue
-            phone_raw = found_contact["phone"]
-            if not phone_raw:
-                appointments.append({"event_name":summary,"name":found_contact["name"],"start":event_start,"phone":None})
-                continue
-            phone_e164 = sanitize_phone(phone_raw)
-            if not phone_e164 or len(phone_e164) < 6:
-                failures.append((summary, phone_raw, "bad_format"))
-                print(f"   ✖ bad phone format: {phone_raw}")
-                continue
-            appointments.append({"event_name":summary,"name":found_contact["name"],"start":event_start,"phone":phone_e164})
-        return appointments
+def event_contact(ev):
+    """Contact for an event that carries its own number (see phone_from_event), else None."""
+    found = phone_from_event(ev)
+    if not found:
+        return None
+    phone, source = found
+    return {"name": normalize_query(ev.get("summary", "")) or ev.get("summary", ""), "phone": phone, "phone_source": source}
+
+def appointment_from_event(ev, found_contact, failures: Optional[list] = None, factory=dict, tz_name: str = "Europe/Rome"):
+    """
+    Appointment dict for one event and its resolved contact (or None if not found):
+    phone is None when there is no contact/number; returns None for an unusable number.
+    phone_source says where the number comes from: "titolo" / "descrizione" (written in the
+    event), "rubrica" (Google contacts) or "correzione" (fixed by hand in the app).
+    A contact matched with a confidence below MATCH_REVIEW_THRESHOLD is not messaged:
+    phone is None and review holds the candidates to confirm in the app.
+    """
+    event_start = ev['start'].get('dateTime', ev['start'].get('date'))
+    summary = ev.get("summary", "")
+    base = {"event_id":ev.get("id"),"event_name":summary,"day":event_day(ev, tz_name).isoformat(),"start":event_start,
+            "calendar_id":ev.get("calendar_id"),"phone_source":None}
+    print(f"Event: **{summary}**")
+    if not found_contact:
+        print(f"Nessun telefono associato all'evento '{summary}'")
+        return factory(**base, name=summary, phone=None)
+    if found_contact.get("error"):
+        if failures is not None:
+            failures.append((summary, None, "lookup_failed"))
+        print(f"   ✖ ricerca del contatto non riuscita ({found_contact['error']}): riprova più tardi")
+        return factory(**base, name=summary, phone=None)
+    if not is_confident(found_contact):
+        if failures is not None:
+            failures.append((summary, None, "review"))
+        print(f"   ? contatto incerto ({found_contact['name']}, {found_contact['confidence']:.0%}): da verificare")
+        return factory(**base, name=summary, phone=None, review=found_contact["candidates"])
+    phone_raw = found_contact["phone"]
+    if not phone_raw:
+        return factory(**base, name=found_contact["name"], phone=None)
+    base["phone_source"] = found_contact.get("phone_source") or (
+        "correzione" if found_contact.get("source") == MANUAL else "rubrica")
+    with tracing.span("phone.sanitize"):
+        phone_e164 = sanitize_phone(phone_raw)
+    if not phone_e164 or len(phone_e164) < 6:
+        if failures is not None:
+            failures.append((summary, phone_raw, "bad_format"))
+        print(f"   ✖ bad phone format: {phone_raw}")
+        return None
+    return factory(**base, name=found_contact["name"], phone=phone_e164)
 
 def fetch_events():
     # DEBUG: list calendars and events per calendar
+    import streamlit as st
     st.header("Debug: Calendars & events (raw)")
 
     # build cal_service as you already do
     creds = get_google_credentials()
-    cal_service = build("calendar", "v3", credentials=creds)
+    cal_service = get_service("calendar", "v3", creds)
 
     # list calendars visible to the user
     st.subheader("User's calendars")
-    cal_list = cal_service.calendarList().list().execute()
+    cal_list = quota.call(quota.for_service("calendar", cal_service), cal_service.calendarList().list().execute)
     calendars = cal_list.get("items", [])
     st.write(f"Found {len(calendars)} calendars in calendarList.")
     for cal in calendars:
@@ -405,14 +902,14 @@ def fetch_events():
     for cal in calendars:
         cid = cal.get("id")
         try:
-            ev_resp = cal_service.events().list(
+            ev_resp = quota.call(quota.for_service("calendar", cal_service), cal_service.events().list(
                 calendarId=cid,
                 timeMin=tmin,
                 timeMax=tmax,
                 singleEvents=True,
                 orderBy="startTime",
                 maxResults=50
-            ).execute()
+            ).execute)
         except Exception as e:
             st.write(f"Error fetching events for calendar {cid}: {e}")
             continue
@@ -2,24 +2,28 @@
 import os
 import json
 import stat
+import tomllib
 from pathlib import Path
-import streamlit as st
+from typing import Optional, Dict, Any
 
-def import_secrets():
+# Same file Streamlit reads st.secrets from; override with SECRETS_FILE for cron/headless runs
+DEFAULT_SECRETS_FILE = os.path.join(".streamlit", "secrets.toml")
+
+def apply_secrets(secrets: Dict[str, Any]):
     # 1) Load simple env-like keys into process env (no .env file necessary)
     # pro tip: keep a dedicated section in secrets (e.g. st.secrets["env"]) so you don't leak large JSON blobs
-    for k, v in st.secrets.get("env", {}).items():
+    for k, v in secrets.get("env", {}).items():
         # only set if not already set (avoids overriding in special cases)
-        os.environ.setdefault(k, v)
+        os.environ.setdefault(k, str(v))
 
     # 2) Create a credentials.json file from a JSON secret (for libs that expect a file path)
     # Pro: write in /tmp (ephemeral on cloud) and set file mode 0o600 to restrict access.
-    cred_section = st.secrets.get("google", {})
+    cred_section = secrets.get("google", {})
     if "SERVICE_ACCOUNT_JSON" in cred_section:
         cred_text = cred_section["SERVICE_ACCOUNT_JSON"]
         # Ensure it's valid JSON (if you stored an actual dict in secrets it may be dict already)
         if isinstance(cred_text, dict):
-            cred_payload = cred_text
+            cred_payload = dict(cred_text)
         else:
             cred_payload = json.loads(cred_text)
 
@@ -30,4 +34,20 @@ def import_secrets():
         cred_path.chmod(0o600)
 
         # Many libraries (google SDKs) look for GOOGLE_APPLICATION_CREDENTIALS
-        os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = str(cred_path)
\ No newline at end of file
+        os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = str(cred_path)
+
+def import_secrets():
+    """Streamlit app: read st.secrets."""
+    import streamlit as st
+    apply_secrets(st.secrets)
+
+def load_secrets(path: Optional[str] = None):
+    """
+    Headless runs (cron, CLI): read the same secrets.toml without importing Streamlit.
+    Missing file is fine: everything can also come from the environment.
+    """
+    path = path or os.getenv("SECRETS_FILE") or DEFAULT_SECRETS_FILE
+    if not os.path.exists(path):
+        return
+    with open(path, "rb") as f:
+        apply_secrets(tomllib.load(f))
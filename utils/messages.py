@@ -0,0 +1,190 @@
+import os
+import json
+import string
+import tomllib
+import threading
+from functools import lru_cache
+from typing import Optional, Dict, Any, List, Tuple
+
+from utils import tracing
+from utils.date_utils import LOCALES, DAY_MONTH, parse_local_datetime
+
+# Which Twilio content template a reminder uses and what goes in its variables.
+# Without a templates file every reminder is the classic one: the sender's template
+# (TEMPLATE_ID / the tenant's template_id) with {"2": "*11 Ottobre* alle ore *15:00*"}.
+#
+# templates.toml:
+#
+#   default_language = "it"
+#
+#   [templates.default.it]
+#   variables = { "2" = "{date_time}" }          # content_sid omitted: the sender's template
+#   [templates.default.en]
+#   content_sid = "HX..."
+#   variables = { "1" = "{first_name}", "2" = "{date_time}" }
+#   [templates.prima_visita.it]
+#   content_sid = "HX..."
+#   variables = { "1" = "{first_name}", "2" = "{weekday} {date}", "3" = "{time}" }
+#
+#   [kinds]                                       # words in the event summary -> template
+#   prima_visita = ["prima visita", "1a visita"]
+#
+#   [languages]                                   # words in the event summary -> language
+#   en = ["(en)", "english"]
+#
+# Language: a [languages] word in the summary, else the phone prefix, else default_language.
+# A kind without the patient's language uses the default language, then the "default" kind.
+MESSAGE_TEMPLATES_FILE = os.getenv("MESSAGE_TEMPLATES_FILE", "templates.toml")
+DEFAULT_KIND = "default"
+RENDER_CACHE_SIZE = 4096
+
+PLACEHOLDERS = {"date_time", "date", "time", "weekday", "name", "first_name"}
+_NAME_PLACEHOLDERS = {"name", "first_name"}
+
+# country code -> language, longest prefix first
+PHONE_LANGUAGES = [("+353", "en"), ("+44", "en"), ("+61", "en"), ("+1", "en"), ("+49", "de"), ("+43", "de"),
+                   ("+41", "de"), ("+33", "fr"), ("+32", "fr"), ("+34", "es"), ("+39", "it")]
+
+_DEFAULT_TEMPLATES = {DEFAULT_KIND: {"it": {"variables": {"2": "{date_time}"}}}}
+
+def _placeholders(text: str) -> List[str]:
+    return [field for _, field, _, _ in string.Formatter().parse(text) if field is not None]
+
+def _clean(value: str) -> str:
+    # WhatsApp rejects variables with new lines, tabs or more than 4 spaces in a row, and empty ones
+    value = " ".join(value.replace("\t", " ").splitlines()).strip()
+    while "     " in value:
+        value = value.replace("     ", "    ")
+    return value or "-"
+
+class MessageEngine:
+    """
+    Renders the outbox payload of a reminder: {"content_sid", "content_variables", "time"}.
+    content_variables is already the JSON string Twilio wants; "time" stays for the senders
+    and outbox rows of before. Renders are cached: the same slot in the same template and
+    language is formatted and serialized once.
+    """
+
+    def __init__(self, templates: Dict[str, Dict[str, Dict[str, Any]]], default_language: str = "it",
+                 kinds: Optional[Dict[str, List[str]]] = None, languages: Optional[Dict[str, List[str]]] = None,
+                 tz_name: str = "Europe/Rome"):
+        self.default_language = default_language
+        self.tz_name = tz_name
+        self.templates: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        for kind, by_language in templates.items():
+            for language, template in by_language.items():
+                self.templates[(kind, language)] = self._compile(kind, language, template)
+        if (DEFAULT_KIND, default_language) not in self.templates:
+            raise ValueError(f"manca il template [templates.{DEFAULT_KIND}.{default_language}]")
+        self.kinds = [(word.lower(), kind) for kind, words in (kinds or {}).items() for word in words]
+        self.languages = [(word.lower(), language) for language, words in (languages or {}).items() for word in words]
+        for word, language in self.languages:
+            if language not in LOCALES:
+                raise ValueError(f"[languages] {language!r}: lingua non supportata (disponibili: {', '.join(LOCALES)})")
+        for word, kind in self.kinds:
+            if not any(k == kind for k, _ in self.templates):
+                raise ValueError(f"[kinds] {kind!r}: nessun template [templates.{kind}.<lingua>]")
+        self._only = next(iter(self.templates.values()))
+        self._cache: Dict[tuple, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _compile(kind: str, language: str, template: Dict[str, Any]) -> Dict[str, Any]:
+        where = f"[templates.{kind}.{language}]"
+        if language not in LOCALES:
+            raise ValueError(f"{where}: lingua non supportata (disponibili: {', '.join(LOCALES)})")
+        unknown = set(template) - {"content_sid", "variables"}
+        if unknown:
+            raise ValueError(f"{where}: chiavi sconosciute {sorted(unknown)}")
+        variables = template.get("variables") or {}
+        if not variables:
+            raise ValueError(f"{where}: variables mancante")
+        used = set()
+        for key, text in variables.items():
+            if not isinstance(text, str):
+                raise ValueError(f"{where}: la variabile {key!r} deve essere una stringa")
+            fields = _placeholders(text)
+            bad = set(fields) - PLACEHOLDERS
+            if bad:
+                raise ValueError(f"{where}: segnaposto sconosciuti {sorted(bad)} (disponibili: {sorted(PLACEHOLDERS)})")
+            used.update(fields)
+        return {"kind": kind, "language": language, "content_sid": template.get("content_sid"),
+                "variables": dict(variables), "uses_name": bool(used & _NAME_PLACEHOLDERS)}
+
+    def language_of(self, appointment) -> str:
+        summary = (appointment.get("event_name") or "").lower()
+        for word, language in self.languages:
+            if word in summary:
+                return language
+        phone = appointment.get("phone") or ""
+        for prefix, language in PHONE_LANGUAGES:
+            if phone.startswith(prefix):
+                return language
+        return self.default_language
+
+    def kind_of(self, appointment) -> str:
+        summary = (appointment.get("event_name") or "").lower()
+        for word, kind in self.kinds:
+            if word in summary:
+                return kind
+        return DEFAULT_KIND
+
+    def template_for(self, appointment) -> Dict[str, Any]:
+        if len(self.templates) == 1:
+            return self._only  # one template (the classic setup): nothing to choose
+        kind, language = self.kind_of(appointment), self.language_of(appointment)
+        for key in ((kind, language), (kind, self.default_language), (DEFAULT_KIND, language)):
+            if key in self.templates:
+                return self.templates[key]
+        return self.templates[(DEFAULT_KIND, self.default_language)]
+
+    def _values(self, template: Dict[str, Any], start: str, name: str) -> Dict[str, str]:
+        language = template["language"]
+        local_dt = parse_local_datetime(start, self.tz_name)
+        date = DAY_MONTH[language][local_dt.month - 1][local_dt.day]
+        time = f"{local_dt.hour:02d}:{local_dt.minute:02d}"
+        return {"date_time": LOCALES[language]["date_time"].format(day_month=date, time=time),
+                "date": date, "time": time, "weekday": LOCALES[language]["weekdays"][local_dt.weekday()],
+                "name": name, "first_name": name.split(" ", 1)[0]}
+
+    def render(self, appointment) -> Dict[str, Any]:
+        """render() for outbox.enqueue / plans: one payload per appointment."""
+        template = self.template_for(appointment)
+        name = " ".join((appointment.get("name") or "").split()) if template["uses_name"] else ""
+        key = (template["kind"], template["language"], appointment["start"], name)
+        payload = self._cache.get(key)
+        if payload is not None:
+            tracing.cache("messages.render", True)
+            return payload
+        tracing.cache("messages.render", False)
+        values = self._values(template, appointment["start"], name)
+        variables = {k: _clean(text.format_map(values)) for k, text in template["variables"].items()}
+        payload = {"content_variables": json.dumps(variables, ensure_ascii=False),
+                   "time": values["date_time"]}
+        if template["content_sid"]:
+            payload["content_sid"] = template["content_sid"]
+        with self._lock:
+            if len(self._cache) >= RENDER_CACHE_SIZE:
+                self._cache.clear()
+            self._cache[key] = payload
+        return payload
+
+    __call__ = render
+
+def load_engine(path: Optional[str] = None, tz_name: str = "Europe/Rome") -> MessageEngine:
+    """The engine of templates.toml ($MESSAGE_TEMPLATES_FILE), or the classic single template without it."""
+    path = path or MESSAGE_TEMPLATES_FILE
+    mtime = os.path.getmtime(path) if os.path.exists(path) else None
+    return _load_engine(path, mtime, tz_name)
+
+@lru_cache(maxsize=16)
+def _load_engine(path: str, mtime: Optional[float], tz_name: str) -> MessageEngine:
+    if mtime is None:
+        return MessageEngine(_DEFAULT_TEMPLATES, tz_name=tz_name)
+    with open(path, "rb") as f:
+        data = tomllib.load(f)
+    unknown = set(data) - {"default_language", "templates", "kinds", "languages"}
+    if unknown:
+        raise ValueError(f"{path}: chiavi sconosciute {sorted(unknown)}")
+    return MessageEngine(data.get("templates") or _DEFAULT_TEMPLATES, data.get("default_language", "it"),
+                         data.get("kinds"), data.get("languages"), tz_name=tz_name)
@@ -0,0 +1,298 @@
+import os
+import json
+import time
+import random
+import sqlite3
+import threading
+from itertools import islice
+from typing import Optional, Dict, Any, List, Callable, Iterable
+
+# Durable queue of reminder sends. One row per appointment, keyed on event id + date, so
+# a Streamlit rerun or a double click can never enqueue (and send) the same reminder twice.
+OUTBOX_FILE = os.path.join("tmp", "outbox.sqlite3")
+
+MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "6"))
+BACKOFF_BASE = float(os.getenv("OUTBOX_BACKOFF_BASE", "2"))  # seconds
+BACKOFF_MAX = float(os.getenv("OUTBOX_BACKOFF_MAX", "300"))  # seconds
+BATCH_SIZE = 50
+
+# states
+QUEUED = "queued"      # waiting for (another) attempt at next_attempt_at
+SENDING = "sending"    # claimed by a drainer
+SENT = "sent"
+FAILED = "failed"      # permanent error or attempts exhausted
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    key TEXT PRIMARY KEY,
+    phone TEXT NOT NULL,
+    name TEXT,
+    payload TEXT NOT NULL,
+    state TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL,
+    sid TEXT,
+    last_error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS outbox_due ON outbox (state, next_attempt_at);
+CREATE INDEX IF NOT EXISTS outbox_sid ON outbox (sid);
+CREATE TABLE IF NOT EXISTS delivery (
+    sid TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    error_code TEXT,
+    updated_at REAL NOT NULL
+);
+"""
+
+# Delivery status reported by Twilio's status callback (utils/status_webhook.py) for a sent
+# message. Callbacks can arrive out of order: a status never goes back to an earlier one.
+DELIVERY_RANK = {"accepted": 0, "scheduled": 0, "queued": 0, "sending": 1, "sent": 2,
+                 "delivered": 3, "read": 4, "undelivered": 5, "failed": 5, "canceled": 5}
+
+def _connect(path: str = OUTBOX_FILE) -> sqlite3.Connection:
+    d = os.path.dirname(path) or "."
+    os.makedirs(d, exist_ok=True)
+    conn = sqlite3.connect(path, timeout=30, isolation_level=None)  # autocommit, explicit BEGIN where needed
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript(_SCHEMA)
+    return conn
+
+def outbox_key(event_id: str, start: str) -> str:
+    """Idempotency key: calendar event id + appointment date (YYYY-MM-DD)."""
+    return f"{event_id}|{start[:10]}"
+
+def enqueue(appointments: List[Dict[str, Any]], render: Callable[[Dict[str, Any]], Dict[str, Any]],
+            path: str = OUTBOX_FILE) -> List[str]:
+    """
+    Queue one send per appointment with a phone number. Already queued/sent keys are left untouched.
+    render(appointment) returns the JSON payload passed to the sender (e.g. {"time": ...}).
+    Returns the keys of all the given appointments (new or not).
+    """
+    now = time.time()
+    keys = []
+    conn = _connect(path)
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        for appointment in appointments:
+            if not appointment.get("phone"):
+                continue
+            key = outbox_key(appointment.get("event_id") or appointment["event_name"], appointment["start"])
+            keys.append(key)
+            conn.execute(
+                "INSERT OR IGNORE INTO outbox (key, phone, name, payload, state, attempts, next_attempt_at, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, 0, ?, ?, ?)",
+                (key, appointment["phone"], appointment.get("name"), json.dumps(render(appointment)), QUEUED, now, now, now),
+            )
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+    return keys
+
+def enqueue_stream(appointments: Iterable[Dict[str, Any]], render: Callable[[Dict[str, Any]], Dict[str, Any]],
+                   path: str = OUTBOX_FILE, chunk_size: int = BATCH_SIZE) -> int:
+    """
+    enqueue() for a stream of appointments (google_utils.iter_appointments): one short
+    transaction per chunk, so the database is never locked while the calendar is paged,
+    and no list of keys is kept. Returns the number of appointments with a phone.
+    """
+    count = 0
+    appointments = iter(appointments)
+    while True:
+        chunk = list(islice(appointments, chunk_size))
+        if not chunk:
+            return count
+        count += len(enqueue(chunk, render, path))
+
+def _claim_due(conn: sqlite3.Connection, limit: int = BATCH_SIZE) -> List[sqlite3.Row]:
+    """Atomically move due rows from queued to sending, so two drainers never pick the same row."""
+    now = time.time()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        rows = conn.execute(
+            "SELECT * FROM outbox WHERE state = ? AND next_attempt_at <= ? ORDER BY next_attempt_at LIMIT ?",
+            (QUEUED, now, limit),
+        ).fetchall()
+        conn.executemany(
+            "UPDATE outbox SET state = ?, attempts = attempts + 1, updated_at = ? WHERE key = ?",
+            [(SENDING, now, row["key"]) for row in rows],
+        )
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    return rows
+
+def backoff_delay(attempts: int, retry_after: Optional[float] = None) -> float:
+    """Exponential backoff with jitter; a server-provided Retry-After is a lower bound."""
+    delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** max(0, attempts - 1))
+    delay = random.uniform(delay / 2, delay)
+    if retry_after is not None:
+        delay = max(delay, retry_after)
+    return delay
+
+def _record(conn: sqlite3.Connection, row: sqlite3.Row, result: Dict[str, Any]):
+    now = time.time()
+    attempts = row["attempts"] + 1  # row was read before the claim incremented it
+    if not result.get("error"):
+        conn.execute("UPDATE outbox SET state = ?, sid = ?, last_error = NULL, updated_at = ? WHERE key = ?",
+                     (SENT, result.get("sid"), now, row["key"]))
+    elif result.get("retryable") and attempts < MAX_ATTEMPTS:
+        delay = backoff_delay(attempts, result.get("retry_after"))
+        conn.execute("UPDATE outbox SET state = ?, next_attempt_at = ?, last_error = ?, updated_at = ? WHERE key = ?",
+                     (QUEUED, now + delay, result["error"], now, row["key"]))
+    else:
+        conn.execute("UPDATE outbox SET state = ?, last_error = ?, updated_at = ? WHERE key = ?",
+                     (FAILED, result["error"], now, row["key"]))
+
+def recover_interrupted(path: str = OUTBOX_FILE, older_than: float = 600) -> int:
+    """
+    Rows left in 'sending' by a crashed drainer may or may not have reached Twilio.
+    They are marked failed (to be checked by hand) rather than re-sent, to never message a patient twice.
+    """
+    conn = _connect(path)
+    try:
+        cur = conn.execute(
+            "UPDATE outbox SET state = ?, last_error = ?, updated_at = ? WHERE state = ? AND updated_at < ?",
+            (FAILED, "invio interrotto: verificare se il messaggio è arrivato", time.time(), SENDING, time.time() - older_than),
+        )
+        return cur.rowcount
+    finally:
+        conn.close()
+
+def has_due(path: str = OUTBOX_FILE) -> bool:
+    """True when some queued row can be attempted now (what a non-waiting drain() would pick)."""
+    conn = _connect(path)
+    try:
+        row = conn.execute("SELECT 1 FROM outbox WHERE state = ? AND next_attempt_at <= ? LIMIT 1",
+                           (QUEUED, time.time())).fetchone()
+        return row is not None
+    finally:
+        conn.close()
+
+def drain(send_batch: Optional[Callable[[List[Dict[str, Any]]], List[Dict[str, Any]]]] = None,
+          path: str = OUTBOX_FILE, wait: bool = True) -> Dict[str, int]:
+    """
+    Send everything that is due. With wait=True keeps going (sleeping between retries)
+    until nothing is left in the queue, otherwise returns after one pass.
+    """
+    if send_batch is None:
+        from utils.twilio_utils import send_twilio_messages
+        send_batch = send_twilio_messages
+    stats = {"sent": 0, "retried": 0, "failed": 0}
+    conn = _connect(path)
+    try:
+        while True:
+            rows = _claim_due(conn)
+            if rows:
+                messages = [{"to": row["phone"], **json.loads(row["payload"])} for row in rows]
+                results = send_batch(messages)
+                conn.execute("BEGIN IMMEDIATE")
+                for row, result in zip(rows, results):
+                    _record(conn, row, result)
+                    if not result.get("error"):
+                        stats["sent"] += 1
+                    elif result.get("retryable") and row["attempts"] + 1 < MAX_ATTEMPTS:
+                        stats["retried"] += 1
+                    else:
+                        stats["failed"] += 1
+                conn.execute("COMMIT")
+                continue
+            if not wait:
+                break
+            nxt = conn.execute("SELECT MIN(next_attempt_at) FROM outbox WHERE state = ?", (QUEUED,)).fetchone()[0]
+            if nxt is None:
+                break
+            time.sleep(min(BACKOFF_MAX, max(0.0, nxt - time.time())))
+    finally:
+        conn.close()
+    return stats
+
+def record_delivery(sid: str, status: str, error_code: Optional[str] = None, path: str = OUTBOX_FILE) -> bool:
+    """Store a status callback. Returns False when it was older than what we already know."""
+    status = status.lower()
+    rank = DELIVERY_RANK.get(status, 0)
+    conn = _connect(path)
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        row = conn.execute("SELECT status FROM delivery WHERE sid = ?", (sid,)).fetchone()
+        if row is not None and DELIVERY_RANK.get(row["status"], 0) > rank:
+            conn.execute("COMMIT")
+            return False
+        conn.execute("INSERT OR REPLACE INTO delivery (sid, status, error_code, updated_at) VALUES (?, ?, ?, ?)",
+                     (sid, status, error_code or None, time.time()))
+        conn.execute("COMMIT")
+        return True
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+
+def get_states(keys: List[str], path: str = OUTBOX_FILE) -> List[Dict[str, Any]]:
+    """Send state of each key plus the delivery status from the callbacks (one indexed query, no Twilio calls)."""
+    if not keys:
+        return []
+    conn = _connect(path)
+    try:
+        placeholders = ",".join("?" * len(keys))
+        rows = conn.execute(
+            "SELECT o.key, o.name, o.phone, o.state, o.attempts, o.sid, o.last_error, o.next_attempt_at, "
+            "d.status AS delivery, d.error_code AS delivery_error "
+            f"FROM outbox o LEFT JOIN delivery d ON d.sid = o.sid WHERE o.key IN ({placeholders})",
+            keys,
+        ).fetchall()
+        return [dict(row) for row in rows]
+    finally:
+        conn.close()
+
+def count_states(days: List[str], path: str = OUTBOX_FILE) -> Dict[str, int]:
+    """
+    {state: number of reminders} for the appointments of the given days (YYYY-MM-DD);
+    sent reminders are counted by delivery status once Twilio reported one.
+    """
+    if not days:
+        return {}
+    conn = _connect(path)
+    try:
+        placeholders = ",".join("?" * len(days))
+        rows = conn.execute(
+            "SELECT CASE WHEN d.status IS NOT NULL AND o.state = 'sent' THEN d.status ELSE o.state END AS s, COUNT(*) "
+            f"FROM outbox o LEFT JOIN delivery d ON d.sid = o.sid WHERE substr(o.key, -10) IN ({placeholders}) GROUP BY s",
+            list(days),
+        ).fetchall()
+        return {state: n for state, n in rows}
+    finally:
+        conn.close()
+
+# ---- Background drainer ----
+
+_drain_thread: Optional[threading.Thread] = None
+_drain_lock = threading.Lock()
+
+def start_background_drain(path: str = OUTBOX_FILE) -> bool:
+    """
+    Drain the outbox in a daemon thread so the Streamlit script returns immediately.
+    Only one drainer per process; returns False if one is already running.
+    """
+    global _drain_thread
+    with _drain_lock:
+        if _drain_thread is not None and _drain_thread.is_alive():
+            return False
+
+        def _run():
+            try:
+                recover_interrupted(path=path)
+                stats = drain(path=path)
+                print(f"Outbox svuotata: {stats}")
+            except Exception as e:
+                print(f"Warning: outbox drain failed: {e}")
+
+        _drain_thread = threading.Thread(target=_run, name="outbox-drain", daemon=True)
+        _drain_thread.start()
+        return True
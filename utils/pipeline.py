@@ -0,0 +1,206 @@
+import os
+import asyncio
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+from typing import Optional, Dict, Any, List, Callable
+
+from utils import tracing
+from utils.contacts import name_key, sync_contact_index, is_confident
+from utils.google_utils import (
+    GOOGLE_CALENDAR_IDS, get_service, get_day_bounds, event_day, event_key, fetch_events_page,
+    search_contacts_by_name, lookup_failed, more_confident, _contact_fields, appointment_from_event, event_contact,
+    remember_resolutions, _start_sort_key,
+)
+from utils.resolution_memo import load_memo, load_overrides, memo_key
+from utils import event_store
+
+# Streaming version of get_events + outbox send: calendar pages, contact lookups and sends
+# overlap instead of running one phase after the other. The blocking Google/Twilio/SQLite
+# calls run in worker threads (asyncio.to_thread); asyncio only schedules them.
+PIPELINE_CONCURRENCY = int(os.getenv("PIPELINE_CONCURRENCY", "8"))  # People searches in flight
+
+def _new_progress() -> Dict[str, int]:
+    return {"events": 0, "resolved": 0, "with_phone": 0, "queued": 0, "sent": 0, "retried": 0, "failed": 0}
+
+async def _pipeline(creds, target_days, calendar_ids, render, send_batch, send, on_progress, concurrency):
+    tz = "Europe/Rome"
+    tmin, _ = get_day_bounds(target_days[0], tz)
+    _, tmax = get_day_bounds(target_days[-1], tz)
+    wanted = set(target_days)
+    progress = _new_progress()
+    appointments: List[tuple] = []  # (event, appointment): sorted by event start at the end, like get_events
+
+    def _notify(appointment=None):
+        if on_progress is not None:
+            on_progress(dict(progress), appointment)
+
+    cal_service = get_service("calendar", "v3", creds)
+    people_service = get_service("people", "v1", creds)
+    # the address book sync runs while the first calendar pages arrive
+    index_task = asyncio.create_task(asyncio.to_thread(sync_contact_index, people_service))
+
+    async def _load_memo():
+        await index_task  # the sync may invalidate remembered entries of changed contacts
+        return await asyncio.to_thread(load_memo)
+
+    memo_task = asyncio.create_task(_load_memo())
+    # manual corrections are not touched by the sync: no need to wait for it
+    overrides_task = asyncio.create_task(asyncio.to_thread(load_overrides))
+    learned: Dict[str, Any] = {}  # summary -> contact, remembered at the end
+
+    events: asyncio.Queue = asyncio.Queue()
+    seen = set()
+
+    async def _produce(calendar_id):
+        if event_store.EVENT_STORE:
+            # from the local store: usually one small delta call, no paging
+            stored = await asyncio.to_thread(event_store.read_events, cal_service, calendar_id, tmin, tmax,
+                                           event_store.EVENTS_FILE)
+            if stored is not None:
+                for ev in stored:
+                    key = event_key(ev)
+                    if key in seen or event_day(ev) not in wanted:
+                        continue
+                    seen.add(key)
+                    await events.put({**ev, "calendar_id": calendar_id})
+                return
+        page_token = None
+        while True:
+            items, page_token = await asyncio.to_thread(fetch_events_page, cal_service, calendar_id, tmin, tmax, page_token)
+            for ev in items:
+                key = event_key(ev)
+                if key in seen or event_day(ev) not in wanted:
+                    continue
+                seen.add(key)
+                await events.put({**ev, "calendar_id": calendar_id})
+            if not page_token:
+                return
+
+    # one lookup per distinct patient, even when their events are resolved concurrently
+    lookups: Dict[str, asyncio.Future] = {}
+    limit = asyncio.Semaphore(max(1, concurrency))
+
+    async def _lookup(summary):
+        remembered = (await memo_task).get(memo_key(summary))
+        tracing.cache("contacts.memo", remembered is not None)
+        if remembered:
+            return remembered
+        index = await index_task
+        with tracing.span("contacts.index_match"):
+            found = index.match(summary)
+        tracing.cache("contacts.index", is_confident(found))
+        if is_confident(found):
+            learned[summary] = _contact_fields(found)
+            return learned[summary]
+        async with limit:
+            try:
+                contact = await asyncio.to_thread(search_contacts_by_name, people_service, summary)
+            except Exception as e:
+                print(f"Ricerca contatto fallita per '{summary}': {e}")
+                contact = lookup_failed(summary, e)
+        contact = more_confident(contact, _contact_fields(found))
+        if is_confident(contact):
+            learned[summary] = contact
+        return contact
+
+    # sending: a single sender moves the appointments confirmed so far into the outbox (one
+    # transaction per wake-up, not per row) and drains it, so messages leave while later
+    # patients are still being resolved
+    wake = asyncio.Event()
+    ready: List[Dict[str, Any]] = []
+    done_resolving = False
+
+    async def _sender():
+        from utils import outbox
+        while True:
+            await wake.wait()
+            wake.clear()
+            if ready:
+                batch = ready[:]
+                del ready[:]
+                await asyncio.to_thread(outbox.enqueue, batch, render)
+                progress["queued"] += len(batch)
+            stats = await asyncio.to_thread(outbox.drain, send_batch, wait=done_resolving)
+            for k in ("sent", "retried", "failed"):
+                progress[k] += stats[k]
+            _notify()
+            if done_resolving and not wake.is_set() and not ready:
+                return
+
+    async def _handle(ev):
+        summary = ev.get("summary", "")
+        # a number written in the event needs no lookup at all (unless corrected by hand)
+        contact = event_contact(ev)
+        tracing.cache("contacts.in_event", contact is not None)
+        if contact is not None:
+            remembered = (await overrides_task).get(memo_key(summary))
+            if remembered:
+                contact = remembered
+        else:
+            key = name_key(summary)
+            tracing.cache("contacts.resolved", key in lookups)
+            if key not in lookups:
+                lookups[key] = asyncio.ensure_future(_lookup(summary))
+            contact = await lookups[key]
+        appointment = appointment_from_event(ev, contact)
+        progress["resolved"] += 1
+        if appointment is None:
+            _notify()
+            return
+        appointments.append((ev, appointment))
+        if appointment["phone"]:
+            progress["with_phone"] += 1
+            if send:
+                ready.append(appointment)
+                wake.set()
+        _notify(appointment)
+
+    async def _consume():
+        handlers = set()
+        while True:
+            ev = await events.get()
+            if ev is None:
+                break
+            progress["events"] += 1
+            task = asyncio.create_task(_handle(ev))
+            handlers.add(task)
+            task.add_done_callback(handlers.discard)
+        if handlers:
+            await asyncio.gather(*handlers)
+
+    sender = asyncio.create_task(_sender()) if send else None
+    consumer = asyncio.create_task(_consume())
+    try:
+        await asyncio.gather(*(_produce(cid) for cid in calendar_ids))
+    finally:
+        await events.put(None)
+    await consumer
+    await index_task  # also when there were no events: keep the tmp/ cache up to date
+    await asyncio.to_thread(remember_resolutions, learned)
+    if sender is not None:
+        # last pass waits for the retries (rate limits, 5xx) to go through
+        done_resolving = True
+        wake.set()
+        await sender
+
+    appointments.sort(key=lambda pair: _start_sort_key(pair[0]))
+    return [appointment for _, appointment in appointments], progress
+
+@tracing.traced("pipeline")
+def run_pipeline(creds, days: Optional[list] = None, calendar_ids: Optional[list] = None,
+                 render: Optional[Callable[[Dict[str, Any]], Dict[str, Any]]] = None, send: bool = False,
+                 send_batch=None, on_progress: Optional[Callable] = None,
+                 concurrency: int = PIPELINE_CONCURRENCY):
+    """
+    Same appointments as get_events(creds, days=...), streamed: events are matched as soon as
+    their calendar page arrives, unknown patients are searched with at most `concurrency`
+    People requests in flight. With send=True each reminder is queued in the outbox (render
+    builds its payload) and sent as soon as its number is confirmed.
+    on_progress(progress, appointment_or_None) is called after every step, on the caller's thread.
+    Returns (appointments, progress counters).
+    """
+    if send and render is None:
+        raise ValueError("render is required to send")
+    target_days = sorted(set(days)) if days else [datetime.now(ZoneInfo("Europe/Rome")).date() + timedelta(days=1)]
+    calendar_ids = list(dict.fromkeys(calendar_ids or GOOGLE_CALENDAR_IDS))
+    return asyncio.run(_pipeline(creds, target_days, calendar_ids, render, send_batch, send, on_progress, concurrency))
@@ -0,0 +1,302 @@
+import os
+import json
+import hashlib
+from datetime import datetime, timedelta, timezone
+from typing import Optional, Dict, Any, List, Callable
+
+from utils import tracing
+
+# Reminder plans computed ahead of time (osteopatia_reminder precompute, e.g. every evening
+# from cron): the appointments of the target days with their resolved phone numbers and the
+# message already rendered, saved as numbered snapshots in tmp/plans/<days>/v0001.json, ...
+# The app only reads the latest snapshot, so the practitioner just confirms and sends.
+#
+# A refresh does not read the whole calendar again: it asks Calendar for the events changed
+# since the snapshot (updatedMin, deleted ones included) and re-resolves only those, plus the
+# appointments whose contact changed in the address book or was corrected by hand.
+PLANS_DIR = os.path.join("tmp", "plans")
+PLAN_KEEP_VERSIONS = 10
+PLAN_REBUILD_HOURS = float(os.getenv("PLAN_REBUILD_HOURS", "24"))  # older snapshots are rebuilt from scratch
+CLOCK_SKEW = timedelta(minutes=1)  # changes saved while we were reading are asked for again next time
+
+# what the plan keeps of each event: enough to rebuild the appointment and recognise it
+_EVENT_FIELDS = ("id", "iCalUID", "recurringEventId", "summary", "description", "start", "updated", "calendar_id")
+
+def _rfc3339(dt: datetime) -> str:
+    return dt.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+def plan_dir(days, plans_dir: str = PLANS_DIR) -> str:
+    """tmp/plans/2026-10-18 for one day, 2026-10-18_2026-10-20 for a range, + a hash when days are skipped."""
+    days = sorted(set(days))
+    name = days[0].isoformat() if len(days) == 1 else f"{days[0].isoformat()}_{days[-1].isoformat()}"
+    if len(days) > 1 and (days[-1] - days[0]).days + 1 != len(days):
+        name += "_" + hashlib.sha1(",".join(d.isoformat() for d in days).encode()).hexdigest()[:8]
+    return os.path.join(plans_dir, name)
+
+def _versions(directory: str) -> List[int]:
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return []
+    return sorted(int(n[1:5]) for n in names if n.startswith("v") and n.endswith(".json") and n[1:5].isdigit())
+
+def _version_file(directory: str, version: int) -> str:
+    return os.path.join(directory, f"v{version:04d}.json")
+
+def load_plan(days, calendar_ids: Optional[list] = None, plans_dir: str = PLANS_DIR,
+              version: Optional[int] = None) -> Optional[Dict[str, Any]]:
+    """Latest snapshot (or a given version) for exactly these days and calendars, or None."""
+    directory = plan_dir(days, plans_dir)
+    versions = _versions(directory)
+    if not versions:
+        return None
+    path = _version_file(directory, version or versions[-1])
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            plan = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"Warning: could not read plan {path}: {e}")
+        return None
+    if calendar_ids is not None and plan.get("calendar_ids") != list(dict.fromkeys(calendar_ids)):
+        return None  # built for other calendars
+    return plan
+
+def _write(plan: Dict[str, Any], directory: str):
+    os.makedirs(directory, exist_ok=True)
+    path = _version_file(directory, plan["version"])
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(plan, f, ensure_ascii=False)
+    # names and phone numbers of patients: owner read/write only
+    try:
+        os.chmod(tmp_path, 0o600)
+    except Exception:
+        pass
+    os.replace(tmp_path, path)
+
+def save_plan(plan: Dict[str, Any], plans_dir: str = PLANS_DIR, new_version: bool = True) -> Dict[str, Any]:
+    """Write the plan as the next version (or over the current one) and drop the oldest versions."""
+    directory = plan_dir([datetime.strptime(d, "%Y-%m-%d").date() for d in plan["days"]], plans_dir)
+    versions = _versions(directory)
+    if new_version or not versions:
+        plan["version"] = (versions[-1] if versions else 0) + 1
+        versions.append(plan["version"])
+    _write(plan, directory)
+    for old in versions[:-PLAN_KEEP_VERSIONS]:
+        try:
+            os.remove(_version_file(directory, old))
+        except OSError:
+            pass
+    return plan
+
+def default_render(tz_name: str = "Europe/Rome") -> Callable[[Dict[str, Any]], Dict[str, Any]]:
+    from utils.messages import load_engine
+    return load_engine(tz_name=tz_name).render
+
+def _entry_key(ev) -> str:
+    return f"{ev.get('calendar_id')}|{ev['id']}"
+
+def _entries(events, appointments, render) -> Dict[str, Dict[str, Any]]:
+    """Plan entries for resolved events: the event (trimmed), its appointment and the rendered message."""
+    from utils.outbox import outbox_key
+    by_key = {outbox_key(each["event_id"] or each["event_name"], each["start"]): each for each in appointments}
+    entries = {}
+    for ev in events:
+        start = ev["start"].get("dateTime", ev["start"].get("date"))
+        appointment = by_key.get(outbox_key(ev.get("id") or ev.get("summary", ""), start))
+        if appointment is None:
+            continue  # unusable phone number: left out, like get_events does
+        entries[_entry_key(ev)] = {
+            "event": {k: ev[k] for k in _EVENT_FIELDS if k in ev},
+            "appointment": appointment,
+            "payload": render(appointment) if appointment["phone"] else None,
+        }
+    return entries
+
+def _new_plan(days, calendar_ids, tz_name, entries, checked_at, diff, full_built_at=None) -> Dict[str, Any]:
+    now = _rfc3339(datetime.now(timezone.utc))
+    return {
+        "days": [d.isoformat() for d in sorted(set(days))],
+        "calendar_ids": calendar_ids,
+        "tz_name": tz_name,
+        "built_at": now,
+        "full_built_at": full_built_at or now,  # last computation from scratch
+        "checked_at": checked_at,
+        "diff": diff,
+        "entries": entries,
+    }
+
+@tracing.traced("plan.build")
+def build_plan(creds, days, calendar_ids: Optional[list] = None, tz_name: str = "Europe/Rome",
+               cache_dir: Optional[str] = None, render=None) -> Dict[str, Any]:
+    """Full computation: whole calendar window, contacts and messages. Saved as a new version."""
+    from utils.google_utils import (GOOGLE_CALENDAR_IDS, fetch_calendars_events, get_day_bounds, event_day,
+                                    get_service, resolve_appointments)
+    from utils.contacts import sync_contact_index
+    from utils.resolution_memo import load_memo
+
+    calendar_ids = list(dict.fromkeys(calendar_ids or GOOGLE_CALENDAR_IDS))
+    target_days = sorted(set(days))
+    checked_at = _rfc3339(datetime.now(timezone.utc) - CLOCK_SKEW)
+    tmin, _ = get_day_bounds(target_days[0], tz_name)
+    _, tmax = get_day_bounds(target_days[-1], tz_name)
+    wanted = set(target_days)
+    contacts_path, memo_path = _cache_paths(cache_dir)
+    store_path = os.path.join(cache_dir, "events.sqlite3") if cache_dir else None
+    events = [ev for ev in fetch_calendars_events(creds, calendar_ids, tmin, tmax, store_path=store_path)
+              if event_day(ev, tz_name) in wanted]
+    appointments = []
+    if events:
+        people_service = get_service("people", "v1", creds)
+        index = sync_contact_index(people_service, path=contacts_path, memo_path=memo_path)
+        appointments = resolve_appointments(events, people_service, index, load_memo(memo_path),
+                                            memo_path=memo_path, tz_name=tz_name)
+    entries = _entries(events, appointments, render or default_render(tz_name))
+    plan = _new_plan(target_days, calendar_ids, tz_name, entries, checked_at, {"full": True})
+    return save_plan(plan, _plans_dir(cache_dir))
+
+def _cache_paths(cache_dir: Optional[str]):
+    from utils.contacts import CONTACTS_CACHE_FILE
+    from utils.resolution_memo import MEMO_FILE
+    if not cache_dir:
+        return CONTACTS_CACHE_FILE, MEMO_FILE
+    return os.path.join(cache_dir, "contacts_cache.json"), os.path.join(cache_dir, "resolution_memo.sqlite3")
+
+def _plans_dir(cache_dir: Optional[str]) -> str:
+    return os.path.join(cache_dir, "plans") if cache_dir else PLANS_DIR
+
+def _stale_contacts(entries, memo, index) -> List[str]:
+    """Entries whose number would come out different now (address book edited, manual correction added or removed)."""
+    from utils.google_utils import sanitize_phone
+    from utils.resolution_memo import memo_key, MANUAL
+    from utils.contacts import is_confident
+    stale = []
+    for key, entry in entries.items():
+        appointment = entry["appointment"]
+        remembered = memo.get(memo_key(appointment["event_name"]))
+        if remembered and remembered["source"] == MANUAL:
+            expected = remembered["phone"]
+        elif appointment["phone_source"] in ("titolo", "descrizione"):
+            continue  # written in the event: only changes with the event
+        elif appointment["phone"] is None:
+            continue  # not found last time: searched again by the next full rebuild
+        else:
+            found = remembered or index.match(appointment["event_name"])
+            expected = sanitize_phone(found["phone"]) if is_confident(found) and found["phone"] else None
+        if expected != appointment["phone"]:
+            stale.append(key)
+    return stale
+
+@tracing.traced("plan.refresh")
+def refresh_plan(creds, days, calendar_ids: Optional[list] = None, tz_name: str = "Europe/Rome",
+                 cache_dir: Optional[str] = None, render=None, full: bool = False) -> Dict[str, Any]:
+    """
+    Bring the latest plan up to date with only the changes since it was checked; a new
+    version is written only if something changed. Falls back to build_plan() when there is
+    no plan yet, it is older than PLAN_REBUILD_HOURS, or a recurring series was edited.
+    """
+    from utils.google_utils import (GOOGLE_CALENDAR_IDS, get_service, iter_changed_events, event_day, event_key,
+                                    resolve_appointments)
+    from utils.contacts import sync_contact_index
+    from utils.resolution_memo import load_memo
+
+    calendar_ids = list(dict.fromkeys(calendar_ids or GOOGLE_CALENDAR_IDS))
+    plans_dir = _plans_dir(cache_dir)
+    plan = None if full else load_plan(days, calendar_ids, plans_dir)
+    if plan is None or _age_hours(plan) > PLAN_REBUILD_HOURS:
+        return build_plan(creds, days, calendar_ids, tz_name, cache_dir, render)
+
+    checked_at = _rfc3339(datetime.now(timezone.utc) - CLOCK_SKEW)
+    cal_service = get_service("calendar", "v3", creds)
+    changed = []
+    for calendar_id in calendar_ids:
+        for ev in iter_changed_events(cal_service, calendar_id, plan["checked_at"]):
+            if ev.get("recurrence") and ev.get("status") != "cancelled":
+                # a series was edited: which occurrences moved is not in the answer
+                print(f"Serie ricorrente modificata ({ev.get('summary', ev['id'])}): ricalcolo il piano")
+                return build_plan(creds, days, calendar_ids, tz_name, cache_dir, render)
+            changed.append({**ev, "calendar_id": calendar_id})
+
+    entries = plan["entries"]
+    wanted = {datetime.strptime(d, "%Y-%m-%d").date() for d in plan["days"]}
+    removed, to_resolve = set(), {}
+    for ev in changed:
+        key = _entry_key(ev)
+        if key in entries and entries[key]["event"].get("updated") == ev.get("updated"):
+            continue  # already in the plan (asked again because of CLOCK_SKEW)
+        if key in entries:
+            removed.add(key)
+        if ev.get("status") == "cancelled":
+            # a deleted series takes all its occurrences with it
+            removed.update(k for k, entry in entries.items()
+                           if entry["event"].get("calendar_id") == ev["calendar_id"] and entry["event"].get("recurringEventId") == ev["id"])
+        elif "start" in ev and event_day(ev, tz_name) in wanted:
+            to_resolve[key] = ev
+
+    contacts_path, memo_path = _cache_paths(cache_dir)
+    people_service = get_service("people", "v1", creds)
+    index = sync_contact_index(people_service, path=contacts_path, memo_path=memo_path)
+    memo = load_memo(memo_path)
+    stale = [key for key in _stale_contacts(entries, memo, index) if key not in removed]
+    for key in stale:
+        to_resolve[key] = entries[key]["event"]
+
+    if not removed and not to_resolve:
+        # nothing new: same version, just remember how far we looked
+        plan["checked_at"] = checked_at
+        return save_plan(plan, plans_dir, new_version=False)
+
+    before = {key: entries[key]["appointment"] for key in removed | set(stale)}
+    kept = {key: entry for key, entry in entries.items() if key not in removed and key not in stale}
+    # the same event shared by two calendars is kept once, as in a full build
+    known = {event_key(entry["event"]) for entry in kept.values()}
+    events = []
+    for ev in to_resolve.values():
+        if event_key(ev) not in known:
+            known.add(event_key(ev))
+            events.append(ev)
+    appointments = resolve_appointments(events, people_service, index, memo, memo_path=memo_path, tz_name=tz_name) if events else []
+    fresh = _entries(events, appointments, render or default_render(tz_name))
+    kept.update(fresh)
+
+    diff = {
+        "full": False,
+        "added": sorted(fresh[k]["appointment"]["event_name"] for k in fresh if k not in before),
+        "changed": sorted(fresh[k]["appointment"]["event_name"] for k in fresh if k in before),
+        "removed": sorted(before[k]["event_name"] for k in before if k not in fresh),
+    }
+    plan = _new_plan(wanted, calendar_ids, tz_name, kept, checked_at, diff, plan.get("full_built_at"))
+    return save_plan(plan, plans_dir)
+
+def _age_hours(plan: Dict[str, Any]) -> float:
+    built = datetime.strptime(plan.get("full_built_at") or plan["built_at"], "%Y-%m-%dT%H:%M:%SZ").replace(tzinfo=timezone.utc)
+    return (datetime.now(timezone.utc) - built).total_seconds() / 3600
+
+def plan_appointments(plan: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """The appointments of a plan in start order, as get_events returns them."""
+    appointments = [entry["appointment"] for entry in plan["entries"].values()]
+    appointments.sort(key=lambda each: (each["start"], each["event_name"]))
+    return appointments
+
+def plan_render(plan: Dict[str, Any], fallback=None) -> Callable[[Dict[str, Any]], Dict[str, Any]]:
+    """render() for outbox.enqueue that returns the messages rendered in the plan."""
+    from utils.outbox import outbox_key
+    payloads = {outbox_key(entry["appointment"]["event_id"] or entry["appointment"]["event_name"], entry["appointment"]["start"]): entry["payload"]
+                for entry in plan["entries"].values() if entry["payload"] is not None}
+    fallback = fallback or default_render(plan.get("tz_name", "Europe/Rome"))
+
+    def render(each):
+        payload = payloads.get(outbox_key(each.get("event_id") or each["event_name"], each["start"]))
+        return payload if payload is not None else fallback(each)
+    return render
+
+def describe(plan: Dict[str, Any]) -> str:
+    """"versione 3 del 17/10 alle 19:02: 1 nuovo, 2 modificati, 0 tolti" (local time)."""
+    from zoneinfo import ZoneInfo
+    built = datetime.strptime(plan["built_at"], "%Y-%m-%dT%H:%M:%SZ").replace(tzinfo=timezone.utc)
+    local = built.astimezone(ZoneInfo(plan.get("tz_name", "Europe/Rome")))
+    text = f"versione {plan['version']} del {local:%d/%m} alle {local:%H:%M}"
+    diff = plan.get("diff") or {}
+    if diff.get("full"):
+        return text + ": calcolata da zero"
+    return text + f": {len(diff.get('added', []))} nuovi, {len(diff.get('changed', []))} modificati, {len(diff.get('removed', []))} tolti"
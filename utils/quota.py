@@ -0,0 +1,197 @@
+import os
+import time
+import random
+import threading
+from typing import Optional, Dict, Any, Callable
+
+from utils import tracing
+
+# Every Google and Twilio call of utils/ goes through here: one token bucket per API, filled
+# at the budget rate, so a busy day is spread over time instead of hitting the per-minute
+# quota and getting 429s. The refill rate adapts: halved on 429 / 503 (and paused for the
+# Retry-After the server asked for), then slowly restored after successes.
+#
+# Google quotas are per user: each practice's token (utils/tenants.py) has its own People and
+# Calendar buckets, "people:<token file>" (see for_service), so one practice's 429s do not slow
+# down the others. The default token keeps the plain "people" / "calendar" names.
+#
+#   QUOTA_PEOPLE_PER_MIN    People API (default 90: "read requests per minute per user")
+#   QUOTA_CALENDAR_PER_MIN  Calendar API (default 600)
+#   QUOTA_TWILIO_PER_MIN    Twilio REST, per account (default 6000)
+#   QUOTA_BURST_SECONDS     how many seconds of budget may go out at once (default 10)
+#   QUOTA_MAX_RETRIES       retries of a call that got 429 / 503 (default 5)
+BUDGETS = {
+    "people": float(os.getenv("QUOTA_PEOPLE_PER_MIN", "90")) / 60,
+    "calendar": float(os.getenv("QUOTA_CALENDAR_PER_MIN", "600")) / 60,
+    "twilio": float(os.getenv("QUOTA_TWILIO_PER_MIN", "6000")) / 60,
+}
+QUOTA_BURST_SECONDS = float(os.getenv("QUOTA_BURST_SECONDS", "10"))
+QUOTA_MAX_RETRIES = int(os.getenv("QUOTA_MAX_RETRIES", "5"))
+BACKOFF_BASE = 1.0   # seconds, doubled at every retry of the same call
+BACKOFF_MAX = 60.0
+MIN_RATE_FACTOR = 0.05  # the adaptive rate never goes below 5% of the budget
+RECOVERY_STEP = 0.02    # +2% of the budget per request that went through
+
+RETRYABLE_STATUS = (429, 503)
+
+def error_status(e: Exception) -> Optional[int]:
+    """HTTP status of a googleapiclient HttpError or a TwilioRestException (None for anything else)."""
+    resp = getattr(e, "resp", None)
+    status = getattr(resp, "status", None) if resp is not None else getattr(e, "status", None)
+    try:
+        return int(status) if status is not None else None
+    except (TypeError, ValueError):
+        return None
+
+def _retry_after(e: Exception) -> Optional[float]:
+    resp = getattr(e, "resp", None)
+    value = resp.get("retry-after") if hasattr(resp, "get") else None
+    try:
+        return max(0.0, float(value)) if value else None
+    except ValueError:
+        return None
+
+class TokenBucket:
+    """Blocking token bucket with an adaptive refill rate. Thread-safe."""
+
+    def __init__(self, name: str, rate: float, burst_seconds: float = QUOTA_BURST_SECONDS):
+        self.name = name
+        self.budget = rate
+        self.rate = rate
+        self.capacity = max(1.0, rate * burst_seconds)
+        self.tokens = self.capacity
+        self.paused_until = 0.0
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+        self.counters = {"calls": 0, "units": 0, "waited": 0, "wait_s": 0.0, "throttled": 0,
+                         "unavailable": 0, "retries": 0, "gave_up": 0}
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    def acquire(self, cost: float = 1):
+        """
+        Wait for `cost` tokens. A cost bigger than the bucket (a whole batch request) only
+        waits for a full bucket and leaves it in debt, so the following calls wait instead.
+        """
+        need = min(cost, self.capacity)
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                delay = max(0.0, self.paused_until - now)
+                if not delay and self.tokens >= need:
+                    self.tokens -= cost
+                    self.counters["calls"] += 1
+                    self.counters["units"] += cost
+                    if waited:
+                        self.counters["waited"] += 1
+                        self.counters["wait_s"] += waited
+                    return waited
+                delay = delay or (need - self.tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+    def penalize(self, status: Optional[int], retry_after: Optional[float] = None):
+        """The server pushed back: halve the rate and, with a Retry-After, pause everyone."""
+        with self._lock:
+            self.counters["throttled" if status == 429 else "unavailable"] += 1
+            self.rate = max(self.budget * MIN_RATE_FACTOR, self.rate / 2)
+            if retry_after:
+                self.paused_until = max(self.paused_until, time.monotonic() + retry_after)
+        tracing.count(f"quota.{self.name}.{status}")
+
+    def succeed(self, cost: float = 1):
+        if self.rate < self.budget:
+            with self._lock:
+                self.rate = min(self.budget, self.rate + self.budget * RECOVERY_STEP * cost)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {**self.counters, "wait_s": round(self.counters["wait_s"], 2),
+                    "rate_per_min": round(self.rate * 60, 1), "budget_per_min": round(self.budget * 60, 1)}
+
+_buckets: Dict[str, TokenBucket] = {}
+_buckets_lock = threading.Lock()
+
+def bucket(api: str) -> TokenBucket:
+    """
+    The bucket of an API: "people", "calendar", "twilio", or "<api>:<key>" for a separate
+    bucket with the same budget (e.g. one per Twilio account).
+    """
+    with _buckets_lock:
+        b = _buckets.get(api)
+        if b is None:
+            b = _buckets[api] = TokenBucket(api, BUDGETS[api.split(":", 1)[0]])
+        return b
+
+def for_service(api: str, service) -> str:
+    """The bucket of a Google `api` for the user of `service` (get_service tags it with its token)."""
+    user = getattr(service, "quota_user", None)
+    return f"{api}:{user}" if user else api
+
+def backoff_delay(attempt: int, retry_after: Optional[float] = None) -> float:
+    if retry_after is not None:
+        return min(BACKOFF_MAX, retry_after)
+    return min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt) * random.uniform(0.5, 1.0)
+
+def call(api: str, fn: Callable[[], Any], cost: float = 1, retries: Optional[int] = None) -> Any:
+    """
+    Run fn() (one API round trip) within the budget of `api`. On 429 / 503 the bucket slows
+    down and the call is retried with exponential backoff up to `retries` times
+    (QUOTA_MAX_RETRIES); any other error, or the last one, is raised to the caller.
+    """
+    b = bucket(api)
+    retries = QUOTA_MAX_RETRIES if retries is None else retries
+    attempt = 0
+    while True:
+        b.acquire(cost)
+        try:
+            result = fn()
+        except Exception as e:
+            status = error_status(e)
+            if status not in RETRYABLE_STATUS:
+                raise
+            retry_after = _retry_after(e)
+            b.penalize(status, retry_after)
+            if attempt >= retries:
+                count(api, "gave_up")
+                raise
+            count(api, "retries")
+            time.sleep(backoff_delay(attempt, retry_after))
+            attempt += 1
+            continue
+        b.succeed(cost)
+        return result
+
+def observe(api: str, e: Optional[Exception]):
+    """Feedback for a call made outside call() (e.g. one sub-request of a batch)."""
+    status = error_status(e) if e is not None else None
+    if status in RETRYABLE_STATUS:
+        bucket(api).penalize(status, _retry_after(e))
+    elif e is None:
+        bucket(api).succeed()
+
+def count(api: str, counter: str, n: int = 1):
+    b = bucket(api)
+    with b._lock:
+        b.counters[counter] += n
+
+def stats() -> Dict[str, Dict[str, Any]]:
+    """Counters per bucket, for monitoring: calls, waits, 429 / 503 seen, retries, current rate."""
+    with _buckets_lock:
+        buckets = list(_buckets.values())
+    return {b.name: b.stats() for b in buckets}
+
+def summary_line() -> str:
+    parts = []
+    for name, s in sorted(stats().items()):
+        parts.append(f"{name}: {s['calls']} chiamate, attese {s['waited']} ({s['wait_s']} s), "
+                     f"429 {s['throttled']}, 503 {s['unavailable']}, ritentate {s['retries']}, fallite {s['gave_up']}")
+    return "; ".join(parts)
+
+def reset():
+    with _buckets_lock:
+        _buckets.clear()
@@ -0,0 +1,134 @@
+import os
+import time
+import sqlite3
+from typing import Optional, Dict, Any, List, Iterable
+
+from utils.contacts import normalize_query
+
+# Persistent summary -> contact memo: weekly patients have the same calendar summary every
+# time, so once resolved (index or People search) they are found again without any lookup.
+#   - automatic entries expire after MEMO_TTL_DAYS and are dropped when the People sync
+#     reports a change to their contact;
+#   - manual entries (corrections made in the app) never expire and win over everything.
+MEMO_FILE = os.path.join("tmp", "resolution_memo.sqlite3")
+MEMO_TTL_DAYS = float(os.getenv("RESOLUTION_MEMO_TTL_DAYS", "60"))
+
+AUTO = "auto"
+MANUAL = "manual"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS memo (
+    query TEXT PRIMARY KEY,
+    resource_name TEXT,
+    name TEXT NOT NULL,
+    phone TEXT,
+    source TEXT NOT NULL,
+    expires_at REAL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS memo_contact ON memo (resource_name);
+"""
+
+def _connect(path: str = MEMO_FILE) -> sqlite3.Connection:
+    d = os.path.dirname(path) or "."
+    os.makedirs(d, exist_ok=True)
+    conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript(_SCHEMA)
+    return conn
+
+def memo_key(summary: str) -> str:
+    return normalize_query(summary).casefold()
+
+def _contact(row: sqlite3.Row) -> Dict[str, Any]:
+    return {"name": row["name"], "phone": row["phone"], "resource_name": row["resource_name"], "source": row["source"]}
+
+def load_memo(path: str = MEMO_FILE) -> Dict[str, Dict[str, Any]]:
+    """All live entries, {memo_key: contact}; expired automatic entries are deleted on the way."""
+    conn = _connect(path)
+    try:
+        conn.execute("DELETE FROM memo WHERE source = ? AND expires_at < ?", (AUTO, time.time()))
+        return {row["query"]: _contact(row) for row in conn.execute("SELECT * FROM memo")}
+    finally:
+        conn.close()
+
+def remember(resolved: Dict[str, Dict[str, Any]], path: str = MEMO_FILE, ttl_days: float = MEMO_TTL_DAYS):
+    """
+    Store automatic resolutions {summary: {"name", "phone" (E.164 or None), "resource_name"}}.
+    Manual entries are never overwritten.
+    """
+    if not resolved:
+        return
+    now = time.time()
+    rows = [(memo_key(summary), c.get("resource_name"), c["name"], c.get("phone"), AUTO, now + ttl_days * 86400, now)
+            for summary, c in resolved.items() if memo_key(summary)]
+    conn = _connect(path)
+    try:
+        conn.executemany(
+            "INSERT INTO memo (query, resource_name, name, phone, source, expires_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT(query) DO UPDATE SET resource_name = excluded.resource_name, name = excluded.name, "
+            "phone = excluded.phone, expires_at = excluded.expires_at, updated_at = excluded.updated_at "
+            "WHERE memo.source != 'manual'",
+            rows,
+        )
+    finally:
+        conn.close()
+
+def set_override(summary: str, name: str, phone: Optional[str], path: str = MEMO_FILE):
+    """Manual correction: this summary is always `name` / `phone` (E.164, or None for "do not send")."""
+    conn = _connect(path)
+    try:
+        conn.execute(
+            "INSERT OR REPLACE INTO memo (query, resource_name, name, phone, source, expires_at, updated_at) "
+            "VALUES (?, NULL, ?, ?, ?, NULL, ?)",
+            (memo_key(summary), name, phone, MANUAL, time.time()),
+        )
+    finally:
+        conn.close()
+
+def remove_entry(query: str, path: str = MEMO_FILE):
+    conn = _connect(path)
+    try:
+        conn.execute("DELETE FROM memo WHERE query = ?", (query,))
+    finally:
+        conn.close()
+
+def load_overrides(path: str = MEMO_FILE) -> Dict[str, Dict[str, Any]]:
+    """Only the manual entries, {memo_key: contact}."""
+    conn = _connect(path)
+    try:
+        return {row["query"]: _contact(row) for row in conn.execute("SELECT * FROM memo WHERE source = ?", (MANUAL,))}
+    finally:
+        conn.close()
+
+def list_overrides(path: str = MEMO_FILE) -> List[Dict[str, Any]]:
+    conn = _connect(path)
+    try:
+        rows = conn.execute("SELECT query, name, phone FROM memo WHERE source = ? ORDER BY query", (MANUAL,)).fetchall()
+        return [dict(row) for row in rows]
+    finally:
+        conn.close()
+
+def invalidate_contacts(resource_names: Iterable[str], path: str = MEMO_FILE) -> int:
+    """Drop the automatic entries of contacts changed (or deleted) in the address book."""
+    resource_names = [(rn,) for rn in set(resource_names) if rn]
+    if not resource_names:
+        return 0
+    conn = _connect(path)
+    try:
+        before = conn.total_changes
+        conn.executemany("DELETE FROM memo WHERE source = 'auto' AND resource_name = ?", resource_names)
+        return conn.total_changes - before
+    finally:
+        conn.close()
+
+def invalidate_all(path: str = MEMO_FILE) -> int:
+    """After a full address book resync we no longer know what changed: keep only the manual entries."""
+    if not os.path.exists(path):
+        return 0
+    conn = _connect(path)
+    try:
+        return conn.execute("DELETE FROM memo WHERE source = 'auto'").rowcount
+    finally:
+        conn.close()
@@ -0,0 +1,148 @@
+import os
+import time
+import threading
+from datetime import datetime, date, timedelta, timezone
+from zoneinfo import ZoneInfo
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import Optional, Dict, Any, List
+
+from utils.tenants import Tenant
+
+# Daily reminder job of many practices in one process. Two shared pools:
+#   - SCHEDULER_JOBS tenants are processed at the same time (calendar + contacts + enqueue);
+#   - their sends all go through one pool of SCHEDULER_SEND_WORKERS threads. Each tenant's
+#     job thread waits on its own RateLimiter (tenant.max_mps) and only then submits the
+#     message, so the workers never sleep on a slow tenant: a big practice cannot starve
+#     the others and idle tenants cost nothing.
+# Retries are not waited for inside a job: the next tick drains the outboxes with due retries.
+SCHEDULER_JOBS = int(os.getenv("SCHEDULER_JOBS", "4"))
+SCHEDULER_SEND_WORKERS = int(os.getenv("SCHEDULER_SEND_WORKERS", "16"))
+SCHEDULER_POLL = float(os.getenv("SCHEDULER_POLL", "30"))  # seconds between ticks
+
+def _last_run_file(tenant: Tenant) -> str:
+    return os.path.join(tenant.data_dir, "last_run")
+
+def last_run(tenant: Tenant) -> Optional[date]:
+    try:
+        with open(_last_run_file(tenant), "r", encoding="utf-8") as f:
+            return date.fromisoformat(f.read().strip())
+    except (OSError, ValueError):
+        return None
+
+def mark_run(tenant: Tenant, day: date):
+    os.makedirs(tenant.data_dir, exist_ok=True)
+    tmp_path = _last_run_file(tenant) + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(day.isoformat())
+    os.replace(tmp_path, _last_run_file(tenant))
+
+def is_due(tenant: Tenant, now: Optional[datetime] = None) -> bool:
+    """Past the tenant's send_at (its local time) and not run yet today."""
+    local = (now or datetime.now(timezone.utc)).astimezone(ZoneInfo(tenant.timezone))
+    return local.hour * 60 + local.minute >= tenant.send_at_minutes and last_run(tenant) != local.date()
+
+class Scheduler:
+
+    def __init__(self, tenants: List[Tenant], jobs: int = SCHEDULER_JOBS, send_workers: int = SCHEDULER_SEND_WORKERS):
+        from utils.twilio_utils import RateLimiter
+        self.tenants = tenants
+        self._jobs = ThreadPoolExecutor(max_workers=max(1, jobs), thread_name_prefix="tenant-job")
+        self._send_pool = ThreadPoolExecutor(max_workers=max(1, send_workers), thread_name_prefix="twilio-send")
+        self._limiters = {t.id: RateLimiter(t.max_mps) for t in tenants}
+        self._running: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+
+    def _send_batch(self, tenant: Tenant):
+        from utils.twilio_utils import get_twilio_client, send_twilio_messages
+        from utils.status_webhook import tenant_callback_url
+        client = get_twilio_client(tenant.twilio_account_sid, tenant.twilio_auth_token)
+        status_callback = tenant_callback_url(tenant.id)  # the receiver stores it in this tenant's outbox
+
+        def send_batch(messages):
+            return send_twilio_messages(messages, client=client, from_number=tenant.whatsapp_number,
+                                        template_id=tenant.template_id, limiter=self._limiters[tenant.id],
+                                        pool=self._send_pool, status_callback=status_callback)
+        return send_batch
+
+    def run_tenant(self, tenant: Tenant, dry_run: bool = False) -> Dict[str, Any]:
+        """One tenant's daily job: tomorrow's (days_ahead) appointments -> outbox -> first send pass."""
+        from utils.google_utils import get_shared_credentials, get_events
+        from utils.outbox import enqueue, drain, recover_interrupted
+        from utils.messages import load_engine
+
+        result = {"tenant": tenant.id, "appointments": 0, "queued": 0, "sent": 0, "retried": 0, "failed": 0, "error": None}
+        today = datetime.now(ZoneInfo(tenant.timezone)).date()
+        creds = get_shared_credentials(tenant.token_file)
+        if not creds:
+            result["error"] = f"token Google mancante o scaduto ({tenant.token_file})"
+            print(f"[{tenant.id}] {result['error']}")
+            return result
+        os.makedirs(tenant.data_dir, exist_ok=True)
+        days = [today + timedelta(days=tenant.days_ahead)]
+        appointments = get_events(creds, days=days, calendar_ids=tenant.calendar_ids,
+                                  tz_name=tenant.timezone, cache_dir=tenant.data_dir) or []
+        to_send = [each for each in appointments if each["phone"]]
+        result["appointments"] = len(appointments)
+        if dry_run:
+            result["queued"] = len(to_send)
+            return result
+
+        recover_interrupted(path=tenant.outbox_file)
+        result["queued"] = len(enqueue(to_send, load_engine(tenant.templates_file, tenant.timezone).render,
+                                       path=tenant.outbox_file))
+        mark_run(tenant, today)  # queued: from here on the outbox makes sure nothing is sent twice
+        result.update(drain(self._send_batch(tenant), path=tenant.outbox_file, wait=False))
+        print(f"[{tenant.id}] {result['appointments']} appuntamenti, inviati {result['sent']}, "
+              f"da riprovare {result['retried']}, non inviati {result['failed']}")
+        return result
+
+    def _drain_tenant(self, tenant: Tenant) -> Dict[str, Any]:
+        from utils.outbox import drain
+        return {"tenant": tenant.id, **drain(self._send_batch(tenant), path=tenant.outbox_file, wait=False)}
+
+    def _submit(self, tenant: Tenant, fn, *args) -> Optional[Future]:
+        with self._lock:
+            running = self._running.get(tenant.id)
+            if running is not None and not running.done():
+                return None  # still busy from the previous tick
+            future = self._jobs.submit(self._guarded, tenant, fn, *args)
+            self._running[tenant.id] = future
+            return future
+
+    def _guarded(self, tenant: Tenant, fn, *args):
+        try:
+            return fn(*args)
+        except Exception as e:
+            # one practice's broken calendar / token must not stop the others
+            print(f"[{tenant.id}] job fallito: {e}")
+            return {"tenant": tenant.id, "error": str(e)}
+
+    def tick(self, now: Optional[datetime] = None) -> List[Future]:
+        """Start the jobs that are due and the retry passes of outboxes with due retries."""
+        from utils.outbox import has_due
+        futures = []
+        for tenant in self.tenants:
+            if is_due(tenant, now):
+                future = self._submit(tenant, self.run_tenant, tenant)
+            elif os.path.exists(tenant.outbox_file) and has_due(tenant.outbox_file):
+                future = self._submit(tenant, self._drain_tenant, tenant)
+            else:
+                continue
+            if future is not None:
+                futures.append(future)
+        return futures
+
+    def run_all(self, dry_run: bool = False) -> List[Dict[str, Any]]:
+        """Run every tenant now (whatever send_at says) and wait for the results."""
+        futures = [self._jobs.submit(self._guarded, t, self.run_tenant, t, dry_run) for t in self.tenants]
+        return [f.result() for f in futures]
+
+    def run_forever(self, poll: float = SCHEDULER_POLL):
+        print(f"Scheduler avviato: {len(self.tenants)} studi")
+        while True:
+            self.tick()
+            time.sleep(poll)
+
+    def shutdown(self):
+        self._jobs.shutdown(wait=True)
+        self._send_pool.shutdown(wait=True)
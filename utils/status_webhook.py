@@ -0,0 +1,205 @@
+import os
+import threading
+from urllib.parse import parse_qsl, urlencode, urlsplit
+from urllib.request import Request, urlopen
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional, Dict, List, TYPE_CHECKING
+
+from utils import outbox, tracing, event_store
+
+if TYPE_CHECKING:
+    from utils.tenants import Tenant
+
+# Receiver for Twilio's status_callback: Twilio POSTs (form encoded) MessageSid + MessageStatus
+# (sent, delivered, read, undelivered, failed, ...) every time a message changes state.
+# Statuses go in the outbox database (delivery table), where the app reads them with one query.
+#
+# Expose it with a tunnel or reverse proxy and set STATUS_CALLBACK_URL to the public URL
+# (e.g. https://promemoria.example.com/twilio/status): it is passed to messages.create and
+# used to check the X-Twilio-Signature of every request.
+#
+# The same server receives Google Calendar push notifications on CALENDAR_WEBHOOK_PATH: set
+# CALENDAR_WEBHOOK_URL to its public https URL and utils/event_store.py opens a watch channel
+# per calendar. Notifications carry no data, they only mark the calendar to be synced.
+#
+# Practices of the scheduler (utils/tenants.py) send with their own Twilio account: their
+# callbacks come to STATUS_CALLBACK_URL?tenant=<id> and are checked with that tenant's auth
+# token and stored in its outbox. Calendar notifications are looked up in every tenant's store
+# (channel ids are unique), so the watch address needs no tenant.
+STATUS_WEBHOOK_HOST = os.getenv("STATUS_WEBHOOK_HOST", "127.0.0.1")
+STATUS_WEBHOOK_PORT = int(os.getenv("STATUS_WEBHOOK_PORT", "8765"))
+STATUS_WEBHOOK_PATH = "/twilio/status"
+CALENDAR_WEBHOOK_PATH = "/google/calendar"
+# signature check needs the auth token; set STATUS_WEBHOOK_VALIDATE=0 only for local tests
+STATUS_WEBHOOK_VALIDATE = os.getenv("STATUS_WEBHOOK_VALIDATE", "1") == "1"
+
+def _auth_token() -> Optional[str]:
+    return os.getenv("TWILIO_AUTH_TOKEN_NEW")
+
+def _local_url(path: str = STATUS_WEBHOOK_PATH) -> str:
+    return f"http://{STATUS_WEBHOOK_HOST}:{STATUS_WEBHOOK_PORT}{path}"
+
+def _public_url(query: str = "") -> str:
+    # the URL Twilio signs: the public one, not the address behind the tunnel / proxy, with the query
+    url = os.getenv("STATUS_CALLBACK_URL") or _local_url()
+    return f"{url}?{query}" if query else url
+
+def tenant_callback_url(tenant_id: str) -> Optional[str]:
+    """status_callback of a scheduler tenant's messages; None without STATUS_CALLBACK_URL."""
+    url = os.getenv("STATUS_CALLBACK_URL")
+    return f"{url}?{urlencode({'tenant': tenant_id})}" if url else None
+
+def sign(url: str, params: Dict[str, str], auth_token: str) -> str:
+    """X-Twilio-Signature for a form POST (same algorithm as twilio.request_validator)."""
+    from twilio.request_validator import RequestValidator
+    return RequestValidator(auth_token).compute_signature(url, params)
+
+class _Handler(BaseHTTPRequestHandler):
+    server_version = "osteopatia-status/1"
+    outbox_path = outbox.OUTBOX_FILE
+    events_path = event_store.EVENTS_FILE
+    tenants: Dict[str, "Tenant"] = {}
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        if url.path == CALENDAR_WEBHOOK_PATH:
+            self._calendar_notification()
+            return
+        if url.path != STATUS_WEBHOOK_PATH:
+            self.send_error(404)
+            return
+        length = int(self.headers.get("Content-Length") or 0)
+        params = dict(parse_qsl(self.rfile.read(length).decode("utf-8")))
+        tracing.count("webhook.status")
+
+        token, outbox_path = _auth_token(), self.outbox_path
+        tenant_id = dict(parse_qsl(url.query)).get("tenant")
+        if tenant_id is not None:
+            tenant = self.tenants.get(tenant_id)
+            if tenant is None:
+                self.send_error(404, "unknown tenant")
+                return
+            token, outbox_path = tenant.twilio_auth_token or token, tenant.outbox_file
+
+        if STATUS_WEBHOOK_VALIDATE:
+            from twilio.request_validator import RequestValidator
+            if not token or not RequestValidator(token).validate(_public_url(url.query), params,
+                                                                 self.headers.get("X-Twilio-Signature", "")):
+                self.send_error(403, "invalid signature")
+                return
+
+        sid, status = params.get("MessageSid"), params.get("MessageStatus")
+        if not sid or not status:
+            self.send_error(400, "MessageSid and MessageStatus are required")
+            return
+        try:
+            outbox.record_delivery(sid, status, params.get("ErrorCode"), path=outbox_path)
+        except Exception as e:
+            print(f"Warning: could not store status {status} for {sid}: {e}")
+            self.send_error(500)  # Twilio retries the callback
+            return
+        self.send_response(204)
+        self.end_headers()
+
+    def _calendar_notification(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        if length:
+            self.rfile.read(length)  # Google sends no body, just in case
+        tracing.count("webhook.calendar")
+        channel_id = self.headers.get("X-Goog-Channel-ID")
+        state = self.headers.get("X-Goog-Resource-State", "")
+        if not channel_id:
+            self.send_error(400, "X-Goog-Channel-ID is required")
+            return
+        # the store that opened the channel: the process one or a tenant's
+        paths = list(dict.fromkeys([self.events_path] + [t.events_file for t in self.tenants.values()]))
+        try:
+            known = any(event_store.handle_notification(channel_id, self.headers.get("X-Goog-Channel-Token"), state,
+                                                        path=path)
+                        for path in paths if os.path.exists(path))
+        except Exception as e:
+            print(f"Warning: could not handle calendar notification for channel {channel_id}: {e}")
+            self.send_error(500)  # Google retries the notification
+            return
+        if not known:
+            self.send_error(403, "unknown channel or wrong token")
+            return
+        self.send_response(200)
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass  # one line per callback would flood the logs
+
+def make_server(host: str = STATUS_WEBHOOK_HOST, port: int = STATUS_WEBHOOK_PORT,
+                path: str = outbox.OUTBOX_FILE, events_path: str = event_store.EVENTS_FILE,
+                tenants: Optional[List["Tenant"]] = None) -> ThreadingHTTPServer:
+    handler = type("Handler", (_Handler,), {"outbox_path": path, "events_path": events_path,
+                                            "tenants": {t.id: t for t in tenants or []}})
+    return ThreadingHTTPServer((host, port), handler)
+
+_server: Optional[ThreadingHTTPServer] = None
+_server_lock = threading.Lock()
+
+def start_status_server(host: str = STATUS_WEBHOOK_HOST, port: int = STATUS_WEBHOOK_PORT,
+                        path: str = outbox.OUTBOX_FILE) -> bool:
+    """Serve the callbacks from a daemon thread (once per process). Returns False if already running or the port is taken."""
+    global _server
+    with _server_lock:
+        if _server is not None:
+            return False
+        try:
+            _server = make_server(host, port, path)
+        except OSError as e:
+            # e.g. another Streamlit process already listens on the port: that one stores the statuses
+            print(f"Warning: status webhook not started on {host}:{port}: {e}")
+            return False
+        threading.Thread(target=_server.serve_forever, name="status-webhook", daemon=True).start()
+        print(f"Ricevo gli stati di consegna su http://{host}:{_server.server_address[1]}{STATUS_WEBHOOK_PATH}")
+        return True
+
+def post_synthetic_callback(sid: str, status: str, url: Optional[str] = None, error_code: Optional[str] = None,
+                            auth_token: Optional[str] = None, tenant: Optional[str] = None) -> int:
+    """
+    Post a fake Twilio status callback to the receiver (default: the local address), signed
+    like Twilio does when an auth token is available, so it also passes STATUS_WEBHOOK_VALIDATE=1.
+    tenant: as the callback of that scheduler tenant (?tenant=<id>). Returns the HTTP status.
+    """
+    query = urlencode({"tenant": tenant}) if tenant else ""
+    params = {"MessageSid": sid, "MessageStatus": status, "SmsSid": sid, "SmsStatus": status}
+    if error_code:
+        params["ErrorCode"] = error_code
+    headers = {"Content-Type": "application/x-www-form-urlencoded"}
+    token = auth_token or _auth_token()
+    if token:
+        headers["X-Twilio-Signature"] = sign(_public_url(query), params, token)
+    url = url or _local_url()
+    request = Request(f"{url}?{query}" if query else url, data=urlencode(params).encode(), headers=headers, method="POST")
+    try:
+        with urlopen(request, timeout=10) as resp:
+            return resp.status
+    except Exception as e:
+        code = getattr(e, "code", None)
+        if code is None:
+            raise
+        return code
+
+def post_synthetic_calendar_notification(calendar_id: str, state: str = "exists", url: Optional[str] = None,
+                                         path: str = event_store.EVENTS_FILE) -> int:
+    """
+    Post a fake Google Calendar push notification for the watch channel of `calendar_id`
+    (default: to the local receiver), as Google does when an event changes. Returns the HTTP status.
+    """
+    channel = event_store.channel_of(calendar_id, path=path)
+    if channel is None:
+        raise ValueError(f"nessun canale di notifica aperto per il calendario {calendar_id}")
+    headers = {"X-Goog-Channel-ID": channel["channel_id"], "X-Goog-Channel-Token": channel["token"] or "",
+               "X-Goog-Resource-State": state, "X-Goog-Message-Number": "1", "Content-Length": "0"}
+    request = Request(url or _local_url(CALENDAR_WEBHOOK_PATH), data=b"", headers=headers, method="POST")
+    try:
+        with urlopen(request, timeout=10) as resp:
+            return resp.status
+    except Exception as e:
+        code = getattr(e, "code", None)
+        if code is None:
+            raise
+        return code
@@ -0,0 +1,97 @@
+import os
+import tomllib
+from dataclasses import dataclass, field
+from typing import Optional, Dict, Any, List
+
+# One practice (osteopath) served by this process: its Google token, calendars, Twilio sender
+# and template, timezone and when its daily reminders go out. Without a tenants file there is
+# a single "default" tenant built from the same env variables the app has always used.
+#
+# tenants.toml:
+#
+#   [tenants.rossi]
+#   name = "Studio Rossi"
+#   calendar_ids = ["studio.rossi@gmail.com"]
+#   whatsapp_number = "+39021234567"
+#   template_id = "HX..."
+#   send_at = "18:30"           # local time of the daily job (reminders for tomorrow)
+#   max_mps = 2                 # Twilio messages per second for this practice
+#   # optional: timezone, days_ahead, token_file, data_dir, templates_file (utils/messages.py),
+#   # twilio_account_sid / twilio_auth_token (default: the shared account from the env)
+TENANTS_FILE = os.getenv("TENANTS_FILE", "tenants.toml")
+TENANTS_DIR = os.path.join("tmp", "tenants")
+
+@dataclass
+class Tenant:
+    id: str
+    name: str = ""
+    calendar_ids: List[str] = field(default_factory=list)
+    timezone: str = "Europe/Rome"
+    whatsapp_number: Optional[str] = None
+    template_id: Optional[str] = None
+    twilio_account_sid: Optional[str] = None
+    twilio_auth_token: Optional[str] = None
+    send_at: str = "18:00"
+    days_ahead: int = 1
+    max_mps: float = 2.0
+    token_file: str = ""
+    data_dir: str = ""
+    templates_file: Optional[str] = None  # default: $MESSAGE_TEMPLATES_FILE
+
+    def __post_init__(self):
+        # everything on disk is per tenant: token, contacts cache, resolution memo, outbox
+        self.data_dir = self.data_dir or os.path.join(TENANTS_DIR, self.id)
+        self.token_file = self.token_file or os.path.join(self.data_dir, "token.json")
+        self.name = self.name or self.id
+
+    @property
+    def outbox_file(self) -> str:
+        return os.path.join(self.data_dir, "outbox.sqlite3")
+
+    @property
+    def events_file(self) -> str:
+        # the calendar store get_events keeps in cache_dir (utils/event_store.py)
+        return os.path.join(self.data_dir, "events.sqlite3")
+
+    @property
+    def send_at_minutes(self) -> int:
+        hours, minutes = self.send_at.split(":")
+        return int(hours) * 60 + int(minutes)
+
+def default_tenant() -> Tenant:
+    """The single practice of a classic deployment: env variables and tmp/ as before."""
+    from utils.google_utils import GOOGLE_CALENDAR_IDS, TOKEN_FILE
+    from utils.outbox import OUTBOX_FILE
+    return Tenant(
+        id="default",
+        calendar_ids=[c for c in GOOGLE_CALENDAR_IDS if c],
+        whatsapp_number=os.getenv("WHATSAPP_PHONE_NUMBER"),
+        template_id=os.getenv("TEMPLATE_ID"),
+        send_at=os.getenv("REMINDER_SEND_AT", "18:00"),
+        max_mps=float(os.getenv("TWILIO_MAX_MPS", "10")),
+        token_file=TOKEN_FILE,
+        data_dir=os.path.dirname(OUTBOX_FILE) or ".",
+    )
+
+def _tenant_from_dict(tenant_id: str, data: Dict[str, Any]) -> Tenant:
+    known = set(Tenant.__dataclass_fields__) - {"id"}
+    unknown = set(data) - known
+    if unknown:
+        raise ValueError(f"tenant {tenant_id!r}: chiavi sconosciute {sorted(unknown)}")
+    tenant = Tenant(id=tenant_id, **data)
+    if not tenant.calendar_ids:
+        raise ValueError(f"tenant {tenant_id!r}: calendar_ids mancante")
+    tenant.send_at_minutes  # validates "HH:MM"
+    return tenant
+
+def load_tenants(path: Optional[str] = None) -> List[Tenant]:
+    """Tenants from tenants.toml ($TENANTS_FILE); the default tenant when the file does not exist."""
+    path = path or TENANTS_FILE
+    if not os.path.exists(path):
+        return [default_tenant()]
+    with open(path, "rb") as f:
+        data = tomllib.load(f)
+    tenants = [_tenant_from_dict(tenant_id, values) for tenant_id, values in data.get("tenants", {}).items()]
+    if not tenants:
+        raise ValueError(f"{path}: nessun tenant in [tenants.<id>]")
+    return tenants
@@ -0,0 +1,193 @@
+import os
+import json
+import time
+import threading
+import contextvars
+from collections import deque
+from functools import wraps
+from typing import Dict, Any, List
+
+# Lightweight tracing of the reminder pipeline: span durations, API call counters and cache
+# hit/miss. Off by default; when off every helper is a flag check.
+# Records go to the Collector of the current context: the process one (CLI, TRACING=1) or
+# one per Streamlit session (use()), so sessions sharing the process never see or clear
+# each other's spans. Thread pools get the caller's collector through bound().
+
+class Collector:
+    """The spans, API counters and cache hits of one trace (a CLI run, a Streamlit session)."""
+
+    def __init__(self, maxlen: int = 20000):
+        self.lock = threading.Lock()
+        self.spans: deque = deque(maxlen=maxlen)  # finished spans, oldest dropped first
+        self.counters: Dict[str, int] = {}
+        self.caches: Dict[str, List[int]] = {}    # name -> [hits, misses]
+
+    def reset(self):
+        with self.lock:
+            self.spans.clear()
+            self.counters.clear()
+            self.caches.clear()
+
+_enabled = os.getenv("TRACING") == "1"
+_process = Collector()
+_UNSET = object()
+_current = contextvars.ContextVar("tracing_collector", default=_UNSET)
+
+def enable():
+    """Trace the whole process into the process collector (CLI --trace)."""
+    global _enabled
+    _enabled = True
+
+def disable():
+    global _enabled
+    _enabled = False
+
+def use(collector):
+    """Trace the current context (e.g. one Streamlit session's script run) into `collector`; None: no tracing."""
+    _current.set(collector)
+
+def _collector():
+    collector = _current.get()
+    if collector is _UNSET:
+        return _process if _enabled else None
+    return collector
+
+def bound(fn):
+    """fn running in the caller's tracing context, for a thread pool (asyncio.to_thread already does it)."""
+    context = contextvars.copy_context()
+    # one copy per call: a context cannot be entered by two threads at once
+    return lambda *args, **kwargs: context.copy().run(fn, *args, **kwargs)
+
+def is_enabled() -> bool:
+    return _collector() is not None
+
+def reset():
+    collector = _collector()
+    if collector is not None:
+        collector.reset()
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **attrs):
+        pass
+
+_NOOP = _NoopSpan()
+
+class _Span:
+    __slots__ = ("name", "attrs", "start", "collector")
+
+    def __init__(self, name: str, attrs: Dict[str, Any], collector: Collector):
+        self.name = name
+        self.attrs = attrs
+        self.collector = collector
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        duration = time.perf_counter() - self.start
+        record = {"name": self.name, "ts": time.time() - duration, "duration_ms": round(duration * 1000, 3),
+                  "thread": threading.current_thread().name}
+        if exc_type is not None:
+            record["error"] = exc_type.__name__
+        if self.attrs:
+            record.update(self.attrs)
+        with self.collector.lock:
+            self.collector.spans.append(record)
+        return False
+
+    def set(self, **attrs):
+        """Attach attributes discovered while the span runs (e.g. number of items)."""
+        self.attrs.update(attrs)
+
+def span(name: str, **attrs):
+    """with tracing.span("calendar.fetch", calendars=3): ..."""
+    collector = _collector()
+    if collector is None:
+        return _NOOP
+    return _Span(name, attrs, collector)
+
+def traced(name: str):
+    """Decorator version of span()."""
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            collector = _collector()
+            if collector is None:
+                return fn(*args, **kwargs)
+            with _Span(name, {}, collector):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def count(name: str, n: int = 1):
+    """API call counter, e.g. tracing.count("people.searchContacts")."""
+    collector = _collector()
+    if collector is None:
+        return
+    with collector.lock:
+        collector.counters[name] = collector.counters.get(name, 0) + n
+
+def cache(name: str, hit: bool):
+    collector = _collector()
+    if collector is None:
+        return
+    with collector.lock:
+        stats = collector.caches.setdefault(name, [0, 0])
+        stats[0 if hit else 1] += 1
+
+# ---- reporting ----
+
+def _percentile(ordered: List[float], p: float) -> float:
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, round(p / 100 * (len(ordered) - 1)))]
+
+def snapshot() -> Dict[str, Any]:
+    """Aggregated view: per-span count/total/p50/p95/max, API counters and cache hit rates."""
+    collector = _collector() or _process
+    with collector.lock:
+        spans = list(collector.spans)
+        counters = dict(collector.counters)
+        caches = {k: list(v) for k, v in collector.caches.items()}
+    by_name: Dict[str, List[float]] = {}
+    for s in spans:
+        by_name.setdefault(s["name"], []).append(s["duration_ms"])
+    span_stats = []
+    for name, durations in by_name.items():
+        durations.sort()
+        span_stats.append({
+            "span": name, "count": len(durations), "total_ms": round(sum(durations), 1),
+            "p50_ms": round(_percentile(durations, 50), 1), "p95_ms": round(_percentile(durations, 95), 1),
+            "max_ms": round(durations[-1], 1),
+        })
+    span_stats.sort(key=lambda s: -s["total_ms"])
+    cache_stats = [
+        {"cache": name, "hits": h, "misses": m, "hit_rate": round(h / (h + m), 3) if h + m else None}
+        for name, (h, m) in sorted(caches.items())
+    ]
+    return {"spans": span_stats, "api_calls": counters, "caches": cache_stats}
+
+def to_jsonl() -> str:
+    """Raw spans (one JSON object per line) plus a final summary line, for offline analysis."""
+    collector = _collector() or _process
+    with collector.lock:
+        spans = list(collector.spans)
+    lines = [json.dumps(s, ensure_ascii=False) for s in spans]
+    summary = snapshot()
+    lines.append(json.dumps({"name": "summary", "api_calls": summary["api_calls"], "caches": summary["caches"]}))
+    return "\n".join(lines) + "\n"
+
+def export_jsonl(path: str):
+    d = os.path.dirname(path) or "."
+    os.makedirs(d, exist_ok=True)
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(to_jsonl())
@@ -1,20 +1,224 @@
 import os
+import json
+import threading
+from time import monotonic, sleep
+from concurrent.futures import ThreadPoolExecutor, Executor
+from typing import Optional, Dict, Any, List
+
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+
 from twilio.rest import Client
+from twilio.base.exceptions import TwilioRestException
+from twilio.http.http_client import TwilioHttpClient
+from requests.adapters import HTTPAdapter
+from requests.exceptions import RequestException, ConnectionError as RequestsConnectionError, ConnectTimeout
+from urllib3.exceptions import NewConnectionError
+
+from utils import tracing, quota
 
 TWILIO_ACCOUNT_SID_NEW = os.getenv("TWILIO_ACCOUNT_SID_NEW")
 TWILIO_AUTH_TOKEN_NEW = os.getenv("TWILIO_AUTH_TOKEN_NEW")
 WHATSAPP_PHONE_NUMBER = os.getenv("WHATSAPP_PHONE_NUMBER")
 TEMPLATE_ID = os.getenv("TEMPLATE_ID")
+# public URL of the status callback receiver (utils/status_webhook.py); no delivery tracking if unset
+STATUS_CALLBACK_URL = os.getenv("STATUS_CALLBACK_URL")
+
+# Concurrency / throughput of the batch sender.
+# Twilio queues WhatsApp messages per sender at ~80 MPS by default; keep well below it.
+TWILIO_MAX_WORKERS = int(os.getenv("TWILIO_MAX_WORKERS", "8"))
+TWILIO_MAX_MPS = float(os.getenv("TWILIO_MAX_MPS", "10"))
+
+_clients: Dict[tuple, Client] = {}  # (account sid, auth token) -> Client
+_client_lock = threading.Lock()
+
+class PooledHttpClient(TwilioHttpClient):
+    """
+    TwilioHttpClient with a connection pool sized for the batch sender.
+    It also remembers the last response per thread, so concurrent senders can read
+    the headers (e.g. Retry-After) of their own failed request.
+    """
+
+    def __init__(self, pool_maxsize: int = 10, **kwargs):
+        self._local = threading.local()
+        super().__init__(pool_connections=True, **kwargs)
+        self.session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=pool_maxsize))
+
+    def request(self, *args, **kwargs):
+        self._local.last_response = None
+        response = super().request(*args, **kwargs)
+        self._local.last_response = response
+        return response
+
+    @property
+    def thread_last_response(self):
+        return getattr(self._local, "last_response", None)
+
+def get_twilio_client(account_sid: Optional[str] = None, auth_token: Optional[str] = None) -> Client:
+    """
+    One Client per Twilio account and token for the whole process (default: the account from the env).
+    Keyed on the token too: two tenants with the same SID and different tokens (e.g. API keys)
+    must not share the first one's credentials.
+    Its http client keeps a requests Session, so every message reuses the same pooled
+    HTTPS connections instead of a new TLS handshake.
+    """
+    account_sid = account_sid or TWILIO_ACCOUNT_SID_NEW
+    auth_token = auth_token or TWILIO_AUTH_TOKEN_NEW
+    with _client_lock:
+        client = _clients.get((account_sid, auth_token))
+        if client is None:
+            # pool at least as big as the number of workers sending at the same time
+            http_client = PooledHttpClient(pool_maxsize=max(TWILIO_MAX_WORKERS, 10))
+            client = Client(account_sid, auth_token, http_client=http_client)
+            _clients[(account_sid, auth_token)] = client
+        return client
+
+class RateLimiter:
+    """Spaces calls at least 1/rate seconds apart across threads (simple leaky bucket)."""
 
-def send_twilio_message(to, time):
-    
-    client = Client(TWILIO_ACCOUNT_SID_NEW, TWILIO_AUTH_TOKEN_NEW)
+    def __init__(self, rate_per_sec: float):
+        self.interval = 1.0 / rate_per_sec if rate_per_sec and rate_per_sec > 0 else 0.0
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = monotonic()
+            slot = max(now, self._next)
+            self._next = slot + self.interval
+        delay = slot - now
+        if delay > 0:
+            sleep(delay)
+
+def _parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Retry-After is either a number of seconds or an HTTP date."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
     try:
-        message = client.messages.create(
-        from_=f'whatsapp:{WHATSAPP_PHONE_NUMBER}',
-        content_sid=TEMPLATE_ID,
-        content_variables=f'{{"2":"{time}"}}',
-        to=f'whatsapp:{to}'
-        )
-    except Exception as _:
-        print(f"Number {to} is invalid")
\ No newline at end of file
+        when = parsedate_to_datetime(value)
+        return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+    except Exception:
+        return None
+
+def _retry_after(client: Client) -> Optional[float]:
+    response = getattr(client.http_client, "thread_last_response", None)
+    if response is None or not getattr(response, "headers", None):
+        return None
+    return _parse_retry_after(response.headers.get("Retry-After"))
+
+def _never_sent(e: RequestException) -> bool:
+    """
+    True only for errors raised before the request went out (DNS, connection refused, connect
+    timeout): then Twilio surely has no message and a retry cannot message the patient twice.
+    """
+    if isinstance(e, ConnectTimeout):
+        return True
+    if not isinstance(e, RequestsConnectionError):
+        return False
+    reason = e.args[0] if e.args else None
+    reason = getattr(reason, "reason", reason)  # MaxRetryError wraps the urllib3 error
+    return isinstance(reason, NewConnectionError)
+
+def send_twilio_message(to, time=None, client: Optional[Client] = None, from_number: Optional[str] = None,
+                        template_id: Optional[str] = None, content_variables: Optional[str] = None,
+                        status_callback: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Send one WhatsApp reminder. Never raises: returns
+      {"to", "sid", "status", "error", "http_status", "retryable", "retry_after"}
+    so a single bad number does not stop the batch and callers can decide whether to retry.
+    from_number / template_id default to WHATSAPP_PHONE_NUMBER / TEMPLATE_ID (one practice per env).
+    content_variables is the JSON rendered by utils/messages.py; without it, the classic {"2": time}.
+    status_callback defaults to STATUS_CALLBACK_URL (a scheduler tenant passes its own, see utils/status_webhook.py).
+    """
+    client = client or get_twilio_client()
+    result = {"to": to, "sid": None, "status": "failed", "error": None,
+              "http_status": None, "retryable": False, "retry_after": None}
+    tracing.count("twilio.messages.create")
+    # account-wide budget, on top of the per-sender RateLimiter; retries are the outbox's job
+    budget = quota.bucket(f"twilio:{getattr(client, 'username', None) or TWILIO_ACCOUNT_SID_NEW}")
+    budget.acquire()
+    status_callback = status_callback or STATUS_CALLBACK_URL
+    extra = {"status_callback": status_callback} if status_callback else {}
+    try:
+        with tracing.span("twilio.messages.create"):
+            message = client.messages.create(
+            from_=f'whatsapp:{from_number or WHATSAPP_PHONE_NUMBER}',
+            content_sid=template_id or TEMPLATE_ID,
+            content_variables=content_variables or json.dumps({"2": time}, ensure_ascii=False),
+            to=f'whatsapp:{to}',
+            **extra
+            )
+        budget.succeed()
+    except TwilioRestException as e:
+        # 429 (too many requests) and 5xx are transient, anything else (invalid number, ...) is not
+        result["error"] = e.msg or str(e)
+        result["http_status"] = e.status
+        result["retryable"] = e.status == 429 or (e.status or 0) >= 500
+        if result["retryable"]:
+            result["retry_after"] = _retry_after(client)
+        if e.status in quota.RETRYABLE_STATUS:
+            budget.penalize(e.status, result["retry_after"])
+        print(f"Message to {to} failed ({e.status}): {result['error']}")
+        return result
+    except RequestException as e:
+        # network problem: retried only if the request never left; after a read timeout or a
+        # reset Twilio may have accepted it, so it is failed and checked by hand (like recover_interrupted)
+        if _never_sent(e):
+            result["error"] = str(e)
+            result["retryable"] = True
+        else:
+            result["error"] = f"invio incerto: verificare se il messaggio è arrivato ({e})"
+        print(f"Message to {to} failed (network): {e}")
+        return result
+    except Exception as e:
+        result["error"] = str(e)
+        print(f"Number {to} is invalid: {e}")
+        return result
+    result.update(sid=message.sid, status=message.status)
+    return result
+
+@tracing.traced("twilio.batch")
+def send_twilio_messages(messages: List[Dict[str, Any]], max_workers: int = TWILIO_MAX_WORKERS,
+                         max_mps: float = TWILIO_MAX_MPS, client: Optional[Client] = None,
+                         from_number: Optional[str] = None, template_id: Optional[str] = None,
+                         limiter: Optional[RateLimiter] = None, pool: Optional[Executor] = None,
+                         status_callback: Optional[str] = None) -> List[Dict[str, Any]]:
+    """
+    Send many reminders concurrently over the shared client.
+    messages: [{"to": "+39...", "time": "*11 ottobre* alle ore *15:00*"}, ...], or the payloads of
+    utils/messages.py with their own "content_sid" / "content_variables".
+    Returns one result per message, in the same order.
+    Several practices in one process (utils/scheduler.py) pass their own client / sender /
+    template / status callback, a limiter that lives across batches, and a worker pool shared
+    between them.
+    """
+    if not messages:
+        return []
+    client = client or get_twilio_client()
+    limiter = limiter or RateLimiter(max_mps)
+
+    def _deliver(msg):
+        return send_twilio_message(msg["to"], msg.get("time"), client=client, from_number=from_number,
+                                   template_id=msg.get("content_sid") or template_id,
+                                   content_variables=msg.get("content_variables"), status_callback=status_callback)
+
+    def _send(msg):
+        limiter.wait()
+        return _deliver(msg)
+
+    if pool is not None:
+        # shared pool: pace here, in the caller's thread, and hand over one message at a time,
+        # so the workers never sleep on this sender's limiter while other senders wait behind it
+        futures = []
+        for msg in messages:
+            limiter.wait()
+            futures.append(pool.submit(_deliver, msg))
+        return [f.result() for f in futures]
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(messages)))) as pool:
+        return list(pool.map(_send, messages))